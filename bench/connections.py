@@ -0,0 +1,77 @@
+"""Idle connection benchmark: python bench/connections.py [count [mode ...]]"""
+import http.client
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def benchmark_connections(modes=('threading', 'gevent', 'eventlet'), count=500):
+    """Hold count idle Socket.IO connections against a server in each mode and report its memory.
+
+    Each connection is a long-poll request the server keeps open, as a
+    quiet student's would be. Memory and thread counts come from /proc, so
+    this runs on Linux only."""
+    def server_status(pid):
+        fields = {}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                fields[key] = value.split()[0] if value.split() else ''
+        return int(fields['VmRSS']) / 1024, int(fields['Threads'])
+
+    def connect(port):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        conn.request('GET', '/socket.io/?EIO=4&transport=polling')
+        sid = json.loads(conn.getresponse().read().decode()[1:])['sid']
+        path = f"/socket.io/?EIO=4&transport=polling&sid={sid}"
+        conn.request('POST', path, body='40')
+        conn.getresponse().read()
+        conn.request('GET', path)  # The connect acknowledgement
+        conn.getresponse().read()
+        conn.request('GET', path)  # Left open: the server holds it until it has something to send
+        return conn
+
+    for port, mode in enumerate(modes, start=5600):
+        if mode != 'threading' and importlib.util.find_spec(mode) is None:
+            print(f"{mode:>10}: not installed")
+            continue
+        env = dict(os.environ, ASYNC_MODE=mode, PORT=str(port))
+        with tempfile.TemporaryDirectory() as tmp:
+            server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'edu.py')], cwd=tmp, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            conns = []
+            try:
+                for _ in range(100):
+                    try:
+                        probe = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+                        probe.request('GET', '/health')
+                        probe.getresponse().read()
+                        probe.close()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+                before, _ = server_status(server.pid)
+                for _ in range(count):
+                    try:
+                        conns.append(connect(port))
+                    except (OSError, http.client.HTTPException, ValueError):
+                        break
+                time.sleep(0.5)
+                after, threads = server_status(server.pid)
+                print(f"{mode:>10}: {len(conns)}/{count} idle connections, "
+                      f"RSS {before:.1f} -> {after:.1f} MB "
+                      f"({(after - before) * 1024 / max(len(conns), 1):.1f} KB each), {threads} threads")
+            finally:
+                for conn in conns:
+                    conn.close()
+                server.terminate()
+                server.wait()
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    benchmark_connections(sys.argv[2:] or ('threading', 'gevent', 'eventlet'), count)
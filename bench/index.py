@@ -0,0 +1,46 @@
+"""Index page benchmark: python bench/index.py [requests]"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import HTML_TEMPLATE, STATIC_DIR, STATIC_FILES, app, static_assets, static_urls
+from flask import render_template_string
+
+def benchmark_index(requests=2000):
+    """Server-side time to answer GET / by rendering per request, from the cache, and as a 304"""
+    client = app.test_client()
+
+    def timed(**headers):
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get('/', headers=headers)
+        return (time.perf_counter() - start) / requests, response
+
+    def render_per_request():
+        with app.test_request_context('/'):
+            return render_template_string(HTML_TEMPLATE, asset_url=static_urls.__getitem__)
+
+    start = time.perf_counter()
+    for _ in range(requests // 10):
+        page = render_per_request()
+    render_time = (time.perf_counter() - start) / (requests // 10)
+    plain_time, plain = timed()
+    gzip_time, gzipped = timed(**{'Accept-Encoding': 'gzip'})
+    br_time, compressed = timed(**{'Accept-Encoding': 'gzip, deflate, br'})
+    cached_time, cached = timed(**{'Accept-Encoding': 'gzip, deflate, br', 'If-None-Match': compressed.headers['ETag']})
+    print(f"{'render per request':>20}: {render_time * 1e6:8.1f}us  {len(page.encode()):>7} bytes")
+    for name, elapsed, response in (('cached', plain_time, plain), ('cached gzip', gzip_time, gzipped),
+                                    ('cached br', br_time, compressed), ('revalidated', cached_time, cached)):
+        print(f"{name:>20}: {elapsed * 1e6:8.1f}us  {len(response.data):>7} bytes  {response.status}")
+
+    # First visits download each asset once in the best encoding; repeat visits send no requests for them
+    for name in STATIC_FILES:
+        asset = static_assets[static_urls[name].rsplit('/', 1)[1]]
+        source = os.path.getsize(os.path.join(STATIC_DIR, name))
+        sizes = '  '.join(f"{encoding or 'minified'} {len(body):>6}" for encoding, (body, _) in asset.encoded.items())
+        print(f"{name:>20}: source {source:>6}  {sizes} bytes")
+
+if __name__ == '__main__':
+    benchmark_index(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
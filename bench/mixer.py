@@ -0,0 +1,50 @@
+"""Mixer CPU benchmark: python bench/mixer.py [speakers ...]"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import (AUDIO_CODEC_OPUS, AUDIO_FRAME_HEADER, MIX_BITRATE, MIX_FRAME_MS, MIX_FRAME_SAMPLES,
+                 MIX_SAMPLE_RATE, AudioMixer, np, opuslib)
+
+def opus_frames(count=64):
+    """count audio_frame payloads of 20 ms of noise, encoded the way the page sends them"""
+    rng = np.random.default_rng(0)
+    encoder = opuslib.Encoder(MIX_SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+    encoder.bitrate = MIX_BITRATE
+    header = AUDIO_FRAME_HEADER.pack(1, AUDIO_CODEC_OPUS, 1, 0, 0)
+    return [header + encoder.encode(rng.integers(-8000, 8000, MIX_FRAME_SAMPLES, dtype='<i2').tobytes(),
+                                    MIX_FRAME_SAMPLES)
+            for _ in range(count)]
+
+def benchmark_mixer(speakers=(1, 2, 4, 8, 16), ticks=500):
+    """Time AudioMixer.push and mix, Opus decoding and encoding included, and the bandwidth a listener needs"""
+    frames = opus_frames()
+    budget = MIX_FRAME_MS * 1000
+    for count in speakers:
+        mixer = AudioMixer()
+        elapsed = 0.0
+        sent = 0
+        for tick in range(ticks):
+            start = time.perf_counter()
+            for speaker in range(count):
+                # What the audio_frame handlers do between two ticks: decode each speaker's frame
+                mixer.push(speaker, frames[(tick + speaker) % len(frames)])
+                if tick == 0:
+                    mixer.push(speaker, frames[speaker % len(frames)])
+            mixed = mixer.mix()
+            elapsed += time.perf_counter() - start
+            sent += len(mixed[0]) if mixed is not None else 0
+        per_tick = elapsed / ticks * 1e6
+        # Relayed unmixed, a listener receives every speaker's Opus stream (24 kbit/s from the page)
+        mixed_kbps = sent * 8 / (ticks * MIX_FRAME_MS)
+        print(f"{count:3d} speakers: {per_tick:8.1f}us per tick, {per_tick / count:6.1f}us per speaker, "
+              f"{per_tick / budget * 100:5.2f}% of a {MIX_FRAME_MS} ms frame; "
+              f"{mixed_kbps:5.1f} kbit/s per listener vs {24 * count} unmixed")
+
+if __name__ == '__main__':
+    if np is None or opuslib is None:
+        print("bench/mixer.py needs NumPy and opuslib")
+        sys.exit(1)
+    benchmark_mixer([int(s) for s in sys.argv[1:]] or (1, 2, 4, 8, 16))
@@ -0,0 +1,39 @@
+"""Stroke simplification benchmark: python bench/simplify.py [session.jsonl]"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import StrokeStore
+from whiteboard import synthetic_session
+
+def benchmark_simplify(path=None, tolerances=(0.25, 0.5, 0.75, 1.0, 2.0)):
+    """Report how much stroke simplification shrinks stored and replayed history.
+
+    path is a recorded session, one whiteboard_draw payload per line as JSON;
+    without it a synthetic session is used."""
+    if path:
+        with open(path, 'r') as f:
+            ops = [json.loads(line) for line in f if line.strip()]
+    else:
+        ops = synthetic_session()
+    print(f"{'tolerance':>9} {'points':>10} {'kept':>10} {'ratio':>7} {'replay KB':>10} {'ms/stroke':>10}")
+    for tolerance in (0,) + tuple(tolerances):
+        store = StrokeStore(max_points=10 ** 9, simplify_px=0)
+        for op in ops:
+            store.append(dict(op))
+        raw = store.points
+        start = time.perf_counter()
+        if tolerance:
+            for stroke in store._strokes:
+                if stroke.style[0] in ('pen', 'eraser'):
+                    store.points -= stroke.simplify(tolerance)
+        elapsed = time.perf_counter() - start
+        replay = len(json.dumps(store.since(0)[0]))
+        print(f"{tolerance:>9} {raw:>10} {store.points:>10} {raw / store.points:>6.1f}x "
+              f"{replay / 1024:>10.0f} {elapsed * 1000 / max(len(store), 1):>10.3f}")
+
+if __name__ == '__main__':
+    benchmark_simplify(sys.argv[1] if len(sys.argv) > 1 else None)
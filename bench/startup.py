@@ -0,0 +1,59 @@
+"""Cold start benchmark: python bench/startup.py [size ...]"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import edu
+
+def benchmark_startup(sizes=(1000, 10000, 100000)):
+    """Compare cold start of the old exec()-based sads.py loader with the database"""
+    saved_db, saved_file = edu.user_db, edu.USER_DB_FILE
+    print(f"{'students':>10} {'exec sads.py':>14} {'open db':>10} {'first lookup':>14}")
+    try:
+        for size in sizes:
+            roster = {
+                f"student{i}": {
+                    'name': f"Student {i}",
+                    'phone': f"07{i:09d}",
+                    'join_time': '2024-01-01 09:00:00',
+                    'total_sessions': 1
+                }
+                for i in range(size)
+            }
+            with tempfile.TemporaryDirectory() as tmp:
+                legacy_path = os.path.join(tmp, 'sads.py')
+                with open(legacy_path, 'w') as f:
+                    f.write(f"user_data = {repr(roster)}\n")
+
+                start = time.perf_counter()
+                namespace = {}
+                with open(legacy_path, 'r') as f:
+                    exec(f.read(), namespace)
+                exec_time = time.perf_counter() - start
+
+                edu.user_db, edu.USER_DB_FILE = None, os.path.join(tmp, 'students.db')
+                edu.import_legacy_user_data(legacy_path)
+                edu.user_db.close()
+                edu.user_db = None
+                edu.user_data.clear()
+
+                start = time.perf_counter()
+                edu.load_user_data()
+                open_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                edu.get_user_record(f"student{size // 2}")
+                lookup_time = time.perf_counter() - start
+
+                edu.user_db.close()
+                edu.user_db = None
+                edu.user_data.clear()
+            print(f"{size:>10} {exec_time * 1000:>12.1f}ms {open_time * 1000:>8.1f}ms {lookup_time * 1000:>12.2f}ms")
+    finally:
+        edu.user_db, edu.USER_DB_FILE = saved_db, saved_file
+
+if __name__ == '__main__':
+    benchmark_startup([int(s) for s in sys.argv[1:]] or (1000, 10000, 100000))
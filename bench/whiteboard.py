@@ -0,0 +1,83 @@
+"""Whiteboard memory benchmark: python bench/whiteboard.py [operations]"""
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import WHITEBOARD_PAGE_BYTES, HistoryStream, StrokeStore
+
+def synthetic_session(points=100000, seed=1):
+    """Whiteboard operations as the page sends them: wavy pen strokes and some shapes"""
+    rng = random.Random(seed)
+    ops = []
+    while len(ops) < points:
+        color = rng.choice(('#ffffff', '#ff0000', '#00ff00', '#ffff00'))
+        size = rng.choice((2, 3, 5))
+        x, y = rng.uniform(0, 1200), rng.uniform(0, 700)
+        if rng.random() < 0.1:
+            ops.append({'tool': rng.choice(('line', 'rect', 'circle')), 'color': color, 'size': size,
+                        'startX': x, 'startY': y, 'endX': x + rng.uniform(-200, 200),
+                        'endY': y + rng.uniform(-200, 200), 'type': 'draw'})
+            continue
+        tool = 'eraser' if rng.random() < 0.05 else 'pen'
+        if tool == 'eraser':
+            color = '#2a2a2a'
+        ops.append({'tool': tool, 'color': color, 'size': size, 'startX': x, 'startY': y,
+                    'endX': x, 'endY': y, 'type': 'start'})
+        heading = rng.uniform(0, 2 * math.pi)
+        for _ in range(rng.randint(20, 200)):
+            heading += rng.uniform(-0.15, 0.15)
+            nx, ny = x + 3 * math.cos(heading), y + 3 * math.sin(heading)
+            ops.append({'tool': tool, 'color': color, 'size': size, 'startX': x, 'startY': y,
+                        'endX': nx, 'endY': ny, 'type': 'draw'})
+            x, y = nx, ny
+    return ops[:points]
+
+def benchmark_whiteboard(points=100000):
+    """Compare memory of the old list of op dicts with StrokeStore"""
+    ops = synthetic_session(points)
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used, kept
+
+    # Each op as the old handler kept it: a fresh dict decoded from JSON
+    dict_bytes, _ = measure(lambda: [json.loads(json.dumps(op)) for op in ops])
+    store = StrokeStore(max_points=len(ops) * 2, simplify_px=0)
+
+    def fill():
+        for op in ops:
+            store.append(json.loads(json.dumps(op)))
+        return store
+
+    store_bytes, _ = measure(fill)
+    print(f"{len(ops)} operations, {store.points} points in {len(store)} strokes")
+    print(f"list of dicts: {dict_bytes / len(ops):8.1f} bytes/op")
+    print(f"StrokeStore:   {store_bytes / store.points:8.1f} bytes/point "
+          f"({dict_bytes / max(store_bytes, 1):.1f}x smaller)")
+
+    # Late-join history: every stroke re-encoded vs the pre-encoded checkpoint plus tail
+    start = time.perf_counter()
+    json.dumps(store.since(0)[0])
+    full_time = time.perf_counter() - start
+    store.compact()
+    start = time.perf_counter()
+    stream = HistoryStream(*store.history())
+    pages = 1
+    while not stream.next_page()['last']:
+        pages += 1
+    checkpoint_time = time.perf_counter() - start
+    print(f"join history:  {full_time * 1000:8.1f}ms re-encoded, {checkpoint_time * 1000:.1f}ms "
+          f"from checkpoint in {pages} pages of {WHITEBOARD_PAGE_BYTES // 1024} KB")
+
+if __name__ == '__main__':
+    benchmark_whiteboard(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -1,1386 +1,2270 @@
+import os
+
+# Server mode: 'threading' (the default) runs the Werkzeug development server
+# with one OS thread per connection; 'gevent' or 'eventlet' hold thousands of
+# idle connections on green threads. Both patch the standard library, which
+# has to happen before anything else is imported.
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
 from flask import Flask, render_template_string, request, jsonify, session, redirect, url_for
 from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
 import uuid
 import json
-import os
+import math
 from datetime import datetime
+from collections import OrderedDict, deque
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
 import threading
+import queue
 import time
 import base64
+import functools
+import gzip
+import hashlib
+import re
+import ast
+import atexit
+import signal
+import sqlite3
+import struct
+import sys
 
-app = Flask(__name__)
+try:
+    import numpy as np
+except ImportError:  # Only needed for server-side audio mixing
+    np = None
+
+try:
+    import opuslib
+except Exception:  # Only needed for mixing; raises more than ImportError when libopus is missing
+    opuslib = None
+
+try:
+    import brotli
+except ImportError:  # Pages are still served gzipped
+    brotli = None
+
+app = Flask(__name__, static_folder=None)  # Static files are served fingerprinted from /static/
 app.config['SECRET_KEY'] = 'smart_board_secret_key_2024'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', logger=False, engineio_logger=False)
+# Cluster mode: workers behind sticky sessions share a Redis-compatible server
+# (MESSAGE_QUEUE=redis://host:6379, needs the redis package) for broadcasts
+# and room ownership; `python tools/broker.py` runs a stand-in on one box
+MESSAGE_QUEUE = os.environ.get('MESSAGE_QUEUE')
+WORKER_ID = os.environ.get('WORKER_ID') or uuid.uuid4().hex[:8]
+ROOM_LEASE_SECONDS = 30  # A room whose owner stops renewing this is free to claim
 
-# Global variables for session management
-active_users = {}
-raised_hands = []
-lecture_active = False
-teacher_id = None
-user_data = {}
-whiteboard_state = []  # Store all drawing operations
+class MeteredSocketIO(SocketIO):
+    """SocketIO that records every emit, from handlers or background tasks, in metrics"""
 
-# File to store user data
-USER_DATA_FILE = 'sads.py'
+    def emit(self, event, *args, **kwargs):
+        metrics.emitted(event, args, kwargs.get('to') or kwargs.get('room'), kwargs.get('skip_sid'),
+                        kwargs.get('namespace') or '/')
+        return super().emit(event, *args, **kwargs)
+
+# async_handlers=False runs one client's events in the order they arrive, rather than each
+# on its own thread; a stroke's chunks and a speaker's audio frames rely on that
+socketio = MeteredSocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, logger=False, engineio_logger=False,
+                    message_queue=MESSAGE_QUEUE, channel='edugrh', async_handlers=False)
+
+DEFAULT_ROOM = 'lecture_room'
+# Lecture IDs come from clients; '/' and ':' are kept out so names built from them can't collide
+ROOM_ID_PATTERN = re.compile(r'[^/:\x00-\x1f]{1,64}')
+STROKE_CHUNK_MAX_POINTS = 2000  # Upper bound on points in one whiteboard_draw chunk
+# Finished pen strokes are simplified to within this many pixels; 0 keeps every point
+WHITEBOARD_SIMPLIFY_PX = float(os.environ.get('WHITEBOARD_SIMPLIFY_PX', 0.75))
+# How often finished strokes are folded into each room's checkpoint
+WHITEBOARD_CHECKPOINT_SECONDS = float(os.environ.get('WHITEBOARD_CHECKPOINT_SECONDS', 5))
+# Whiteboard history is sent to joining clients in pages of about this many bytes
+WHITEBOARD_PAGE_BYTES = int(os.environ.get('WHITEBOARD_PAGE_BYTES', 64 * 1024))
+WHITEBOARD_BACKGROUND = '#2a2a2a'  # What the eraser paints: the canvas colour in app.css
+# Compaction finds strokes hidden under later ones on a grid of this many pixels
+WHITEBOARD_CELL_PX = float(os.environ.get('WHITEBOARD_CELL_PX', 2))
+# Strokes wider than this or reaching further from the origin are never dropped
+WHITEBOARD_MAX_REASONED_SIZE = 64
+WHITEBOARD_EXTENT = 16384
+# Binary whiteboard chunks (opt-in per client): a 16-byte header, then x, y
+# pairs as little-endian int16 in quarter pixels
+WB_HEADER = struct.Struct('<BBBB3sxII')  # version, flags, tool, size, rgb, stroke, seq
+WB_VERSION = 1
+WB_FLAG_END = 1
+WB_TOOLS = ('pen', 'eraser', 'line', 'rect', 'circle')
+WB_COORD_SCALE = 4
+AUDIO_MAX_BYTES = 512 * 1024  # Largest audio chunk relayed
+# Streaming audio frames: version, codec, stream, a reserved byte, seq, timestamp (ms), payload.
+# A sender starts a new stream (mod 256) whenever seq and timestamp restart from 0
+AUDIO_FRAME_HEADER = struct.Struct('<BBBxII')
+AUDIO_FRAME_MAX_BYTES = 8192
+AUDIO_CODEC_PCM16 = 0  # 16 kHz mono little-endian int16
+AUDIO_CODEC_OPUS = 1
+# Mix speakers on the server so each listener receives one Opus stream
+# (AUDIO_MIX=1, needs NumPy and opuslib with libopus). A listener then
+# downloads MIX_BITRATE whatever the number of speakers, instead of about
+# 24 kbit/s per speaker; raw PCM16 would be 256 kbit/s, so there is no
+# mixing without Opus. Browsers without an Opus decoder still get the mix
+# as PCM16
+AUDIO_MIX = os.environ.get('AUDIO_MIX', '0') == '1'
+MIX_SAMPLE_RATE = 16000
+MIX_BITRATE = 24000
+MIX_FRAME_MS = 20
+MIX_FRAME_SAMPLES = MIX_SAMPLE_RATE * MIX_FRAME_MS // 1000
+MIX_PACKET_MAX_SAMPLES = MIX_SAMPLE_RATE * 120 // 1000  # Longest Opus packet
+MIX_PRIME_FRAMES = 2  # Frames buffered per speaker before they are mixed in
+MIX_MAX_FRAMES = 10  # Beyond this a speaker's oldest frames are dropped
+# Audio is fanned out by its own workers, each with a bounded queue of emits
+AUDIO_WORKERS = int(os.environ.get('AUDIO_WORKERS', 2))
+AUDIO_QUEUE_DEPTH = int(os.environ.get('AUDIO_QUEUE_DEPTH', 256))
+# A connection with more than this waiting to be sent is congested; one
+# congested for SLOW_CLIENT_SECONDS is disconnected
+SEND_QUEUE_MAX_MESSAGES = int(os.environ.get('SEND_QUEUE_MAX_MESSAGES', 500))
+SEND_QUEUE_MAX_BYTES = int(os.environ.get('SEND_QUEUE_MAX_BYTES', 1024 * 1024))
+SLOW_CLIENT_SECONDS = float(os.environ.get('SLOW_CLIENT_SECONDS', 10))
+SEND_CHECK_SECONDS = 0.5
+# Histogram buckets for /metrics: handler time in seconds, and recipients per emit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# Payloads other than text and binary are JSON-sized on one call in this many per event
+METRICS_SIZE_SAMPLE = max(int(os.environ.get('METRICS_SIZE_SAMPLE', 16)), 1)
+PRESENCE_TICK = 1 / float(os.environ.get('PRESENCE_TICK_HZ', 10))
+WHITEBOARD_MAX_POINTS = int(os.environ.get('WHITEBOARD_MAX_POINTS', 1000000))
+
+class HandQueue:
+    """Raised hands in the order they went up, keyed by sid"""
+
+    def __init__(self):
+        self._hands = OrderedDict()
+
+    def __len__(self):
+        return len(self._hands)
+
+    def __contains__(self, user_id):
+        return user_id in self._hands
+
+    def raise_hand(self, user_id, name):
+        """Queue a hand; raising it again keeps its place"""
+        if user_id not in self._hands:
+            self._hands[user_id] = {
+                'id': user_id,
+                'name': name,
+                'raised_at': int(time.time() * 1000)
+            }
+
+    def lower(self, user_id):
+        """Drop a hand from the queue; returns False if it was not raised"""
+        return self._hands.pop(user_id, None) is not None
+
+    remove = lower
+
+    def pop_next(self):
+        """Take the longest-waiting hand, or None"""
+        if not self._hands:
+            return None
+        return self._hands.popitem(last=False)[1]
+
+    def entries(self):
+        return list(self._hands.values())
+
+def simplify_path(points, tolerance):
+    """Ramer-Douglas-Peucker over a flat [x0, y0, x1, y1, ...] sequence.
+
+    Returns the indices of the points to keep, first and last always included."""
+    count = len(points) // 2
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[2 * first], points[2 * first + 1]
+        x2, y2 = points[2 * last], points[2 * last + 1]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        farthest, farthest_sq = -1, tolerance_sq
+        for i in range(first + 1, last):
+            px, py = points[2 * i] - x1, points[2 * i + 1] - y1
+            if length_sq:
+                cross = px * dy - py * dx
+                distance_sq = cross * cross / length_sq
+            else:
+                distance_sq = px * px + py * py
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = i, distance_sq
+        if farthest != -1:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [i for i, kept in enumerate(keep) if kept]
+
+class Stroke:
+    """One pen/eraser path or shape with its points packed in a float array.
+
+    seq_ends[i] is the number of points after operation first_seq + i, so an
+    operation's points can be found without keeping the operation itself."""
+
+    __slots__ = ('style', 'stroke_id', 'first_seq', 'points', 'seq_ends')
+
+    def __init__(self, style, first_seq, coords, stroke_id=None):
+        self.style = style  # Interned (tool, color, size) tuple
+        self.stroke_id = stroke_id  # Client's ID for chunked strokes
+        self.first_seq = first_seq
+        self.points = array('f', coords)
+        self.seq_ends = array('I', [len(coords) // 2])
+
+    @property
+    def last_seq(self):
+        return self.first_seq + len(self.seq_ends) - 1
+
+    def __len__(self):
+        return len(self.points) // 2
+
+    def extend(self, coords):
+        self.points.extend(coords)
+        self.seq_ends.append(len(self.points) // 2)
+
+    def simplify(self, tolerance):
+        """Drop points within tolerance of the path; returns how many were removed"""
+        before = len(self)
+        kept = simplify_path(self.points, tolerance)
+        if len(kept) == before:
+            return 0
+        points = self.points
+        self.points = array('f', [v for i in kept for v in (points[2 * i], points[2 * i + 1])])
+        # Each operation now ends after the kept points that came before its end
+        self.seq_ends = array('I', [max(bisect_left(kept, end), 1) for end in self.seq_ends])
+        return before - len(kept)
+
+    def record(self, after_seq=0):
+        """Stroke as sent to clients, limited to operations after after_seq"""
+        tool, color, size = self.style
+        points = self.points
+        if after_seq >= self.first_seq:
+            # Resume from the last point the client already has so the path joins up
+            start = self.seq_ends[after_seq - self.first_seq] - 1
+            points = points[start * 2:]
+        return {
+            'stroke': self.stroke_id,
+            'tool': tool,
+            'color': color,
+            'size': size,
+            # float32 noise would bloat the JSON; a tenth of a pixel is plenty
+            'points': [round(v, 1) for v in points],
+            'seq': self.last_seq
+        }
+
+OPAQUE_COLOR = re.compile(r'#[0-9a-fA-F]{6}')
+HALF_CELL_DIAGONAL = math.sqrt(0.5)  # Centre-to-corner distance of a unit grid cell
 
-def save_user_data():
-    """Save user data to sads.py file"""
+def stroke_bounds(stroke):
+    """(left, top, right, bottom) around everything a stroke can ink, or None
+    if it is malformed or outside what compaction reasons about"""
+    tool, _, size = stroke.style
     try:
-        with open(USER_DATA_FILE, 'w') as f:
-            f.write("# Student Database - Generated automatically\n")
-            f.write("# Format: {'username': {'name': 'Name', 'phone': 'Phone', 'join_time': 'Time'}}\n\n")
-            f.write("student_data = {\n")
-            for username, data in user_data.items():
-                f.write(f"    '{username}': {{\n")
-                f.write(f"        'name': '{data.get('name', '')}',\n")
-                f.write(f"        'phone': '{data.get('phone', '')}',\n")
-                f.write(f"        'join_time': '{data.get('join_time', '')}',\n")
-                f.write(f"        'total_sessions': {data.get('total_sessions', 1)}\n")
-                f.write("    },\n")
-            f.write("}\n\n")
-            f.write(f"# Total students: {len(user_data)}\n")
-            f.write(f"# Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-    except Exception as e:
-        print(f"Error saving user data: {e}")
+        half = float(size) / 2 + 1  # A pixel of antialiasing either side
+    except (TypeError, ValueError):
+        return None
+    points = stroke.points
+    if not 1 < half <= WHITEBOARD_MAX_REASONED_SIZE / 2 + 1 or not math.isfinite(sum(points)):
+        return None
+    if tool in ('line', 'rect', 'circle'):
+        if len(points) < 4:
+            return None
+        if tool == 'circle':
+            radius = math.hypot(points[2] - points[0], points[3] - points[1])
+            points = (points[0] - radius, points[1] - radius, points[0] + radius, points[1] + radius)
+    elif len(points) < 2:
+        return None
+    left, top, right, bottom = min(points[0::2]), min(points[1::2]), max(points[0::2]), max(points[1::2])
+    if left < -WHITEBOARD_EXTENT or top < -WHITEBOARD_EXTENT or right > WHITEBOARD_EXTENT or bottom > WHITEBOARD_EXTENT:
+        return None
+    return left - half, top - half, right + half, bottom + half
 
-def load_user_data():
-    """Load user data from sads.py file if exists"""
-    global user_data
+def stroke_outline(stroke, cell=WHITEBOARD_CELL_PX):
+    """A stroke's path as (x1, y1, x2, y2) segments and the half width of the
+    ink around them; circles become polygons close enough to be within a cell.
+    Only meaningful for strokes stroke_bounds accepts."""
+    tool, _, size = stroke.style
+    half = float(size) / 2
+    p = stroke.points
+    if tool == 'line':
+        return [(p[0], p[1], p[2], p[3])], half
+    if tool == 'rect':
+        x1, y1, x2, y2 = p[:4]
+        return [(x1, y1, x2, y1), (x2, y1, x2, y2), (x2, y2, x1, y2), (x1, y2, x1, y1)], half
+    if tool == 'circle':
+        radius = math.hypot(p[2] - p[0], p[3] - p[1])
+        sides = min(max(int(2 * math.pi * radius / cell), 8), 4096)
+        corners = [(p[0] + radius * math.cos(2 * math.pi * i / sides), p[1] + radius * math.sin(2 * math.pi * i / sides))
+                   for i in range(sides + 1)]
+        # The arc bulges past each side by at most the sagitta
+        return [a + b for a, b in zip(corners, corners[1:])], half + radius * (1 - math.cos(math.pi / sides))
+    if len(p) == 2:
+        return [(p[0], p[1], p[0], p[1])], half
+    return [(p[i], p[i + 1], p[i + 2], p[i + 3]) for i in range(0, len(p) - 2, 2)], half
+
+def _solve(a, b, low, high):
+    """The x with low <= a * x + b <= high, as (first, last), or None"""
+    if not a:
+        return (-math.inf, math.inf) if low <= b <= high else None
+    first, last = (low - b) / a, (high - b) / a
+    return (first, last) if a > 0 else (last, first)
+
+def segment_cells(segments, reach, cell):
+    """Yield (row, first column, last column) runs of the grid cells whose
+    centres are within reach of one of the segments, one per row of each
+    segment; runs of neighbouring segments overlap"""
+    reach_sq = reach * reach
+    for x1, y1, x2, y2 in segments:
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        for row in range(math.ceil((min(y1, y2) - reach) / cell - 0.5),
+                         math.floor((max(y1, y2) + reach) / cell - 0.5) + 1):
+            y = (row + 0.5) * cell
+            # A capsule cut by a row is one run: the union of its two end
+            # discs and the band along the segment
+            first, last = math.inf, -math.inf
+            for px, py in ((x1, y1), (x2, y2)):
+                gap = reach_sq - (y - py) * (y - py)
+                if gap >= 0:
+                    half = math.sqrt(gap)
+                    first, last = min(first, px - half), max(last, px + half)
+            if length:
+                along = _solve(dx, (y - y1) * dy - x1 * dx, 0, length * length)
+                across = _solve(dy, -x1 * dy - (y - y1) * dx, -reach * length, reach * length)
+                if along and across:
+                    start, end = max(along[0], across[0]), min(along[1], across[1])
+                    if start <= end:
+                        first, last = min(first, start), max(last, end)
+            if first > last:
+                continue
+            first, last = math.ceil(first / cell - 0.5), math.floor(last / cell - 0.5)
+            if first <= last:
+                yield row, first, last
+
+class CellRuns:
+    """A set of grid cells kept as sorted, merged runs of columns per row"""
+
+    __slots__ = ('rows',)
+
+    def __init__(self, runs=()):
+        self.rows = {}
+        for run in runs:
+            self.add(*run)
+
+    def __bool__(self):
+        return bool(self.rows)
+
+    def add(self, row, first, last):
+        runs = self.rows.setdefault(row, [])
+        start = bisect_left(runs, (first,))
+        if start and runs[start - 1][1] >= first - 1:
+            start -= 1
+            first, last = runs[start][0], max(last, runs[start][1])
+        end = start
+        while end < len(runs) and runs[end][0] <= last + 1:
+            last = max(last, runs[end][1])
+            end += 1
+        runs[start:end] = [(first, last)]
+
+    def covers(self, row, first, last):
+        """Whether every cell of the run is in the set"""
+        runs = self.rows.get(row)
+        if not runs:
+            return False
+        i = bisect_right(runs, (first, math.inf)) - 1
+        return i >= 0 and runs[i][1] >= last
+
+    def touches(self, row, first, last):
+        """Whether any cell of the run is in the set"""
+        runs = self.rows.get(row)
+        if not runs:
+            return False
+        i = bisect_right(runs, (last, math.inf)) - 1
+        return i >= 0 and runs[i][1] >= first
+
+def ink_cells(outline, cell=WHITEBOARD_CELL_PX):
+    """Cells a stroke might put any ink in, antialiasing included"""
+    segments, half = outline
+    return segment_cells(segments, half + cell * HALF_CELL_DIAGONAL + 1, cell)
+
+def cover_reach(stroke, cell=WHITEBOARD_CELL_PX):
+    """How far from its path an opaque pen or eraser stroke paints whole cells
+    over, or 0 for strokes that cover none"""
+    tool, color, size = stroke.style
+    if tool not in ('pen', 'eraser') or not isinstance(color, str) or not OPAQUE_COLOR.fullmatch(color):
+        return 0
     try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r') as f:
-                content = f.read()
-                local_vars = {}
-                exec(content, {}, local_vars)
-                if 'student_data' in local_vars:
-                    user_data = local_vars['student_data']
-    except Exception as e:
-        print(f"Error loading user data: {e}")
+        return max(float(size) / 2 - cell * HALF_CELL_DIAGONAL - 1, 0)
+    except (TypeError, ValueError):
+        return 0
 
-# Load existing user data on startup
-load_user_data()
+def cover_cells(stroke, outline, cell=WHITEBOARD_CELL_PX):
+    """Cells an opaque pen or eraser stroke paints over completely.
 
-# HTML Template with all features FIXED
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Smart Board - Online Teaching Platform</title>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.2/socket.io.js"></script>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Arial', sans-serif;
-            background: linear-gradient(135deg, #1e1e1e 0%, #2d2d2d 100%);
-            color: #ffffff;
-            overflow: hidden;
-            height: 100vh;
-        }
-        
-        .container {
-            display: flex;
-            height: 100vh;
-            flex-direction: column;
-        }
-        
-        .header {
-            background: #1a1a1a;
-            padding: 10px 20px;
-            border-bottom: 2px solid #333;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            flex-wrap: wrap;
-            gap: 10px;
-        }
-        
-        .logo {
-            font-size: 24px;
-            font-weight: bold;
-            color: #4CAF50;
-        }
-        
-        .controls {
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-            align-items: center;
-        }
-        
-        .btn {
-            padding: 8px 16px;
-            border: none;
-            border-radius: 25px;
-            cursor: pointer;
-            font-weight: bold;
-            transition: all 0.3s;
-            font-size: 14px;
-        }
-        
-        .btn-primary {
-            background: #4CAF50;
-            color: white;
-        }
-        
-        .btn-danger {
-            background: #f44336;
-            color: white;
-        }
-        
-        .btn-warning {
-            background: #ff9800;
-            color: white;
-        }
-        
-        .btn:hover {
-            transform: scale(1.05);
-            opacity: 0.9;
-        }
-        
-        .btn:disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-            transform: none;
-        }
-        
-        .main-content {
-            display: flex;
-            flex: 1;
-            overflow: hidden;
-        }
-        
-        .whiteboard-container {
-            flex: 1;
-            display: flex;
-            flex-direction: column;
-            background: #2d2d2d;
-        }
-        
-        .toolbar {
-            background: #1a1a1a;
-            padding: 10px;
-            display: flex;
-            gap: 10px;
-            align-items: center;
-            flex-wrap: wrap;
-            border-bottom: 1px solid #333;
-        }
-        
-        .tool-group {
-            display: flex;
-            gap: 5px;
-            align-items: center;
-        }
-        
-        .whiteboard {
-            flex: 1;
-            background: #2a2a2a;  /* DARK MODE WHITEBOARD */
-            cursor: crosshair;
-            position: relative;
-            border: 2px solid #444;
-        }
-        
-        .sidebar {
-            width: 300px;
-            background: #1a1a1a;
-            border-left: 2px solid #333;
-            display: flex;
-            flex-direction: column;
-            overflow: hidden;
-        }
-        
-        .sidebar-tabs {
-            display: flex;
-            border-bottom: 1px solid #333;
-        }
-        
-        .tab {
-            flex: 1;
-            padding: 10px;
-            text-align: center;
-            cursor: pointer;
-            background: #2d2d2d;
-            border-right: 1px solid #333;
-            transition: all 0.3s;
-        }
-        
-        .tab.active {
-            background: #4CAF50;
-            color: white;
-        }
-        
-        .tab-content {
-            flex: 1;
-            padding: 15px;
-            overflow-y: auto;
-        }
-        
-        .user-item {
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            padding: 10px;
-            margin: 5px 0;
-            background: #2d2d2d;
-            border-radius: 8px;
-            border-left: 4px solid #4CAF50;
-        }
-        
-        .user-item.teacher {
-            border-left-color: #ff9800;
-        }
-        
-        .user-item.hand-raised {
-            border-left-color: #f44336;
-            animation: pulse 2s infinite;
-        }
-        
-        @keyframes pulse {
-            0% { opacity: 1; }
-            50% { opacity: 0.7; }
-            100% { opacity: 1; }
-        }
-        
-        .hand-raised-indicator {
-            color: #f44336;
-            font-weight: bold;
-        }
-        
-        .audio-controls {
-            display: flex;
-            gap: 10px;
-            align-items: center;
-            margin: 10px 0;
-        }
-        
-        .status {
-            padding: 5px 10px;
-            border-radius: 15px;
-            font-size: 12px;
-            font-weight: bold;
-        }
-        
-        .status.online {
-            background: #4CAF50;
-            color: white;
-        }
-        
-        .status.offline {
-            background: #666;
-            color: white;
-        }
-        
-        .chat-messages {
-            height: 200px;
-            overflow-y: auto;
-            background: #2d2d2d;
-            border-radius: 8px;
-            padding: 10px;
-            margin: 10px 0;
-        }
-        
-        .message {
-            margin: 5px 0;
-            padding: 5px 10px;
-            border-radius: 15px;
-            max-width: 80%;
-        }
-        
-        .message.teacher {
-            background: #4CAF50;
-            margin-left: auto;
-        }
-        
-        .message.student {
-            background: #555;
-        }
-        
-        .chat-input {
-            display: flex;
-            gap: 5px;
-            margin-top: 10px;
-        }
-        
-        .chat-input input {
-            flex: 1;
-            padding: 10px;
-            border: none;
-            border-radius: 20px;
-            background: #333;
-            color: white;
-        }
-        
-        .modal {
-            display: none;
-            position: fixed;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            background: rgba(0,0,0,0.8);
-            z-index: 1000;
-        }
-        
-        .modal-content {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            background: #1a1a1a;
-            padding: 30px;
-            border-radius: 15px;
-            border: 2px solid #4CAF50;
-            max-width: 400px;
-            width: 90%;
-        }
-        
-        .form-group {
-            margin: 15px 0;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 5px;
-            font-weight: bold;
-        }
-        
-        .form-group input, .form-group select {
-            width: 100%;
-            padding: 12px;
-            border: 1px solid #333;
-            border-radius: 8px;
-            background: #2d2d2d;
-            color: white;
-            font-size: 16px;
-        }
-        
-        .volume-slider {
-            width: 100px;
-            margin: 0 10px;
-        }
-        
-        .audio-visualizer {
-            display: flex;
-            align-items: end;
-            gap: 2px;
-            height: 30px;
-            margin: 0 10px;
-        }
-        
-        .bar {
-            width: 3px;
-            background: #4CAF50;
-            border-radius: 2px;
-            transition: height 0.1s;
-            height: 2px;
-        }
-        
-        @media (max-width: 768px) {
-            .main-content {
-                flex-direction: column;
-            }
-            
-            .sidebar {
-                width: 100%;
-                height: 250px;
-            }
-            
-            .controls {
-                font-size: 12px;
-            }
-            
-            .btn {
-                padding: 6px 12px;
-                font-size: 12px;
+    Canvas paths with round caps and joins ink exactly the points within half
+    the line width of a segment; zero-length segments are left out since the
+    canvas may not draw them."""
+    reach = cover_reach(stroke, cell)
+    if not reach:
+        return ()
+    return segment_cells([s for s in outline[0] if s[0] != s[2] or s[1] != s[3]], reach, cell)
+
+def paints_background(stroke):
+    tool, color, _ = stroke.style
+    return tool in ('pen', 'eraser') and isinstance(color, str) and color.lower() == WHITEBOARD_BACKGROUND
+
+def boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+class StrokeStore:
+    """Whiteboard history as strokes in a deque; oldest strokes drop off in O(1).
+
+    Each incoming operation is numbered from 1. A stroke chunk ({stroke,
+    points}) adds its points to the stroke with that ID, and a legacy pen
+    'draw' operation adds one point to the current stroke; neither is kept as
+    a dict, and tool, colour and size are stored once per stroke. When a pen
+    stroke ends it is simplified to within simplify_px. base_seq is the last
+    sequence number no longer held, either evicted or wiped by a clear.
+
+    compact() folds finished strokes into a checkpoint kept as pre-encoded
+    JSON, so late joiners get the checkpoint plus only the strokes after
+    checkpoint_seq, and drops strokes that later strokes hide, so a board
+    that is drawn on and erased over and over holds about what it shows.
+    hidden counts the strokes dropped that way."""
+
+    def __init__(self, max_points=WHITEBOARD_MAX_POINTS, simplify_px=WHITEBOARD_SIMPLIFY_PX):
+        self.max_points = max_points
+        self.simplify_px = simplify_px
+        self._strokes = deque()
+        self._styles = {}
+        self._current = None  # Pen stroke that 'draw' operations extend
+        self.points = 0
+        self.seq = 0
+        self.base_seq = 0
+        # (stroke, encoded record) for the oldest finished strokes, in order
+        self._checkpoint_parts = deque()
+        self.checkpoint_seq = 0
+        self.hidden = 0
+
+    def __len__(self):
+        return len(self._strokes)
+
+    def __bool__(self):
+        return bool(self._strokes)
+
+    def nbytes(self):
+        """Approximate memory held by the strokes and the encoded checkpoint"""
+        size = sum(sys.getsizeof(stroke) + sys.getsizeof(stroke.points) + sys.getsizeof(stroke.seq_ends)
+                   for stroke in self._strokes)
+        return size + sum(sys.getsizeof(part) for _, part in self._checkpoint_parts)
+
+    def _style(self, op):
+        style = (op.get('tool', 'pen'), op.get('color', '#ffffff'), op.get('size', 3))
+        return self._styles.setdefault(style, style)
+
+    def append_chunk(self, stroke_id, tool, color, size, coords, end=False):
+        """Store a stroke chunk's flat coordinates and return its sequence number"""
+        self.seq += 1
+        style = self._styles.setdefault((tool, color, size), (tool, color, size))
+        current = self._current
+        if current is not None and current.stroke_id == stroke_id and current.style is style:
+            current.extend(coords)
+            self.points += len(coords) // 2
+        else:
+            self._add(Stroke(style, self.seq, coords, stroke_id))
+        if end:
+            self.end_stroke()
+        self._evict()
+        return self.seq
+
+    def append(self, op):
+        """Store an operation and return its sequence number"""
+        if 'points' in op:
+            tool, color, size = self._style(op)
+            return self.append_chunk(op.get('stroke'), tool, color, size, op['points'], op.get('end'))
+        self.seq += 1
+        style = self._style(op)
+        start = (op['startX'], op['startY'])
+        end = (op['endX'], op['endY'])
+        if style[0] in ('pen', 'eraser'):
+            current = self._current
+            if op.get('type') == 'start':
+                self._add(Stroke(style, self.seq, start))
+            elif current is not None and current.style is style:
+                current.extend(end)
+                self.points += 1
+            else:
+                # Segment without a start we still hold, e.g. after eviction
+                self._add(Stroke(style, self.seq, start + end))
+        else:
+            self._add(Stroke(style, self.seq, start + end))
+            self.end_stroke()
+        self._evict()
+        return self.seq
+
+    def end_stroke(self, stroke_id=None):
+        """Simplify the current stroke now that no more points will arrive"""
+        current = self._current
+        if current is None or (stroke_id is not None and current.stroke_id != stroke_id):
+            return
+        self._current = None
+        if self.simplify_px > 0 and current.style[0] in ('pen', 'eraser'):
+            self.points -= current.simplify(self.simplify_px)
+
+    def _add(self, stroke):
+        self.end_stroke()
+        self._strokes.append(stroke)
+        self._current = stroke
+        self.points += len(stroke)
+
+    def _evict(self):
+        while self.points > self.max_points and len(self._strokes) > 1:
+            stroke = self._strokes.popleft()
+            self.points -= len(stroke)
+            self.base_seq = stroke.last_seq
+            if self._checkpoint_parts:
+                self._checkpoint_parts.popleft()
+            else:
+                self.checkpoint_seq = self.base_seq
+
+    def clear(self):
+        self._strokes.clear()
+        self._current = None
+        self.points = 0
+        self.base_seq = self.seq
+        self._checkpoint_parts.clear()
+        self.checkpoint_seq = self.seq
+
+    def compact(self):
+        """Fold strokes finished since the last call into the checkpoint, then
+        drop the strokes those leave invisible.
+
+        Only new strokes are encoded. Returns how many strokes were added."""
+        added = []
+        for stroke in islice(self._strokes, len(self._checkpoint_parts), None):
+            if stroke is self._current:
+                break
+            self._checkpoint_parts.append((stroke, json.dumps(stroke.record(), separators=(',', ':'))))
+            self.checkpoint_seq = stroke.last_seq
+            added.append(stroke)
+        if any(cover_reach(stroke) or paints_background(stroke) for stroke in added):
+            self._drop_hidden(added)
+        return len(added)
+
+    def _drop_hidden(self, added, cell=WHITEBOARD_CELL_PX):
+        """Drop held strokes nobody can see since the strokes in added were drawn.
+
+        Each pixel shows the last stroke that inked it, so a stroke whose ink
+        later opaque pen and eraser strokes paint over entirely can go, and so
+        can an eraser stroke that only paints over background. Both are judged
+        on a grid erring towards keeping: a cell only counts as painted over
+        if a later stroke covers all of it, and as inked if any of it might be."""
+        bounds = {stroke: stroke_bounds(stroke) for stroke in self._strokes}
+        hidden = set()
+        covering = [bounds[stroke] for stroke in added if bounds[stroke] is not None and cover_reach(stroke, cell)]
+        if covering:
+            region = (min(b[0] for b in covering), min(b[1] for b in covering),
+                      max(b[2] for b in covering), max(b[3] for b in covering))
+            candidates = {stroke for stroke, box in bounds.items()
+                          if box is not None and stroke is not self._current and boxes_overlap(box, region)}
+            # Only strokes over the candidates can hide any of them
+            area = (min(bounds[s][0] for s in candidates) - cell, min(bounds[s][1] for s in candidates) - cell,
+                    max(bounds[s][2] for s in candidates) + cell, max(bounds[s][3] for s in candidates) + cell)
+            cover = CellRuns()
+            for stroke in reversed(self._strokes):
+                box = bounds[stroke]
+                if box is None or not boxes_overlap(box, area):
+                    continue
+                candidate = stroke in candidates
+                if not candidate and not cover_reach(stroke, cell):
+                    continue
+                outline = stroke_outline(stroke, cell)
+                if candidate and cover and all(cover.covers(*run) for run in ink_cells(outline, cell)):
+                    hidden.add(stroke)
+                else:
+                    for run in cover_cells(stroke, outline, cell):
+                        cover.add(*run)
+        for eraser in added:
+            box = bounds[eraser]
+            if eraser in hidden or box is None or not paints_background(eraser):
+                continue
+            ink = CellRuns(ink_cells(stroke_outline(eraser, cell), cell))
+            for stroke in self._strokes:
+                if stroke is eraser:
+                    hidden.add(eraser)  # Nothing but background under it
+                    break
+                if stroke in hidden or paints_background(stroke):
+                    continue
+                other = bounds[stroke]
+                if other is None or (boxes_overlap(other, box)
+                                     and any(ink.touches(*run) for run in ink_cells(stroke_outline(stroke, cell), cell))):
+                    break
+        if hidden:
+            self._strokes = deque(stroke for stroke in self._strokes if stroke not in hidden)
+            self._checkpoint_parts = deque(part for part in self._checkpoint_parts if part[0] not in hidden)
+            self.points -= sum(len(stroke) for stroke in hidden)
+            self.hidden += len(hidden)
+
+    def history(self):
+        """Every stroke held as encoded JSON records, checkpoint first, and the seq they cover"""
+        parts = [part for _, part in self._checkpoint_parts]
+        parts.extend(json.dumps(record, separators=(',', ':'))
+                     for record in self.since(self.checkpoint_seq)[0])
+        return parts, self.seq
+
+
+    def since(self, seq):
+        """Stroke records after seq, and whether the caller must reset first.
+
+        If seq predates the store, everything held is returned with reset=True."""
+        if seq < self.base_seq or seq > self.seq:
+            return [stroke.record() for stroke in self._strokes], True
+        records = []
+        for stroke in reversed(self._strokes):
+            if stroke.last_seq <= seq:
+                break
+            records.append(stroke.record(seq))
+        records.reverse()
+        return records, False
+
+PRESENCE_FIELDS = ('id', 'fullName', 'username', 'role', 'hand_raised', 'speaking_permission')
+
+class AudioMixer:
+    """Sums a room's speakers into one Opus frame every MIX_FRAME_MS.
+
+    Listeners get the full mix; each speaker gets it without their own
+    voice. Users whose browsers can't decode Opus get it as PCM16. Speakers'
+    Opus frames are decoded (PCM16 ones are used as sent) and queued per
+    speaker, and a speaker is mixed in only once MIX_PRIME_FRAMES are
+    waiting, so network jitter is absorbed here rather than turning into
+    gaps. Each output stream has its own encoder, since Opus carries state
+    from one frame to the next."""
+
+    def __init__(self, frame_samples=MIX_FRAME_SAMPLES):
+        self.lock = threading.Lock()
+        self.frame_samples = frame_samples
+        self.queues = {}  # sid -> deque of int16 sample arrays
+        self.primed = set()
+        self.seq = 0
+        self.stream = 0  # A new stream after every pause, since the timestamps don't cover it
+        self.paused = True
+        self.decoders = {}  # sid -> Opus decoder for that speaker
+        self.encoders = {}  # sid left out of the mix, or None for the full mix -> Opus encoder
+
+    def __bool__(self):
+        return bool(self.queues)
+
+    def push(self, sid, frame):
+        """Queue the samples of one Opus or PCM16 audio_frame; returns False if it can't be decoded"""
+        payload = bytes(memoryview(frame)[AUDIO_FRAME_HEADER.size:])
+        with self.lock:
+            if frame[1] == AUDIO_CODEC_OPUS:
+                decoder = self.decoders.get(sid)
+                if decoder is None:
+                    decoder = self.decoders[sid] = opuslib.Decoder(MIX_SAMPLE_RATE, 1)
+                try:
+                    payload = decoder.decode(payload, MIX_PACKET_MAX_SAMPLES)
+                except opuslib.OpusError:
+                    return False
+            samples = np.frombuffer(payload, dtype='<i2', count=len(payload) // 2)
+            frames = self.queues.get(sid)
+            if frames is None:
+                frames = self.queues[sid] = deque(maxlen=MIX_MAX_FRAMES)
+            for start in range(0, len(samples), self.frame_samples):
+                frames.append(samples[start:start + self.frame_samples])
+        return True
+
+    def remove(self, sid):
+        with self.lock:
+            self.queues.pop(sid, None)
+            self.primed.discard(sid)
+            self.decoders.pop(sid, None)
+
+    def mix(self, pcm_sids=()):
+        """Mix one frame from every ready speaker; pcm_sids get PCM16 rather than Opus.
+
+        Returns (Opus frame for listeners, PCM16 frame for listeners or None
+        if there are none, {sid: frame without that speaker}, speaker sids),
+        or None if nobody is ready."""
+        ready = {}
+        with self.lock:
+            for sid, frames in list(self.queues.items()):
+                if sid not in self.primed:
+                    if len(frames) < MIX_PRIME_FRAMES:
+                        continue
+                    self.primed.add(sid)
+                if frames:
+                    ready[sid] = frames.popleft()
+                else:
+                    # Ran dry: buffer up again before rejoining the mix
+                    self.primed.discard(sid)
+                    del self.queues[sid]
+            if not ready:
+                self.paused = True
+                return None
+            if self.paused:
+                self.paused = False
+                self.stream = (self.stream + 1) & 0xFF
+                self.seq = 0
+                self.encoders.clear()  # Receivers start new decoders too
+            stamp = (self.stream, self.seq, (self.seq * MIX_FRAME_MS) & 0xFFFFFFFF)
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+            speaking = set(self.queues)
+
+        # Encoders are only used from here, by the one mixer task
+        for sid in [sid for sid in self.encoders if sid is not None and sid not in speaking]:
+            del self.encoders[sid]
+
+        total = np.zeros(self.frame_samples, dtype=np.int32)
+        for samples in ready.values():
+            total[:len(samples)] += samples
+
+        pcm = set(pcm_sids)
+
+        def encode(key, mixed, codec=AUDIO_CODEC_OPUS):
+            samples = np.clip(mixed, -32768, 32767).astype('<i2').tobytes()
+            if codec == AUDIO_CODEC_PCM16:
+                return AUDIO_FRAME_HEADER.pack(1, codec, *stamp) + samples
+            encoder = self.encoders.get(key)
+            if encoder is None:
+                encoder = self.encoders[key] = opuslib.Encoder(MIX_SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+                encoder.bitrate = MIX_BITRATE
+            return AUDIO_FRAME_HEADER.pack(1, codec, *stamp) + encoder.encode(samples, self.frame_samples)
+
+        minus = {}
+        if len(ready) > 1:
+            for sid, samples in ready.items():
+                own = total.copy()
+                own[:len(samples)] -= samples
+                minus[sid] = encode(sid, own, AUDIO_CODEC_PCM16 if sid in pcm else AUDIO_CODEC_OPUS)
+        pcm_frame = encode(None, total, AUDIO_CODEC_PCM16) if pcm - ready.keys() else None
+        return encode(None, total), pcm_frame, minus, list(ready)
+
+def public_user(user_info):
+    """The fields of a user record that other clients need"""
+    return {field: user_info.get(field) for field in PRESENCE_FIELDS}
+
+class Room:
+    """One lecture: its users, raised hands, teacher and whiteboard.
+
+    All state is changed under the room's own lock, so handlers for
+    different rooms never contend. Methods hand back copies to emit. Most
+    handlers emit after the lock is released; presence updates and
+    whiteboard operations are emitted while holding it, so clients see them
+    in version and sequence order."""
+
+    def __init__(self, room_id):
+        self.id = room_id
+        self.lock = threading.RLock()
+        self.closed = False  # Set once the room is dropped from the registry
+        self.active_users = {}
+        self.json_users = 0  # Users without binary whiteboard support
+        self.pcm_users = set()  # Users who can't decode Opus, so get the mix as PCM16
+        self.raised_hands = HandQueue()
+        self.lecture_active = False
+        self.teacher_id = None
+        self.whiteboard_state = StrokeStore()  # Store all drawing operations
+        self.mixer = AudioMixer() if AUDIO_MIX and np is not None and opuslib is not None else None
+        # Presence changes since the last tick, merged per user
+        self.presence_version = 0
+        self.pending_presence = OrderedDict()
+        self.hands_changed = False
+
+    def _presence(self, change):
+        user_id = change['user']['id'] if change['op'] == 'add' else change['id']
+        previous = self.pending_presence.get(user_id)
+        if change['op'] == 'patch' and previous is not None:
+            if previous['op'] == 'add':
+                previous['user'].update(change['fields'])
+            elif previous['op'] == 'patch':
+                previous['fields'].update(change['fields'])
+        else:
+            # A remove replaces a pending add: a snapshot may already show the user
+            self.pending_presence[user_id] = change
+        mark_dirty(self)
+
+    def _hands(self):
+        self.hands_changed = True
+        mark_dirty(self)
+
+    def take_updates(self):
+        """Pop everything changed since the last tick as one room_update payload, or None"""
+        with self.lock:
+            update = {}
+            if self.pending_presence:
+                update['presence'] = {
+                    'from_version': self.presence_version,
+                    'version': self.presence_version + 1,
+                    'changes': list(self.pending_presence.values())
+                }
+                self.presence_version += 1
+                self.pending_presence = OrderedDict()
+            if self.hands_changed:
+                update['raised_hands'] = self.raised_hands.entries()
+                self.hands_changed = False
+            return update or None
+
+    def presence_snapshot(self):
+        """Current users and hands at the last broadcast version.
+
+        The snapshot may already include changes from the next delta; clients
+        apply that delta anyway, which is safe because every change is idempotent."""
+        with self.lock:
+            return {
+                'version': self.presence_version,
+                'users': {user_id: public_user(user_info) for user_id, user_info in self.active_users.items()},
+                'raised_hands': self.raised_hands.entries()
             }
-        }
-        
-        .hidden {
-            display: none !important;
-        }
-        
-        .lecture-status {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            padding: 10px;
-            background: #2d2d2d;
-            border-radius: 8px;
-            margin-bottom: 15px;
-        }
-        
-        .status-indicator {
-            width: 12px;
-            height: 12px;
-            border-radius: 50%;
-            background: #f44336;
-        }
-        
-        .status-indicator.active {
-            background: #4CAF50;
-            animation: pulse 2s infinite;
-        }
 
-        .tool-active {
-            background: #4CAF50 !important;
-            color: white !important;
-        }
-    </style>
-</head>
-<body>
-    <!-- Login Modal -->
-    <div id="loginModal" class="modal" style="display: block;">
-        <div class="modal-content">
-            <h2 style="text-align: center; color: #4CAF50; margin-bottom: 20px;">Join Smart Board</h2>
-            <form id="loginForm">
-                <div class="form-group">
-                    <label>Full Name:</label>
-                    <input type="text" id="fullName" required placeholder="Enter your full name">
-                </div>
-                <div class="form-group">
-                    <label>Username:</label>
-                    <input type="text" id="username" required placeholder="Choose a username">
-                </div>
-                <div class="form-group">
-                    <label>Phone Number:</label>
-                    <input type="tel" id="phoneNumber" required placeholder="Enter your phone number">
-                </div>
-                <div class="form-group">
-                    <label>Join as:</label>
-                    <select id="userRole" required>
-                        <option value="">Select your role</option>
-                        <option value="teacher">Teacher (Can draw and control lecture)</option>
-                        <option value="student">Student (View and participate)</option>
-                    </select>
-                </div>
-                <button type="submit" class="btn btn-primary" style="width: 100%; margin-top: 20px;">Join Lecture</button>
-            </form>
-        </div>
-    </div>
+    def teacher_name(self):
+        with self.lock:
+            if self.teacher_id is None:
+                return 'None'
+            return self.active_users.get(self.teacher_id, {}).get('fullName', 'Unknown')
 
-    <!-- Main Application -->
-    <div class="container hidden" id="mainApp">
-        <div class="header">
-            <div class="logo">📚 Smart Board</div>
-            <div class="controls">
-                <span id="userInfo"></span>
-                <button class="btn btn-warning" id="raiseHandBtn" onclick="toggleRaiseHand()">🙋‍♂️ Raise Hand</button>
-                <button class="btn btn-primary" id="startLectureBtn" onclick="toggleLecture()">Start Lecture</button>
-                <button class="btn btn-danger" onclick="leaveLecture()">Leave</button>
-            </div>
-        </div>
-        
-        <div class="main-content">
-            <div class="whiteboard-container">
-                <div class="toolbar">
-                    <div class="tool-group">
-                        <button class="btn btn-primary tool-active" id="penTool" onclick="setTool('pen')">✏️ Pen</button>
-                        <button class="btn btn-primary" id="eraserTool" onclick="setTool('eraser')">🗑️ Eraser</button>
-                        <input type="color" id="colorPicker" value="#ffffff" onchange="setColor(this.value)" title="Drawing Color">
-                        <input type="range" id="brushSize" min="1" max="20" value="3" onchange="setBrushSize(this.value)" title="Brush Size">
-                        <span id="brushSizeDisplay">3px</span>
-                    </div>
-                    <div class="tool-group">
-                        <button class="btn btn-primary" id="lineTool" onclick="setTool('line')">📏 Line</button>
-                        <button class="btn btn-primary" id="rectTool" onclick="setTool('rect')">⬛ Rectangle</button>
-                        <button class="btn btn-primary" id="circleTool" onclick="setTool('circle')">⭕ Circle</button>
-                        <button class="btn btn-warning" onclick="clearBoard()">🗑️ Clear All</button>
-                    </div>
-                </div>
-                <canvas id="whiteboard" class="whiteboard"></canvas>
-            </div>
-            
-            <div class="sidebar">
-                <div class="sidebar-tabs">
-                    <div class="tab active" onclick="showTab('users')">Users</div>
-                    <div class="tab" onclick="showTab('chat')">Chat</div>
-                    <div class="tab" onclick="showTab('audio')">Audio</div>
-                </div>
-                
-                <div class="tab-content">
-                    <!-- Users Tab -->
-                    <div id="usersTab">
-                        <div class="lecture-status">
-                            <div class="status-indicator" id="lectureIndicator"></div>
-                            <span id="lectureStatusText">Lecture Not Started</span>
-                        </div>
-                        
-                        <h3>Online Users (<span id="userCount">0</span>)</h3>
-                        <div id="usersList"></div>
-                        
-                        <div style="margin-top: 20px;">
-                            <h4>Raised Hands (<span id="handsCount">0</span>)</h4>
-                            <div id="raisedHandsList"></div>
-                        </div>
-                    </div>
-                    
-                    <!-- Chat Tab -->
-                    <div id="chatTab" class="hidden">
-                        <h3>Chat Messages</h3>
-                        <div class="chat-messages" id="chatMessages"></div>
-                        <div class="chat-input">
-                            <input type="text" id="chatInput" placeholder="Type a message..." onkeypress="sendChatOnEnter(event)">
-                            <button class="btn btn-primary" onclick="sendChat()">Send</button>
-                        </div>
-                    </div>
-                    
-                    <!-- Audio Tab -->
-                    <div id="audioTab" class="hidden">
-                        <h3>Audio Controls</h3>
-                        <div class="audio-controls">
-                            <button class="btn btn-primary" id="micBtn" onclick="toggleMicrophone()">🎤 Mic Off</button>
-                            <button class="btn btn-primary" id="speakerBtn" onclick="toggleSpeaker()">🔊 Speaker On</button>
-                        </div>
-                        
-                        <div style="margin: 15px 0;">
-                            <label>Volume:</label>
-                            <input type="range" class="volume-slider" id="volumeSlider" min="0" max="100" value="80" onchange="setVolume(this.value)">
-                            <span id="volumeValue">80%</span>
-                        </div>
-                        
-                        <div class="audio-visualizer" id="audioVisualizer">
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                            <div class="bar"></div>
-                        </div>
-                        
-                        <div style="margin-top: 15px;">
-                            <h4>Audio Settings</h4>
-                            <label><input type="checkbox" id="autoGainControl"> Auto Gain Control</label><br>
-                            <label><input type="checkbox" id="noiseSuppression" checked> Noise Suppression</label><br>
-                            <label><input type="checkbox" id="echoCancellation" checked> Echo Cancellation</label>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
+    def whiteboard_since(self, seq):
+        """Payload for whiteboard_state: strokes drawn after seq, or None if
+        seq is no longer held and the client has to start over"""
+        with self.lock:
+            operations, reset = self.whiteboard_state.since(seq)
+            if reset or seq == 0:
+                return None
+            return {'operations': operations, 'seq': self.whiteboard_state.seq}
 
-    <script>
-        // Global variables
-        let socket;
-        let currentUser = null;
-        let isTeacher = false;
-        let handRaised = false;
-        let microphoneEnabled = false;
-        let speakerEnabled = true;
-        let localStream = null;
-        let audioContext = null;
-        let analyser = null;
-        let mediaRecorder = null;
-        let audioChunks = [];
-        
-        // Whiteboard variables
-        let canvas, ctx;
-        let isDrawing = false;
-        let currentTool = 'pen';
-        let currentColor = '#ffffff';  // White for dark board
-        let currentBrushSize = 3;
-        let startX, startY;
-        let lastX, lastY;
-        
-        // Initialize application
-        document.addEventListener('DOMContentLoaded', function() {
-            initializeWhiteboard();
-            setupEventListeners();
-        });
-        
-        // Setup event listeners
-        function setupEventListeners() {
-            document.getElementById('loginForm').addEventListener('submit', handleLogin);
-        }
-        
-        // Handle user login
-        function handleLogin(e) {
-            e.preventDefault();
-            const fullName = document.getElementById('fullName').value.trim();
-            const username = document.getElementById('username').value.trim();
-            const phoneNumber = document.getElementById('phoneNumber').value.trim();
-            const userRole = document.getElementById('userRole').value;
-            
-            if (!fullName || !username || !phoneNumber || !userRole) {
-                alert('Please fill in all fields');
-                return;
-            }
-            
-            currentUser = {
-                fullName: fullName,
-                username: username,
-                phoneNumber: phoneNumber,
-                role: userRole,
-                id: generateUniqueId()
-            };
-            
-            isTeacher = userRole === 'teacher';
-            
-            // Connect to socket
-            connectSocket();
-            
-            // Hide login modal and show main app
-            document.getElementById('loginModal').style.display = 'none';
-            document.getElementById('mainApp').classList.remove('hidden');
-            
-            // Update UI
-            updateUserInterface();
-        }
-        
-        // Connect to socket
-        function connectSocket() {
-            socket = io();
-            
-            socket.emit('user_join', currentUser);
-            
-            socket.on('user_joined', function(data) {
-                updateUsersList(data.users);
-                addChatMessage('system', `${data.user.fullName} joined the lecture`);
-            });
-            
-            socket.on('user_left', function(data) {
-                updateUsersList(data.users);
-                addChatMessage('system', `${data.user.fullName} left the lecture`);
-            });
-            
-            socket.on('users_update', function(data) {
-                updateUsersList(data.users);
-            });
-            
-            socket.on('hand_raised', function(data) {
-                updateRaisedHands(data.raised_hands);
-            });
-            
-            socket.on('lecture_status', function(data) {
-                updateLectureStatus(data.active, data.teacher);
-            });
-            
-            socket.on('chat_message', function(data) {
-                addChatMessage(data.sender_role, data.message, data.sender_name);
-            });
-            
-            socket.on('whiteboard_update', function(data) {
-                drawOnCanvas(data);
-            });
-            
-            socket.on('whiteboard_clear', function() {
-                clearCanvas();
-            });
-            
-            socket.on('whiteboard_state', function(data) {
-                // Redraw entire whiteboard state for new users
-                clearCanvas();
-                data.operations.forEach(op => drawOnCanvas(op));
-            });
-            
-            socket.on('audio_data', function(data) {
-                if (speakerEnabled && data.user_id !== currentUser.id) {
-                    playAudioData(data.audio_data);
-                }
-            });
+    def lecture_snapshot(self):
+        with self.lock:
+            return {'active': self.lecture_active, 'teacher': self.teacher_name()}
 
-            socket.on('speaking_permission_granted', function() {
-                alert('You have been granted permission to speak!');
-                // Auto-enable microphone when permission is granted
-                if (!microphoneEnabled) {
-                    toggleMicrophone();
-                }
-            });
-        }
-        
-        // Update user interface
-        function updateUserInterface() {
-            document.getElementById('userInfo').textContent = `${currentUser.fullName} (${isTeacher ? 'Teacher' : 'Student'})`;
-            
-            // Hide teacher controls for students
-            if (!isTeacher) {
-                document.getElementById('startLectureBtn').style.display = 'none';
-                // Disable drawing tools for students
-                const toolbar = document.querySelector('.toolbar');
-                toolbar.style.opacity = '0.5';
-                const toolButtons = toolbar.querySelectorAll('.btn');
-                toolButtons.forEach(btn => btn.disabled = true);
-            } else {
-                // Hide raise hand button for teachers
-                document.getElementById('raiseHandBtn').style.display = 'none';
-            }
-        }
-        
-        // Update users list
-        function updateUsersList(users) {
-            const usersList = document.getElementById('usersList');
-            const userCount = document.getElementById('userCount');
-            
-            usersList.innerHTML = '';
-            userCount.textContent = Object.keys(users).length;
-            
-            Object.values(users).forEach(user => {
-                const userItem = document.createElement('div');
-                userItem.className = `user-item ${user.role === 'teacher' ? 'teacher' : ''}`;
-                
-                const isHandRaised = user.hand_raised;
-                if (isHandRaised) {
-                    userItem.classList.add('hand-raised');
-                }
-                
-                userItem.innerHTML = `
-                    <div>
-                        <strong>${user.fullName}</strong>
-                        <div style="font-size: 12px; opacity: 0.7;">${user.username} (${user.role})</div>
-                        ${isHandRaised ? '<span class="hand-raised-indicator">🙋‍♂️ Hand Raised</span>' : ''}
-                    </div>
-                    <div class="status online">Online</div>
-                `;
-                
-                usersList.appendChild(userItem);
-            });
-        }
-        
-        // Update raised hands
-        function updateRaisedHands(raisedHands) {
-            const handsCount = document.getElementById('handsCount');
-            const raisedHandsList = document.getElementById('raisedHandsList');
-            
-            handsCount.textContent = raisedHands.length;
-            
-            raisedHandsList.innerHTML = '';
-            raisedHands.forEach(user => {
-                const handItem = document.createElement('div');
-                handItem.className = 'user-item hand-raised';
-                handItem.innerHTML = `
-                    <div>
-                        <strong>${user.fullName}</strong>
-                        <div style="font-size: 12px; opacity: 0.7;">Wants to speak</div>
-                    </div>
-                    ${isTeacher ? `<button class="btn btn-primary" onclick="givePermissionToSpeak('${user.id}')">Allow</button>` : ''}
-                `;
-                raisedHandsList.appendChild(handItem);
-            });
-        }
-        
-        // Toggle raise hand
-        function toggleRaiseHand() {
-            if (isTeacher) return;
-            
-            handRaised = !handRaised;
-            socket.emit('toggle_hand', { raised: handRaised });
-            
-            const btn = document.getElementById('raiseHandBtn');
-            if (handRaised) {
-                btn.textContent = '✋ Lower Hand';
-                btn.className = 'btn btn-danger';
-            } else {
-                btn.textContent = '🙋‍♂️ Raise Hand';
-                btn.className = 'btn btn-warning';
-            }
-        }
-        
-        // Toggle lecture
-        function toggleLecture() {
-            if (!isTeacher) return;
-            
-            socket.emit('toggle_lecture');
-        }
-        
-        // Update lecture status
-        function updateLectureStatus(active, teacher) {
-            const indicator = document.getElementById('lectureIndicator');
-            const statusText = document.getElementById('lectureStatusText');
-            const startBtn = document.getElementById('startLectureBtn');
-            
-            if (active) {
-                indicator.classList.add('active');
-                statusText.textContent = `Lecture Active - ${teacher}`;
-                if (isTeacher) {
-                    startBtn.textContent = 'End Lecture';
-                    startBtn.className = 'btn btn-danger';
-                }
-            } else {
-                indicator.classList.remove('active');
-                statusText.textContent = 'Lecture Not Started';
-                if (isTeacher) {
-                    startBtn.textContent = 'Start Lecture';
-                    startBtn.className = 'btn btn-primary';
-                }
-            }
-        }
-        
-        // Leave lecture
-        function leaveLecture() {
-            if (confirm('Are you sure you want to leave the lecture?')) {
-                if (localStream) {
-                    localStream.getTracks().forEach(track => track.stop());
-                }
-                socket.emit('user_leave');
-                location.reload();
-            }
-        }
-        
-        // Show tab
-        function showTab(tabName) {
-            // Hide all tabs
-            document.getElementById('usersTab').classList.add('hidden');
-            document.getElementById('chatTab').classList.add('hidden');
-            document.getElementById('audioTab').classList.add('hidden');
-            
-            // Remove active class from all tab buttons
-            document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
-            
-            // Show selected tab
-            document.getElementById(tabName + 'Tab').classList.remove('hidden');
-            
-            // Add active class to selected tab button
-            event.target.classList.add('active');
-        }
-        
-        // Chat functions
-        function sendChat() {
-            const input = document.getElementById('chatInput');
-            const message = input.value.trim();
-            
-            if (message) {
-                socket.emit('send_chat', { message: message });
-                input.value = '';
-            }
-        }
-        
-        function sendChatOnEnter(event) {
-            if (event.key === 'Enter') {
-                sendChat();
-            }
-        }
-        
-        function addChatMessage(senderRole, message, senderName = 'System') {
-            const messagesContainer = document.getElementById('chatMessages');
-            const messageElement = document.createElement('div');
-            messageElement.className = `message ${senderRole}`;
-            
-            const timestamp = new Date().toLocaleTimeString();
-            messageElement.innerHTML = `
-                <div style="font-size: 12px; opacity: 0.7;">${senderName} - ${timestamp}</div>
-                <div>${message}</div>
-            `;
-            
-            messagesContainer.appendChild(messageElement);
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
-        }
-        
-        // Audio functions - FIXED
-        async function toggleMicrophone() {
-            const btn = document.getElementById('micBtn');
-            
-            if (!microphoneEnabled) {
-                try {
-                    // Request microphone permission
-                    localStream = await navigator.mediaDevices.getUserMedia({
-                        audio: {
-                            echoCancellation: document.getElementById('echoCancellation').checked,
-                            noiseSuppression: document.getElementById('noiseSuppression').checked,
-                            autoGainControl: document.getElementById('autoGainControl').checked,
-                            sampleRate: 44100
-                        }
-                    });
-                    
-                    setupAudioProcessing();
-                    microphoneEnabled = true;
-                    btn.textContent = '🎤 Mic On';
-                    btn.className = 'btn btn-danger';
-                    
-                } catch (err) {
-                    alert('Could not access microphone: ' + err.message);
-                    console.error('Microphone error:', err);
-                }
-            } else {
-                // Stop microphone
-                if (localStream) {
-                    localStream.getTracks().forEach(track => track.stop());
-                    localStream = null;
-                }
-                if (mediaRecorder && mediaRecorder.state !== 'inactive') {
-                    mediaRecorder.stop();
-                }
-                if (audioContext) {
-                    audioContext.close();
-                    audioContext = null;
-                }
-                microphoneEnabled = false;
-                btn.textContent = '🎤 Mic Off';
-                btn.className = 'btn btn-primary';
-            }
-        }
-        
-        function toggleSpeaker() {
-            const btn = document.getElementById('speakerBtn');
-            speakerEnabled = !speakerEnabled;
-            
-            if (speakerEnabled) {
-                btn.textContent = '🔊 Speaker On';
-                btn.className = 'btn btn-primary';
-            } else {
-                btn.textContent = '🔇 Speaker Off';
-                btn.className = 'btn btn-danger';
-            }
-        }
-        
-        function setVolume(value) {
-            document.getElementById('volumeValue').textContent = value + '%';
-        }
-        
-        async function setupAudioProcessing() {
-            if (!localStream) return;
-            
-            try {
-                audioContext = new (window.AudioContext || window.webkitAudioContext)();
-                const source = audioContext.createMediaStreamSource(localStream);
-                
-                analyser = audioContext.createAnalyser();
-                analyser.fftSize = 256;
-                analyser.smoothingTimeConstant = 0.8;
-                source.connect(analyser);
-                
-                // Setup MediaRecorder for audio transmission
-                const options = { mimeType: 'audio/webm;codecs=opus' };
-                if (!MediaRecorder.isTypeSupported(options.mimeType)) {
-                    options.mimeType = 'audio/webm';
-                }
-                if (!MediaRecorder.isTypeSupported(options.mimeType)) {
-                    options.mimeType = 'audio/mp4';
-                }
-                
-                mediaRecorder = new MediaRecorder(localStream, options);
-                audioChunks = [];
-                
-                mediaRecorder.ondataavailable = function(event) {
-                    if (event.data.size > 0) {
-                        audioChunks.push(event.data);
-                    }
-                };
-                
-                mediaRecorder.onstop = function() {
-                    if (audioChunks.length > 0) {
-                        const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
-                        const reader = new FileReader();
-                        reader.onload = function() {
-                            socket.emit('audio_data', {
-                                audio_data: Array.from(new Uint8Array(reader.result)),
-                                user_id: currentUser.id
-                            });
-                        };
-                        reader.readAsArrayBuffer(audioBlob);
-                        audioChunks = [];
-                    }
-                    
-                    // Restart recording if still enabled
-                    if (microphoneEnabled && mediaRecorder) {
-                        setTimeout(() => {
-                            if (mediaRecorder && mediaRecorder.state === 'inactive') {
-                                mediaRecorder.start();
-                                setTimeout(() => {
-                                    if (mediaRecorder && mediaRecorder.state === 'recording') {
-                                        mediaRecorder.stop();
-                                    }
-                                }, 1000); // Record for 1 second chunks
-                            }
-                        }, 100);
-                    }
-                };
-                
-                // Start recording
-                mediaRecorder.start();
-                setTimeout(() => {
-                    if (mediaRecorder && mediaRecorder.state === 'recording') {
-                        mediaRecorder.stop();
-                    }
-                }, 1000);
-                
-                // Start audio visualization
-                visualizeAudio();
-                
-            } catch (err) {
-                console.error('Audio processing setup error:', err);
-            }
-        }
-        
-        function visualizeAudio() {
-            if (!analyser) return;
-            
-            const bufferLength = analyser.frequencyBinCount;
-            const dataArray = new Uint8Array(bufferLength);
-            const bars = document.querySelectorAll('#audioVisualizer .bar');
-            
-            function updateVisualization() {
-                if (!analyser) return;
-                
-                analyser.getByteFrequencyData(dataArray);
-                
-                bars.forEach((bar, index) => {
-                    const barIndex = Math.floor((index / bars.length) * bufferLength / 4);
-                    const barHeight = (dataArray[barIndex] / 255) * 25;
-                    bar.style.height = Math.max(2, barHeight) + 'px';
-                });
-                
-                if (microphoneEnabled) {
-                    requestAnimationFrame(updateVisualization);
-                }
-            }
-            
-            updateVisualization();
-        }
-        
-        function playAudioData(audioData) {
-            if (!speakerEnabled) return;
-            
-            try {
-                const uint8Array = new Uint8Array(audioData);
-                const audioBlob = new Blob([uint8Array], { type: 'audio/webm' });
-                const audioUrl = URL.createObjectURL(audioBlob);
-                const audio = new Audio(audioUrl);
-                
-                const volumeSlider = document.getElementById('volumeSlider');
-                audio.volume = volumeSlider.value / 100;
-                
-                audio.play().then(() => {
-                    // Audio played successfully
-                }).catch(err => {
-                    console.log('Audio play error:', err);
-                });
-                
-                // Clean up URL after playing
-                audio.addEventListener('ended', () => {
-                    URL.revokeObjectURL(audioUrl);
-                });
-                
-                // Auto cleanup after 5 seconds
-                setTimeout(() => {
-                    URL.revokeObjectURL(audioUrl);
-                }, 5000);
-                
-            } catch (err) {
-                console.log('Error playing audio:', err);
-            }
-        }
-        
-        // Whiteboard functions - FIXED
-        function initializeWhiteboard() {
-            canvas = document.getElementById('whiteboard');
-            ctx = canvas.getContext('2d');
-            
-            resizeCanvas();
-            window.addEventListener('resize', resizeCanvas);
-            
-            // Mouse events
-            canvas.addEventListener('mousedown', startDrawing);
-            canvas.addEventListener('mousemove', draw);
-            canvas.addEventListener('mouseup', stopDrawing);
-            canvas.addEventListener('mouseout', stopDrawing);
-            
-            // Touch events for mobile
-            canvas.addEventListener('touchstart', handleTouch);
-            canvas.addEventListener('touchmove', handleTouch);
-            canvas.addEventListener('touchend', stopDrawing);
-            
-            // Prevent default touch behaviors
-            canvas.addEventListener('touchstart', e => e.preventDefault());
-            canvas.addEventListener('touchmove', e => e.preventDefault());
-        }
-        
-        function resizeCanvas() {
-            const rect = canvas.getBoundingClientRect();
-            const oldImageData = ctx.getImageData(0, 0, canvas.width, canvas.height);
-            
-            canvas.width = rect.width;
-            canvas.height = rect.height;
-            
-            // Restore image data
-            if (oldImageData.width > 0 && oldImageData.height > 0) {
-                ctx.putImageData(oldImageData, 0, 0);
-            }
-            
-            // Set default drawing properties
-            ctx.lineCap = 'round';
-            ctx.lineJoin = 'round';
-            ctx.strokeStyle = currentColor;
-            ctx.lineWidth = currentBrushSize;
-        }
-        
-        function getMousePos(e) {
-            const rect = canvas.getBoundingClientRect();
-            return {
-                x: (e.clientX - rect.left) * (canvas.width / rect.width),
-                y: (e.clientY - rect.top) * (canvas.height / rect.height)
-            };
-        }
-        
-        function getTouchPos(e) {
-            const rect = canvas.getBoundingClientRect();
+    def add_user(self, user_info):
+        """Add a user; a second teacher is demoted to student. False if the room closed"""
+        with self.lock:
+            if self.closed:
+                return False
+            if user_info['role'] == 'teacher':
+                if self.teacher_id is None:
+                    self.teacher_id = user_info['id']
+                else:
+                    # If there's already a teacher, make this user a student
+                    user_info['role'] = 'student'
+            self.active_users[user_info['id']] = user_info
+            if user_info.get('wire') != 'binary':
+                self.json_users += 1
+            if user_info.get('audio') == 'pcm16':
+                self.pcm_users.add(user_info['id'])
+            self._presence({'op': 'add', 'user': public_user(user_info)})
+            return True
+
+    def remove_user(self, user_id):
+        """Remove a user with their raised hand; returns their info or None"""
+        with self.lock:
+            user_info = self.active_users.pop(user_id, None)
+            if user_info is None:
+                return None
+            if user_info.get('wire') != 'binary':
+                self.json_users -= 1
+            self.pcm_users.discard(user_id)
+            if self.raised_hands.remove(user_id):
+                self._hands()
+            if self.mixer is not None:
+                self.mixer.remove(user_id)
+            self._presence({'op': 'remove', 'id': user_id})
+            # Reset teacher if teacher leaves
+            if user_id == self.teacher_id:
+                self.teacher_id = None
+                self.lecture_active = False
+            return user_info
+
+    def set_hand(self, user_id, raised):
+        """Raise or lower a student's hand; False if the caller is not a student here"""
+        with self.lock:
+            user_info = self.active_users.get(user_id)
+            if user_info is None or user_info['role'] != 'student':
+                return False
+            if user_info['hand_raised'] != raised:
+                user_info['hand_raised'] = raised
+                self._presence({'op': 'patch', 'id': user_id, 'fields': {'hand_raised': raised}})
+            if raised:
+                if user_id not in self.raised_hands:
+                    self.raised_hands.raise_hand(user_id, user_info['fullName'])
+                    self._hands()
+            elif self.raised_hands.lower(user_id):
+                self._hands()
+            return True
+
+    def grant_permission(self, user_id, target_user_id=None):
+        """Let the teacher allow a student to speak, lowering their hand.
+
+        Without a target the longest-waiting raised hand is picked. Returns the
+        student's sid, or None if nothing was granted."""
+        with self.lock:
+            if user_id != self.teacher_id:
+                return None
+            if target_user_id is None:
+                hand = self.raised_hands.pop_next()
+                if hand is None:
+                    return None
+                target_user_id = hand['id']
+            if target_user_id not in self.active_users:
+                return None
+            target = self.active_users[target_user_id]
+            target['speaking_permission'] = True
+            self.raised_hands.lower(target_user_id)
+            self._hands()
+            target['hand_raised'] = False
+            self._presence({'op': 'patch', 'id': target_user_id,
+                            'fields': {'speaking_permission': True, 'hand_raised': False}})
+            return target_user_id
+
+    def toggle_lecture(self, user_id):
+        """Start or end the lecture; returns the new status or None if not the teacher"""
+        with self.lock:
+            if user_id != self.teacher_id:
+                return None
+            self.lecture_active = not self.lecture_active
+            return self.lecture_snapshot()
+
+    def add_whiteboard_op(self, user_id, data):
+        """Log a drawing operation, tagging it with its seq; None if not the teacher"""
+        with self.lock:
+            if user_id != self.teacher_id:  # Only teacher can draw
+                return None
+            # The store is capped at WHITEBOARD_MAX_POINTS, evicting the oldest strokes
+            data['seq'] = self.whiteboard_state.seq + 1
+            return self.whiteboard_state.append(data)
+
+    def add_whiteboard_chunk(self, user_id, stroke_id, tool, color, size, coords, end=False):
+        """Log a decoded binary chunk; returns its seq, or None if not the teacher"""
+        with self.lock:
+            if user_id != self.teacher_id:  # Only teacher can draw
+                return None
+            return self.whiteboard_state.append_chunk(stroke_id, tool, color, size, coords, end)
+
+    def end_whiteboard_stroke(self, user_id, stroke_id):
+        with self.lock:
+            if user_id == self.teacher_id:
+                self.whiteboard_state.end_stroke(stroke_id)
+
+    def clear_whiteboard(self, user_id):
+        """Wipe the board; returns the seq clients resume from, or None if not the teacher"""
+        with self.lock:
+            if user_id != self.teacher_id:  # Only teacher can clear
+                return None
+            self.whiteboard_state.clear()
+            return self.whiteboard_state.seq
+
+    def check_invariants(self):
+        """Raise AssertionError if hands, users and teacher disagree"""
+        with self.lock:
+            hand_ids = [hand['id'] for hand in self.raised_hands.entries()]
+            assert len(hand_ids) == len(set(hand_ids)), 'duplicate raised hand'
+            for user_id in hand_ids:
+                assert user_id in self.active_users, 'raised hand for departed user'
+                assert self.active_users[user_id]['hand_raised'], 'lowered hand still queued'
+            for user_id, user_info in self.active_users.items():
+                if user_info['hand_raised']:
+                    assert user_id in hand_ids, 'raised hand missing from queue'
+            assert self.teacher_id is None or self.teacher_id in self.active_users, 'teacher left'
+
+# Global variables for session management
+rooms = {}
+user_rooms = {}  # sid -> room id
+rooms_lock = threading.Lock()  # Guards the registry only; room state uses Room.lock
+dirty_rooms = set()  # Rooms with changes waiting for the next presence tick
+dirty_rooms_lock = threading.Lock()
+mixing_rooms = set()  # Rooms with speakers queued in their mixer
+mixing_rooms_lock = threading.Lock()
+user_data = {}  # Student records cached on first lookup
+
+def get_room(room_id):
+    """Return the room with this ID, creating it on first join"""
+    with rooms_lock:
+        room = rooms.get(room_id)
+        if room is None:
+            room = rooms[room_id] = Room(room_id)
+        return room
+
+def enter_room(room_id, user_info):
+    """Add a user to a room, retrying if the room was dropped meanwhile"""
+    while True:
+        room = get_room(room_id)
+        if room.add_user(user_info):
+            user_rooms[user_info['id']] = room.id
+            return room
+
+def mark_dirty(room):
+    with dirty_rooms_lock:
+        dirty_rooms.add(room)
+
+def broadcast_room_updates(room):
+    """Send the room's presence, hand and permission changes as one event"""
+    with room.lock:
+        if room.closed:
+            # Nobody is left, and a new room may reuse the ID
+            return
+        # Emitting under the lock keeps deltas in version order
+        update = room.take_updates()
+        if update is not None:
+            socketio.emit('room_update', update, room=lecture_room(room.id))
+
+def presence_ticker():
+    """Flush changed rooms every PRESENCE_TICK so bursts collapse into one event"""
+    global dirty_rooms
+    while True:
+        socketio.sleep(PRESENCE_TICK)
+        with dirty_rooms_lock:
+            batch, dirty_rooms = dirty_rooms, set()
+        for room in batch:
+            try:
+                broadcast_room_updates(room)
+            except Exception as e:
+                print(f"Presence tick error in {room.id}: {e}")
+
+class AudioRelay:
+    """Fans audio out from dedicated worker tasks, away from the signalling handlers.
+
+    A handler only queues the emit, so hands, permissions and chat never wait
+    behind a media broadcast. Each worker has a bounded queue and a sender
+    always maps to the same worker, keeping their frames in order. When a
+    queue is full the newest frame is dropped and counted: audio that
+    arrives late is useless anyway."""
+
+    def __init__(self, workers=AUDIO_WORKERS, depth=AUDIO_QUEUE_DEPTH):
+        self.queues = [queue.Queue(depth) for _ in range(max(workers, 1))]
+        self.lock = threading.Lock()  # Guards the counters
+        self.relayed = 0
+        self.dropped = 0
+
+    def start(self):
+        for pending in self.queues:
+            socketio.start_background_task(self._run, pending)
+
+    def send(self, sender, event, payload, room, to=None, skip_sid=None):
+        """Queue one emit to a member of room, or by default all of it; returns False if it was dropped"""
+        try:
+            self.queues[hash(sender) % len(self.queues)].put_nowait(
+                (event, payload, room, to or lecture_room(room.id), skip_sid))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def _run(self, pending):
+        while True:
+            event, payload, room, to, skip_sid = pending.get()
+            try:
+                send, skip_sid = send_queues.audio_skip(room, to, skip_sid)
+                if not send:
+                    continue
+                socketio.emit(event, payload, room=to, skip_sid=skip_sid)
+                with self.lock:
+                    self.relayed += 1
+            except Exception as e:
+                print(f"Audio relay error in {room.id}: {e}")
+
+    def stats(self):
+        with self.lock:
             return {
-                x: (e.touches[0].clientX - rect.left) * (canvas.width / rect.width),
-                y: (e.touches[0].clientY - rect.top) * (canvas.height / rect.height)
-            };
-        }
-        
-        function startDrawing(e) {
-            if (!isTeacher) return; // Only teachers can draw
-            
-            isDrawing = true;
-            const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
-            startX = pos.x;
-            startY = pos.y;
-            lastX = pos.x;
-            lastY = pos.y;
-            
-            if (currentTool === 'pen' || currentTool === 'eraser') {
-                ctx.beginPath();
-                ctx.moveTo(pos.x, pos.y);
-                
-                // Send initial point
-                const drawData = {
-                    tool: currentTool,
-                    color: currentTool === 'eraser' ? '#2a2a2a' : currentColor,
-                    size: currentBrushSize,
-                    startX: pos.x,
-                    startY: pos.y,
-                    endX: pos.x,
-                    endY: pos.y,
-                    type: 'start'
-                };
-                
-                socket.emit('whiteboard_draw', drawData);
+                'relayed': self.relayed,
+                'dropped': self.dropped,
+                'queued': sum(pending.qsize() for pending in self.queues)
             }
-        }
+
+audio_relay = AudioRelay()
+
+def client_backlog(sid):
+    """(messages, bytes) waiting in a connection's engine.io send queue, or None if unknown"""
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        waiting = socketio.server.eio.sockets[eio_sid].queue
+        if not waiting.qsize():
+            return 0, 0
+        packets = list(waiting.queue)
+    except (AttributeError, KeyError, TypeError):
+        return None
+    size = 0
+    for packet in packets:
+        data = getattr(packet, 'data', None)
+        if isinstance(data, (str, bytes, bytearray)):
+            size += len(data)
+    return len(packets), size
+
+class SendQueues:
+    """Bounds what the server buffers for each connection.
+
+    Socket.IO queues every emit per connection without limit, so a client on
+    a bad link can make the server buffer indefinitely. Every
+    SEND_CHECK_SECONDS each joined client's backlog is measured; one over
+    SEND_QUEUE_MAX_MESSAGES or SEND_QUEUE_MAX_BYTES is congested until it
+    drains. Congested clients are skipped for audio, which is stale by the
+    time it could arrive, and for live whiteboard operations, which are
+    coalesced into one whiteboard_state once the client recovers. Control
+    events always go out. A client congested for SLOW_CLIENT_SECONDS is
+    disconnected.
+
+    In cluster mode each worker measures and disconnects its own
+    connections, and the worker owning the room skips and resyncs them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.congested = {}  # sid -> when its backlog went over the limits
+        self.stale = {}  # sid -> last whiteboard seq sent before operations were skipped
+        self.measured = {}  # local sid -> (when its backlog went over the limits, room owner told)
+        self.counters = dict.fromkeys(
+            ('audio_dropped', 'whiteboard_coalesced', 'whiteboard_resynced', 'disconnected'), 0)
+
+    @staticmethod
+    def _skipped(skip_sid):
+        """skip_sid, which may be one sid, a list of them or None, as a list"""
+        if not skip_sid:
+            return []
+        return list(skip_sid) if isinstance(skip_sid, (list, tuple, set)) else [skip_sid]
+
+    def _slow_members(self, room, skipped):
+        return [sid for sid in self.congested if sid not in skipped and sid in room.active_users]
+
+    def audio_skip(self, room, to, skip_sid=None):
+        """Apply the audio policy to an emit to room's members: (send, skip_sid) with congested members skipped"""
+        with self.lock:
+            if not self.congested:
+                return True, skip_sid
+            if to in self.congested:
+                # Addressed to one congested client
+                self.counters['audio_dropped'] += 1
+                return False, skip_sid
+            if to != lecture_room(room.id):
+                return True, skip_sid
+            skipped = self._skipped(skip_sid)
+            slow = self._slow_members(room, skipped)
+            if not slow:
+                return True, skip_sid
+            self.counters['audio_dropped'] += len(slow)
+            return True, slow + skipped
+
+    def whiteboard_skip(self, room, seq, skip_sid):
+        """skip_sid for a live whiteboard operation; congested members are skipped and resynced later"""
+        with self.lock:
+            if not self.congested:
+                return skip_sid
+            skipped = self._skipped(skip_sid)
+            slow = self._slow_members(room, skipped)
+            if not slow:
+                return skip_sid
+            for sid in slow:
+                self.stale.setdefault(sid, seq - 1)
+            self.counters['whiteboard_coalesced'] += len(slow)
+            return slow + skipped
+
+    def forget(self, sid):
+        with self.lock:
+            self.congested.pop(sid, None)
+            self.stale.pop(sid, None)
+            self.measured.pop(sid, None)
+
+    def set_congested(self, sid, congested):
+        """Apply a client's congestion state on the worker owning its room, resyncing it on recovery"""
+        with self.lock:
+            if congested:
+                self.congested.setdefault(sid, time.monotonic())
+                return
+            self.congested.pop(sid, None)
+            if sid not in self.stale:
+                return
+            self.counters['whiteboard_resynced'] += 1
+            seq = self.stale.pop(sid)
+        room = room_for(sid)
+        if room is None:
+            return
+        with room.lock:
+            state = room.whiteboard_since(seq)
+            if state is not None:
+                socketio.emit('whiteboard_state', state, room=sid)
+                return
+        start_history_stream(room, sid)
+
+    def _report(self, sid, congested, owner, room_id):
+        """Hand a change in a local client's congestion state to the worker owning its room"""
+        if cluster is None or owner == cluster.id:
+            self.set_congested(sid, congested)
+        else:
+            cluster.forward(owner, room_id, 'client_congestion', sid, [congested])
+
+    def check(self):
+        """Measure every client connected to this worker, disconnecting the ones slow for too long.
+
+        The skip policy needs the room's state, so in cluster mode changes
+        are reported to the room's owner, which also does the resync."""
+        now = time.monotonic()
+        if cluster is None:
+            local = {sid: (None, room_id) for sid, room_id in list(user_rooms.items())}
+        else:
+            local = {sid: (cluster.owners.get(member[0], cluster.id), member[0])
+                     for sid, member in list(cluster.members.items())}
+        slow, changed = [], []
+        with self.lock:
+            for sid in list(self.measured):
+                if sid not in local:
+                    del self.measured[sid]
+        for sid, (owner, room_id) in local.items():
+            backlog = client_backlog(sid)
+            if backlog is None:
+                continue
+            messages, size = backlog
+            over = messages > SEND_QUEUE_MAX_MESSAGES or size > SEND_QUEUE_MAX_BYTES
+            with self.lock:
+                measured = self.measured.get(sid)
+                if over and measured is None:
+                    self.measured[sid] = (now, owner)
+                    changed.append((sid, True, owner, room_id))
+                elif over and now - measured[0] >= SLOW_CLIENT_SECONDS:
+                    self.counters['disconnected'] += 1
+                    slow.append(sid)
+                elif over and measured[1] != owner:
+                    # The room moved; its new owner hasn't heard
+                    self.measured[sid] = (measured[0], owner)
+                    changed.append((sid, True, owner, room_id))
+                elif not over and measured is not None:
+                    del self.measured[sid]
+                    changed.append((sid, False, owner, room_id))
+        for sid, congested, owner, room_id in changed:
+            self._report(sid, congested, owner, room_id)
+        for sid in slow:
+            print(f"Disconnecting slow client {sid}")
+            self.forget(sid)
+            socketio.server.disconnect(sid)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, congested=len(self.congested))
+
+send_queues = SendQueues()
+
+def send_queue_monitor():
+    """Apply the send queue limits every SEND_CHECK_SECONDS"""
+    while True:
+        socketio.sleep(SEND_CHECK_SECONDS)
+        try:
+            send_queues.check()
+        except Exception as e:
+            print(f"Send queue check error: {e}")
+
+def payload_size(value):
+    """Approximate bytes one event argument takes on the wire: binary at its length, the rest as JSON"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    try:
+        return len(json.dumps(value, separators=(',', ':')))
+    except (TypeError, ValueError):
+        pass  # Binary somewhere inside
+    if isinstance(value, dict):
+        return 2 + sum(payload_size(key) + payload_size(item) + 4 for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(payload_size(item) + 1 for item in value)
+    return len(str(value))
+
+def is_text(args):
+    """Whether every event argument is text or binary, so sized by its length alone"""
+    return all(isinstance(arg, (bytes, bytearray, str)) for arg in args)
+
+class PayloadBytes:
+    """Estimated bytes of one event's payloads.
+
+    Text and binary are measured on every call. Anything else is JSON-encoded
+    on one call in METRICS_SIZE_SAMPLE, and counted as the mean size of those
+    times the number of such payloads, so every payload isn't encoded a
+    second time and an event seen once or twice is still counted right.
+    Each payload has a weight: the copies of it sent."""
+
+    __slots__ = ('measured', 'calls', 'weight', 'sampled', 'sampled_weight')
+
+    def __init__(self):
+        self.measured = 0
+        self.calls = 0  # Payloads that aren't text, every METRICS_SIZE_SAMPLE-th of them sized
+        self.weight = 0
+        self.sampled = 0
+        self.sampled_weight = 0
+
+    def count(self, text, weight=1):
+        """Count one payload; True if the caller should size it and pass that to add()"""
+        if text:
+            return True
+        self.calls += 1
+        self.weight += weight
+        return (self.calls - 1) % METRICS_SIZE_SAMPLE == 0
+
+    def add(self, text, size, weight=1):
+        if text:
+            self.measured += size * weight
+        else:
+            self.sampled += size * weight
+            self.sampled_weight += weight
+
+    def total(self):
+        if not self.sampled_weight:
+            return self.measured
+        return self.measured + round(self.sampled * self.weight / self.sampled_weight)
+
+def metric_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """Counts per bucket; rendered cumulatively, as Prometheus expects"""
+
+    __slots__ = ('bounds', 'counts', 'total')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last is above every bound
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total:g}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+class Metrics:
+    """Per-event counters and histograms served at /metrics.
+
+    Incoming events are counted and sized where they arrive and timed where
+    their handler runs, which is the room's owner in cluster mode. Emits are
+    counted with their fan-out: how many of this worker's connections the
+    emit addresses. Bytes are estimated by PayloadBytes, with each emit
+    weighted by its fan-out."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = {}  # event -> [calls, PayloadBytes, forwarded]
+        self.latency = {}  # event -> Histogram of handler seconds
+        self.sent = {}  # event -> [emits, PayloadBytes]
+        self.fanout = {}  # event -> Histogram of recipients per emit
+
+    def received_event(self, event, args, forwarded=False):
+        text = is_text(args)
+        with self.lock:
+            counts = self.received.get(event)
+            if counts is None:
+                counts = self.received[event] = [0, PayloadBytes(), 0]
+            counts[0] += 1
+            counts[2] += forwarded
+            sample = counts[1].count(text)
+        if sample:
+            size = sum(payload_size(arg) for arg in args)
+            with self.lock:
+                counts[1].add(text, size)
+
+    def handled(self, event, seconds):
+        with self.lock:
+            histogram = self.latency.get(event)
+            if histogram is None:
+                histogram = self.latency[event] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def emitted(self, event, args, to, skip_sid, namespace='/'):
+        recipients = self._recipients(namespace, to, skip_sid)
+        text = is_text(args)
+        with self.lock:
+            counts = self.sent.get(event)
+            if counts is None:
+                counts = self.sent[event] = [0, PayloadBytes()]
+            counts[0] += 1
+            histogram = self.fanout.get(event)
+            if histogram is None:
+                histogram = self.fanout[event] = Histogram(FANOUT_BUCKETS)
+            histogram.observe(recipients)
+            # Nothing went out, so there is nothing to size
+            sample = recipients > 0 and counts[1].count(text, recipients)
+        if sample:
+            size = sum(payload_size(arg) for arg in args)
+            with self.lock:
+                counts[1].add(text, size, recipients)
+
+    def _recipients(self, namespace, to, skip_sid):
+        """Local connections an emit reaches; to=None broadcasts to all of them"""
+        try:
+            members = socketio.server.manager.rooms[namespace][to]
+        except (AttributeError, KeyError, TypeError):
+            return 0
+        count = len(members)
+        if skip_sid:
+            skipped = skip_sid if isinstance(skip_sid, (list, tuple, set)) else (skip_sid,)
+            count -= sum(1 for sid in skipped if sid in members)
+        return count
+
+    def render(self):
+        """The Prometheus text format: event metrics, then gauges read now"""
+        out = []
+
+        def family(name, kind, description):
+            out.append(f'# HELP {name} {description}')
+            out.append(f'# TYPE {name} {kind}')
+
+        with self.lock:
+            received = {event: [calls, size.total(), forwarded]
+                        for event, (calls, size, forwarded) in self.received.items()}
+            sent = {event: [emits, size.total()] for event, (emits, size) in self.sent.items()}
+            latency = [line for event, histogram in sorted(self.latency.items())
+                       for line in histogram.lines('edugrh_handler_seconds', f'event="{event}"')]
+            fanout = [line for event, histogram in sorted(self.fanout.items())
+                      for line in histogram.lines('edugrh_emit_recipients', f'event="{event}"')]
+
+        for name, index, description in (('edugrh_events_received_total', 0, 'Socket.IO events received'),
+                                         ('edugrh_event_bytes_received_total', 1, 'Estimated payload bytes received'),
+                                         ('edugrh_events_forwarded_total', 2, 'Events forwarded to the owning worker')):
+            family(name, 'counter', description)
+            out.extend(f'{name}{{event="{event}"}} {counts[index]}' for event, counts in sorted(received.items()))
+        family('edugrh_handler_seconds', 'histogram', 'Time spent in each event handler')
+        out.extend(latency)
+        for name, index, description in (('edugrh_emits_total', 0, 'Socket.IO emits'),
+                                         ('edugrh_emit_bytes_sent_total', 1, 'Estimated payload bytes sent')):
+            family(name, 'counter', description)
+            out.extend(f'{name}{{event="{event}"}} {counts[index]}' for event, counts in sorted(sent.items()))
+        family('edugrh_emit_recipients', 'histogram', 'Local connections addressed per emit')
+        out.extend(fanout)
+
+        with rooms_lock:
+            current = list(rooms.values())
+        room_gauges = []
+        for room in current:
+            with room.lock:
+                store = room.whiteboard_state
+                room_gauges.append((metric_label(room.id), len(room.active_users), len(store), store.points,
+                                    store.nbytes()))
+        for name, index, description in (('edugrh_room_users', 1, 'Users in each room'),
+                                         ('edugrh_whiteboard_strokes', 2, 'Strokes held in whiteboard_state'),
+                                         ('edugrh_whiteboard_points', 3, 'Points held in whiteboard_state'),
+                                         ('edugrh_whiteboard_bytes', 4, 'Approximate memory of whiteboard_state')):
+            family(name, 'gauge', description)
+            out.extend(f'{name}{{room="{gauge[0]}"}} {gauge[index]}' for gauge in room_gauges)
+
+        audio = audio_relay.stats()
+        family('edugrh_audio_relayed_total', 'counter', 'Audio emits fanned out by the relay workers')
+        out.append(f'edugrh_audio_relayed_total {audio["relayed"]}')
+        family('edugrh_audio_dropped_total', 'counter', 'Audio emits dropped on a full relay queue')
+        out.append(f'edugrh_audio_dropped_total {audio["dropped"]}')
+        family('edugrh_audio_queued', 'gauge', 'Audio emits waiting for a relay worker')
+        out.append(f'edugrh_audio_queued {audio["queued"]}')
+        queues = send_queues.stats()
+        family('edugrh_congested_clients', 'gauge', 'Connections over the send queue limits')
+        out.append(f'edugrh_congested_clients {queues.pop("congested")}')
+        family('edugrh_send_queue_events_total', 'counter', 'Send queue policy actions')
+        out.extend(f'edugrh_send_queue_events_total{{action="{action}"}} {count}' for action, count in queues.items())
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics()
+
+def audio_mixer():
+    """Mix every room with queued speakers each MIX_FRAME_MS.
+
+    Ticks follow a fixed schedule so the mixed stream keeps real time; after
+    a stall the schedule restarts rather than sending a burst of frames."""
+    interval = MIX_FRAME_MS / 1000
+    next_tick = time.monotonic()
+    while True:
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            socketio.sleep(delay)
+        else:
+            next_tick = time.monotonic()
+        with mixing_rooms_lock:
+            current = list(mixing_rooms)
+        for room in current:
+            try:
+                with room.lock:
+                    pcm = list(room.pcm_users)
+                mixed = room.mixer.mix(pcm)
+                if mixed is None:
+                    if not room.mixer:
+                        with mixing_rooms_lock:
+                            mixing_rooms.discard(room)
+                    continue
+                frame, pcm_frame, minus, speakers = mixed
+                audio_relay.send(room.id, 'audio_frame', {'user_id': 'mix', 'frame': frame}, room,
+                                 skip_sid=speakers + pcm)
+                for sid in pcm:
+                    if sid not in speakers:
+                        audio_relay.send(room.id, 'audio_frame', {'user_id': 'mix', 'frame': pcm_frame}, room, to=sid)
+                for sid, own in minus.items():
+                    audio_relay.send(room.id, 'audio_frame', {'user_id': 'mix', 'frame': own}, room, to=sid)
+            except Exception as e:
+                print(f"Audio mix error in {room.id}: {e}")
+
+class HistoryStream:
+    """One client's paged catch-up through a frozen copy of the whiteboard history"""
+
+    def __init__(self, parts, seq):
+        self.id = uuid.uuid4().hex[:8]
+        self.parts = parts
+        self.seq = seq
+        self.cursor = 0
+        self.page = 0
+
+    def next_page(self, page_bytes=WHITEBOARD_PAGE_BYTES):
+        """Records up to about page_bytes (at least one) as a whiteboard_page payload"""
+        start = end = self.cursor
+        size = 0
+        while end < len(self.parts) and (end == start or size + len(self.parts[end]) <= page_bytes):
+            size += len(self.parts[end])
+            end += 1
+        self.cursor = end
+        payload = {
+            'stream': self.id,
+            'page': self.page,
+            'seq': self.seq,
+            'strokes': '[' + ','.join(self.parts[start:end]) + ']',
+            'last': end >= len(self.parts)
+        }
+        self.page += 1
+        return payload
+
+history_streams = {}  # sid -> HistoryStream still waiting for acks
+
+def start_history_stream(room, sid):
+    """Send a client the whole whiteboard one page at a time, each after the last is acked.
+
+    Live updates keep flowing meanwhile; the client holds back those after
+    the stream's seq until the last page has been drawn."""
+    with room.lock:
+        # Page 0 goes out before any operation it doesn't include, so the client holds all of those
+        parts, seq = room.whiteboard_state.history()
+        stream = HistoryStream(parts, seq)
+        page = stream.next_page()
+        if page['last']:
+            history_streams.pop(sid, None)
+        else:
+            history_streams[sid] = stream
+        socketio.emit('whiteboard_page', page, room=sid)
+
+def whiteboard_compactor():
+    """Every WHITEBOARD_CHECKPOINT_SECONDS, fold finished strokes into each room's checkpoint and drop hidden ones"""
+    while True:
+        socketio.sleep(WHITEBOARD_CHECKPOINT_SECONDS)
+        with rooms_lock:
+            current = list(rooms.values())
+        for room in current:
+            try:
+                with room.lock:
+                    room.whiteboard_state.compact()
+            except Exception as e:
+                print(f"Whiteboard compaction error in {room.id}: {e}")
+
+def send_presence_snapshot(room, sid):
+    """Send one client the full user and hand lists"""
+    socketio.emit('presence_snapshot', room.presence_snapshot(), room=sid)
+
+def room_for(sid):
+    """Return the room a connection has joined, or None"""
+    room_id = user_rooms.get(sid)
+    return rooms.get(room_id) if room_id is not None else None
+
+def discard_room_if_empty(room):
+    with rooms_lock:
+        with room.lock:
+            if not room.active_users and rooms.get(room.id) is room:
+                room.closed = True
+                del rooms[room.id]
+            else:
+                return
+    if cluster is not None:
+        cluster.release(room.id)
+
+def abandon_room(room_id):
+    """Drop this worker's copy of a room that another worker has taken over"""
+    with rooms_lock:
+        room = rooms.pop(room_id, None)
+    if room is None:
+        return
+    with room.lock:
+        room.closed = True
+        members = list(room.active_users)
+    for sid in members:
+        if user_rooms.get(sid) == room_id:
+            del user_rooms[sid]
+        history_streams.pop(sid, None)
+
+def join_target(data):
+    """Room ID and whiteboard encoding requested by a user_join payload; the ID is None if invalid"""
+    room_id = str(data.get('room') or DEFAULT_ROOM)
+    if not ROOM_ID_PATTERN.fullmatch(room_id):
+        room_id = None
+    return room_id, 'binary' if data.get('wire') == 'binary' else 'json'
+
+def lecture_room(room_id):
+    """Socket.IO room for every member of a lecture; the prefix keeps it apart from sids"""
+    return f"lecture:{room_id}"
+
+def wire_room(room_id, wire):
+    """Socket.IO room for the members of a lecture that use one whiteboard encoding"""
+    return f"lecture:{room_id}:{wire}"
+
+def encode_forwarded(event, sid, args):
+    """Bus message for an event forwarded to another worker: JSON, with binary arguments as base64"""
+    return json.dumps([event, sid, args], separators=(',', ':'),
+                      default=lambda value: {'$bytes': base64.b64encode(value).decode('ascii')})
+
+def decode_forwarded(data):
+    """(event, sid, args) from encode_forwarded; raises ValueError if malformed"""
+    def restore(obj):
+        if len(obj) == 1 and isinstance(obj.get('$bytes'), str):
+            return base64.b64decode(obj['$bytes'], validate=True)
+        return obj
+
+    event, sid, args = json.loads(data, object_hook=restore)
+    if not isinstance(event, str) or not isinstance(sid, str) or not isinstance(args, list):
+        raise ValueError("malformed forwarded event")
+    return event, sid, args
+
+class Cluster:
+    """This worker's link to the others sharing MESSAGE_QUEUE.
+
+    A room is owned by the worker that claims it first, which keeps all of
+    its state; other workers forward events about the room to the owner
+    over the bus. The owner's emits go out through Socket.IO's message queue,
+    so each worker delivers them to its own connections, and each worker
+    subscribes its connections to their rooms itself.
+
+    An owner that stops listening or loses its lease loses the room: the
+    first worker to notice claims it, or finds out who did, and rejoins its
+    own members there. Whatever state the old owner held is gone."""
+
+    def __init__(self, url, worker_id=WORKER_ID):
+        import redis
+        self.id = worker_id
+        self.redis = redis.Redis.from_url(url)
+        self.watch_error = redis.WatchError
+        self.lock = threading.Lock()  # One re-homing at a time
+        self.members = {}  # local sid -> (room id, wire, user_join payload)
+        self.owners = {}  # room id -> owning worker, for rooms with local members
+
+    def _channel(self, worker_id):
+        return f"edugrh:worker:{worker_id}"
+
+    def _key(self, room_id):
+        return f"edugrh:room:{room_id}"
+
+    def claim(self, room_id):
+        """The worker owning a room, which becomes this one if nobody does"""
+        key = self._key(room_id)
+        while True:
+            if self.redis.set(key, self.id, nx=True, ex=ROOM_LEASE_SECONDS):
+                return self.id
+            owner = self.redis.get(key)
+            if owner is not None:
+                return owner.decode()
+
+    def _if_owner(self, room_id, apply):
+        """Run apply(pipeline, key) atomically if this worker still holds the room's lease"""
+        key = self._key(room_id)
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != self.id.encode():
+                    return False
+                pipe.multi()
+                apply(pipe, key)
+                pipe.execute()
+                return True
+            except self.watch_error:
+                return False  # Changed since the check
+
+    def release(self, room_id):
+        self._if_owner(room_id, lambda pipe, key: pipe.delete(key))
+
+    def renew(self):
+        """Extend the lease on every room this worker owns, and notice rooms whose owner changed"""
+        with rooms_lock:
+            owned = list(rooms)
+        for room_id in owned:
+            if not self._if_owner(room_id, lambda pipe, key: pipe.expire(key, ROOM_LEASE_SECONDS)):
+                # Stalled past the lease: take the room back if it's free, otherwise hand it over
+                self.rehome(room_id)
+        for room_id, owner in list(self.owners.items()):
+            if owner != self.id and self.redis.get(self._key(room_id)) != owner.encode():
+                self.rehome(room_id)
+
+    def rehome(self, room_id):
+        """Find a room's owner again; if it changed, rejoin this worker's members there. Returns the owner"""
+        with self.lock:
+            owner = self.claim(room_id)
+            if owner != self.id:
+                abandon_room(room_id)
+            local = [(sid, join) for sid, (member_room, _, join) in list(self.members.items())
+                     if member_room == room_id]
+            if not local:
+                self.owners.pop(room_id, None)
+                return owner
+            if self.owners.get(room_id) == owner:
+                return owner
+            self.owners[room_id] = owner
+            print(f"Room {room_id} moved to worker {owner}; rejoining {len(local)} members")
+            for sid, join in local:
+                self.deliver(owner, 'user_join', sid, [join])
+            return owner
+
+    def route(self, event, sid, args):
+        """(worker that handles an event from a local connection, its room), keeping room subscriptions"""
+        if event == 'user_join':
+            room_id, wire = join_target(args[0])
+            if room_id is None:
+                return self.id, None  # The handler rejects it
+            if sid in self.members:
+                # Joining again moves the user: leave the current room first
+                self.forward(*self._leave(sid), 'user_leave', sid, [])
+            join_room(lecture_room(room_id))
+            join_room(wire_room(room_id, wire))
+            self.members[sid] = (room_id, wire, args[0])
+            owner = self.owners.get(room_id)
+            if owner is None:
+                owner = self.owners[room_id] = self.claim(room_id)
+            return owner, room_id
+        member = self.members.get(sid)
+        if member is None:
+            return self.id, None  # Not in a room; the handler ignores it
+        if event in ('user_leave', 'disconnect'):
+            return self._leave(sid)
+        room_id = member[0]
+        return self.owners.get(room_id, self.id), room_id
+
+    def _leave(self, sid):
+        """Drop a local member and its room subscriptions; returns (owner, room id) of the room it left"""
+        room_id, wire, _ = self.members.pop(sid)
+        owner = self.owners.get(room_id, self.id)
+        leave_room(lecture_room(room_id))
+        leave_room(wire_room(room_id, wire))
+        if not any(member[0] == room_id for member in list(self.members.values())):
+            self.owners.pop(room_id, None)
+        return owner, room_id
+
+    def deliver(self, owner, event, sid, args):
+        """Handle an event here or publish it to its owner; False if nobody listens there"""
+        if owner == self.id:
+            self.handle(event, sid, args)
+            return True
+        return self.redis.publish(self._channel(owner), encode_forwarded(event, sid, args)) > 0
+
+    def forward(self, owner, room_id, event, sid, args):
+        """Send an event to the room's owner, re-homing the room if the owner has gone"""
+        if self.deliver(owner, event, sid, args):
+            return
+        current = self.rehome(room_id)
+        if current == owner:
+            print(f"Worker {owner} is gone; dropped {event} from {sid} until its lease on {room_id} runs out")
+        elif event != 'user_join':  # Re-homing rejoined the sender already
+            self.deliver(current, event, sid, args)
+
+    def handle(self, event, sid, args):
+        """Run a handler for a connection that may be held by another worker"""
+        with app.test_request_context('/'):
+            request.sid = sid
+            request.namespace = '/'
+            request.forwarded = True
+            room_handlers[event](*args)
+
+    def listen(self):
+        """Handle events forwarded by other workers, in the order they were sent"""
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._channel(self.id))
+        for message in pubsub.listen():
+            event = None
+            try:
+                event, sid, args = decode_forwarded(message['data'])
+                self.handle(event, sid, args)
+            except Exception as e:
+                print(f"Forwarded {event} error: {e}")
+
+cluster = Cluster(MESSAGE_QUEUE) if MESSAGE_QUEUE else None
+room_handlers = {}  # event -> handler, for events forwarded by other workers
+
+def room_event(event):
+    """Register a Socket.IO handler that works on the sender's room.
+
+    In cluster mode, an event from a connection whose room another worker
+    owns is forwarded there and handled as if the connection were local."""
+    def register(handler):
+        @functools.wraps(handler)
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                metrics.handled(event, time.perf_counter() - start)
+
+        room_handlers[event] = timed
+
+        @functools.wraps(handler)
+        def dispatch(*args):
+            if cluster is None:
+                metrics.received_event(event, args)
+                return timed(*args)
+            owner, room_id = cluster.route(event, request.sid, args)
+            metrics.received_event(event, args, forwarded=owner != cluster.id)
+            if owner == cluster.id:
+                return timed(*args)
+            cluster.forward(owner, room_id, event, request.sid, args)
+
+        socketio.on(event)(dispatch)
+        return handler
+    return register
+
+def is_forwarded():
+    """True while handling an event for a connection held by another worker"""
+    return getattr(request, 'forwarded', False)
+
+def room_lease_keeper():
+    """Renew this worker's room leases well before they run out, and check on other owners'"""
+    while True:
+        socketio.sleep(ROOM_LEASE_SECONDS / 3)
+        try:
+            cluster.renew()
+        except Exception as e:
+            print(f"Room lease error: {e}")
+
+# File to store user data
+USER_DATA_FILE = 'sads.py'  # Legacy format, imported once into the database
+USER_DB_FILE = os.environ.get('USER_DB_FILE', 'students.db')
+
+# Single shared connection; SQLite in WAL mode keeps each upsert O(1)
+user_db = None
+user_db_lock = threading.Lock()
+
+def get_user_db():
+    """Open the student database on first use, importing sads.py if the database is new"""
+    global user_db
+    if user_db is None:
+        db = sqlite3.connect(USER_DB_FILE, check_same_thread=False, timeout=30)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS students ('
+            ' username TEXT PRIMARY KEY,'
+            ' name TEXT NOT NULL,'
+            ' phone TEXT NOT NULL,'
+            ' join_time TEXT NOT NULL,'
+            ' total_sessions INTEGER NOT NULL DEFAULT 1)'
+        )
+        db.commit()
+        if os.path.exists(USER_DATA_FILE) and db.execute('SELECT 1 FROM students LIMIT 1').fetchone() is None:
+            imported = insert_legacy_user_data(db, USER_DATA_FILE)
+            if imported:
+                print(f"Imported {imported} students from {USER_DATA_FILE}")
+        user_db = db
+    return user_db
+
+# Write-behind queue: joins only record the latest row per username and a
+# background writer commits them in batches
+USER_WRITE_INTERVAL = int(os.environ.get('USER_WRITE_INTERVAL_MS', 200)) / 1000
+USER_WRITE_BATCH = int(os.environ.get('USER_WRITE_BATCH', 500))
+pending_user_writes = {}
+user_write_cond = threading.Condition()
+user_flush_lock = threading.Lock()
+
+def save_user(username, data):
+    """Queue a student record for the background writer"""
+    with user_write_cond:
+        pending_user_writes[username] = dict(data)
+        if len(pending_user_writes) >= USER_WRITE_BATCH:
+            user_write_cond.notify()
+
+def flush_user_writes(checkpoint=False):
+    """Commit all queued student records in one transaction"""
+    global pending_user_writes
+    with user_flush_lock:
+        with user_write_cond:
+            batch = pending_user_writes
+            pending_user_writes = {}
+        if not batch and (not checkpoint or user_db is None):
+            return
+        try:
+            with user_db_lock:
+                db = get_user_db()
+                if batch:
+                    db.executemany(
+                        'INSERT INTO students (username, name, phone, join_time, total_sessions) '
+                        'VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT(username) DO UPDATE SET total_sessions = excluded.total_sessions',
+                        [
+                            (username, data.get('name', ''), data.get('phone', ''),
+                             data.get('join_time', ''), data.get('total_sessions', 1))
+                            for username, data in batch.items()
+                        ]
+                    )
+                    db.commit()
+                    batch = {}
+                if checkpoint:
+                    # Fold the WAL back into the main file so the data survives a hard stop
+                    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except Exception as e:
+            print(f"Error saving user data: {e}")
+            # Retry on the next flush; records queued since are newer
+            with user_write_cond:
+                for username, data in batch.items():
+                    pending_user_writes.setdefault(username, data)
+
+def user_writer():
+    """Flush queued student records every USER_WRITE_INTERVAL or USER_WRITE_BATCH changes"""
+    while True:
+        with user_write_cond:
+            user_write_cond.wait_for(lambda: len(pending_user_writes) >= USER_WRITE_BATCH,
+                                     timeout=USER_WRITE_INTERVAL)
+        flush_user_writes()
+
+def shutdown_user_writer(signum=None, frame=None):
+    """Flush pending student records before the process exits"""
+    flush_user_writes(checkpoint=True)
+    if signum is not None:
+        sys.exit(0)
+
+user_writer_thread = threading.Thread(target=user_writer, daemon=True)
+user_writer_thread.start()
+atexit.register(shutdown_user_writer)
+try:
+    signal.signal(signal.SIGTERM, shutdown_user_writer)
+except ValueError:
+    # Not imported from the main thread; atexit still flushes
+    pass
+
+def read_legacy_user_data(path):
+    """Parse a sads.py roster without executing it"""
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            names = [t.id for t in node.targets if isinstance(t, ast.Name)]
+            if 'student_data' in names or 'user_data' in names:
+                return ast.literal_eval(node.value)
+    return {}
+
+def insert_legacy_user_data(db, path):
+    """Copy a sads.py roster into the database, keeping rows already there"""
+    legacy = read_legacy_user_data(path)
+    rows = [
+        (username, data.get('name', ''), data.get('phone', ''),
+         data.get('join_time', ''), data.get('total_sessions', 1))
+        for username, data in legacy.items()
+    ]
+    db.executemany(
+        'INSERT OR IGNORE INTO students (username, name, phone, join_time, total_sessions) '
+        'VALUES (?, ?, ?, ?, ?)',
+        rows
+    )
+    db.commit()
+    return len(rows)
+
+def import_legacy_user_data(path=USER_DATA_FILE):
+    """One-shot import of an existing sads.py file into the database"""
+    with user_db_lock:
+        return insert_legacy_user_data(get_user_db(), path)
+
+def load_user_data():
+    """Open the student database now rather than on the first join.
+
+    Records are not read here; get_user_record() fetches them on first use so
+    startup time does not grow with the roster."""
+    try:
+        with user_db_lock:
+            get_user_db()
+    except Exception as e:
+        print(f"Error loading user data: {e}")
+
+def get_user_record(username):
+    """Return a student's record, reading it from the database on first use"""
+    if username in user_data:
+        return user_data[username]
+    with user_write_cond:
+        pending = pending_user_writes.get(username)
+    if pending is not None:
+        user_data[username] = dict(pending)
+        return user_data[username]
+    try:
+        with user_db_lock:
+            row = get_user_db().execute(
+                'SELECT name, phone, join_time, total_sessions FROM students WHERE username = ?',
+                (username,)
+            ).fetchone()
+    except Exception as e:
+        print(f"Error loading user data: {e}")
+        return None
+    if row is None:
+        return None
+    name, phone, join_time, total_sessions = row
+    user_data[username] = {
+        'name': name,
+        'phone': phone,
+        'join_time': join_time,
+        'total_sessions': total_sessions
+    }
+    return user_data[username]
+
+def count_users():
+    """Number of registered students, including ones still queued for writing"""
+    flush_user_writes()
+    try:
+        with user_db_lock:
+            return get_user_db().execute('SELECT COUNT(*) FROM students').fetchone()[0]
+    except Exception as e:
+        print(f"Error counting users: {e}")
+        return len(user_data)
+
+# HTML Template with all features FIXED
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Smart Board - Online Teaching Platform</title>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+</head>
+<body>
+    <!-- Login Modal -->
+    <div id="loginModal" class="modal" style="display: block;">
+        <div class="modal-content">
+            <h2 style="text-align: center; color: #4CAF50; margin-bottom: 20px;">Join Smart Board</h2>
+            <form id="loginForm">
+                <div class="form-group">
+                    <label>Full Name:</label>
+                    <input type="text" id="fullName" required placeholder="Enter your full name">
+                </div>
+                <div class="form-group">
+                    <label>Username:</label>
+                    <input type="text" id="username" required placeholder="Choose a username">
+                </div>
+                <div class="form-group">
+                    <label>Phone Number:</label>
+                    <input type="tel" id="phoneNumber" required placeholder="Enter your phone number">
+                </div>
+                <div class="form-group">
+                    <label>Class ID:</label>
+                    <input type="text" id="roomId" placeholder="lecture_room">
+                </div>
+                <div class="form-group">
+                    <label>Join as:</label>
+                    <select id="userRole" required>
+                        <option value="">Select your role</option>
+                        <option value="teacher">Teacher (Can draw and control lecture)</option>
+                        <option value="student">Student (View and participate)</option>
+                    </select>
+                </div>
+                <button type="submit" class="btn btn-primary" style="width: 100%; margin-top: 20px;">Join Lecture</button>
+            </form>
+        </div>
+    </div>
+
+    <!-- Main Application -->
+    <div class="container hidden" id="mainApp">
+        <div class="header">
+            <div class="logo">📚 Smart Board</div>
+            <div class="controls">
+                <span id="userInfo"></span>
+                <button class="btn btn-warning" id="raiseHandBtn" onclick="toggleRaiseHand()">🙋‍♂️ Raise Hand</button>
+                <button class="btn btn-primary" id="startLectureBtn" onclick="toggleLecture()">Start Lecture</button>
+                <button class="btn btn-danger" onclick="leaveLecture()">Leave</button>
+            </div>
+        </div>
         
-        function draw(e) {
-            if (!isDrawing || !isTeacher) return;
-            
-            e.preventDefault();
-            const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
+        <div class="main-content">
+            <div class="whiteboard-container">
+                <div class="toolbar">
+                    <div class="tool-group">
+                        <button class="btn btn-primary tool-active" id="penTool" onclick="setTool('pen')">✏️ Pen</button>
+                        <button class="btn btn-primary" id="eraserTool" onclick="setTool('eraser')">🗑️ Eraser</button>
+                        <input type="color" id="colorPicker" value="#ffffff" onchange="setColor(this.value)" title="Drawing Color">
+                        <input type="range" id="brushSize" min="1" max="20" value="3" onchange="setBrushSize(this.value)" title="Brush Size">
+                        <span id="brushSizeDisplay">3px</span>
+                    </div>
+                    <div class="tool-group">
+                        <button class="btn btn-primary" id="lineTool" onclick="setTool('line')">📏 Line</button>
+                        <button class="btn btn-primary" id="rectTool" onclick="setTool('rect')">⬛ Rectangle</button>
+                        <button class="btn btn-primary" id="circleTool" onclick="setTool('circle')">⭕ Circle</button>
+                        <button class="btn btn-warning" onclick="clearBoard()">🗑️ Clear All</button>
+                    </div>
+                </div>
+                <canvas id="whiteboard" class="whiteboard"></canvas>
+            </div>
             
-            if (currentTool === 'pen' || currentTool === 'eraser') {
-                // Draw locally
-                ctx.strokeStyle = currentTool === 'eraser' ? '#2a2a2a' : currentColor;
-                ctx.lineWidth = currentBrushSize;
-                ctx.lineTo(pos.x, pos.y);
-                ctx.stroke();
-                
-                // Send drawing data
-                const drawData = {
-                    tool: currentTool,
-                    color: currentTool === 'eraser' ? '#2a2a2a' : currentColor,
-                    size: currentBrushSize,
-                    startX: lastX,
-                    startY: lastY,
-                    endX: pos.x,
-                    endY: pos.y,
-                    type: 'draw'
-                };
-                
-                socket.emit('whiteboard_draw', drawData);
+            <div class="sidebar">
+                <div class="sidebar-tabs">
+                    <div class="tab active" onclick="showTab('users')">Users</div>
+                    <div class="tab" onclick="showTab('chat')">Chat</div>
+                    <div class="tab" onclick="showTab('audio')">Audio</div>
+                </div>
                 
-                lastX = pos.x;
-                lastY = pos.y;
-            }
-        }
-        
-        function stopDrawing(e) {
-            if (!isDrawing || !isTeacher) return;
-            
-            isDrawing = false;
-            
-            if (currentTool === 'line' || currentTool === 'rect' || currentTool === 'circle') {
-                const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
-                drawShape(currentTool, startX, startY, pos.x, pos.y);
-            }
-        }
-        
-        function handleTouch(e) {
-            e.preventDefault();
-            
-            const touch = e.touches[0];
-            const mouseEvent = new MouseEvent(
-                e.type === 'touchstart' ? 'mousedown' : 
-                e.type === 'touchmove' ? 'mousemove' : 'mouseup', {
-                clientX: touch.clientX,
-                clientY: touch.clientY,
-                bubbles: true
-            });
-            
-            canvas.dispatchEvent(mouseEvent);
-        }
-        
-        function drawOnCanvas(data) {
-            ctx.strokeStyle = data.color;
-            ctx.lineWidth = data.size;
-            ctx.lineCap = 'round';
-            ctx.lineJoin = 'round';
-            
-            switch (data.tool) {
-                case 'pen':
-                case 'eraser':
-                    if (data.type === 'start') {
-                        ctx.beginPath();
-                        ctx.moveTo(data.startX, data.startY);
-                    } else {
-                        ctx.lineTo(data.endX, data.endY);
-                        ctx.stroke();
-                    }
-                    break;
-                case 'line':
-                    drawLine(data.startX, data.startY, data.endX, data.endY);
-                    break;
-                case 'rect':
-                    drawRectangle(data.startX, data.startY, data.endX, data.endY);
-                    break;
-                case 'circle':
-                    drawCircle(data.startX, data.startY, data.endX, data.endY);
-                    break;
-            }
-        }
-        
-        function setTool(tool) {
-            currentTool = tool;
-            
-            // Remove active class from all tools
-            document.querySelectorAll('.toolbar .btn').forEach(btn => {
-                btn.classList.remove('tool-active');
-            });
-            
-            // Add active class to selected tool
-            const toolMap = {
-                'pen': 'penTool',
-                'eraser': 'eraserTool',
-                'line': 'lineTool',
-                'rect': 'rectTool',
-                'circle': 'circleTool'
-            };
-            
-            if (toolMap[tool]) {
-                document.getElementById(toolMap[tool]).classList.add('tool-active');
-            }
-            
-            // Update cursor
-            canvas.style.cursor = tool === 'eraser' ? 'crosshair' : 'crosshair';
-        }
-        
-        function setColor(color) {
-            currentColor = color;
-        }
-        
-        function setBrushSize(size) {
-            currentBrushSize = parseInt(size);
-            document.getElementById('brushSizeDisplay').textContent = size + 'px';
-        }
-        
-        function clearBoard() {
-            if (!isTeacher) return;
-            
-            if (confirm('Are you sure you want to clear the whiteboard?')) {
-                clearCanvas();
-                socket.emit('whiteboard_clear');
-            }
-        }
-        
-        function clearCanvas() {
-            ctx.clearRect(0, 0, canvas.width, canvas.height);
-        }
-        
-        function drawLine(x1, y1, x2, y2) {
-            ctx.beginPath();
-            ctx.moveTo(x1, y1);
-            ctx.lineTo(x2, y2);
-            ctx.stroke();
-        }
-        
-        function drawRectangle(x1, y1, x2, y2) {
-            const width = x2 - x1;
-            const height = y2 - y1;
-            ctx.beginPath();
-            ctx.rect(x1, y1, width, height);
-            ctx.stroke();
-        }
-        
-        function drawCircle(x1, y1, x2, y2) {
-            const radius = Math.sqrt(Math.pow(x2 - x1, 2) + Math.pow(y2 - y1, 2));
-            ctx.beginPath();
-            ctx.arc(x1, y1, radius, 0, 2 * Math.PI);
-            ctx.stroke();
-        }
-        
-        function drawShape(tool, x1, y1, x2, y2) {
-            ctx.strokeStyle = currentColor;
-            ctx.lineWidth = currentBrushSize;
-            
-            const drawData = {
-                tool: tool,
-                color: currentColor,
-                size: currentBrushSize,
-                startX: x1,
-                startY: y1,
-                endX: x2,
-                endY: y2,
-                type: 'shape'
-            };
-            
-            switch (tool) {
-                case 'line':
-                    drawLine(x1, y1, x2, y2);
-                    break;
-                case 'rect':
-                    drawRectangle(x1, y1, x2, y2);
-                    break;
-                case 'circle':
-                    drawCircle(x1, y1, x2, y2);
-                    break;
-            }
-            
-            socket.emit('whiteboard_draw', drawData);
-        }
-        
-        // Utility functions
-        function generateUniqueId() {
-            return Math.random().toString(36).substr(2, 9) + Date.now().toString(36);
-        }
-        
-        function givePermissionToSpeak(userId) {
-            socket.emit('give_permission', { user_id: userId });
-        }
-        
-        // Handle disconnection
-        window.addEventListener('beforeunload', function() {
-            if (localStream) {
-                localStream.getTracks().forEach(track => track.stop());
-            }
-            if (socket) {
-                socket.emit('user_leave');
-            }
-        });
-        
-        // Auto-resize canvas when window resizes
-        let resizeTimeout;
-        window.addEventListener('resize', function() {
-            clearTimeout(resizeTimeout);
-            resizeTimeout = setTimeout(resizeCanvas, 100);
-        });
-    </script>
+                <div class="tab-content">
+                    <!-- Users Tab -->
+                    <div id="usersTab">
+                        <div class="lecture-status">
+                            <div class="status-indicator" id="lectureIndicator"></div>
+                            <span id="lectureStatusText">Lecture Not Started</span>
+                        </div>
+                        
+                        <h3>Online Users (<span id="userCount">0</span>)</h3>
+                        <div id="usersList"></div>
+                        
+                        <div style="margin-top: 20px;">
+                            <h4>Raised Hands (<span id="handsCount">0</span>)</h4>
+                            <div id="raisedHandsList"></div>
+                        </div>
+                    </div>
+                    
+                    <!-- Chat Tab -->
+                    <div id="chatTab" class="hidden">
+                        <h3>Chat Messages</h3>
+                        <div class="chat-messages" id="chatMessages"></div>
+                        <div class="chat-input">
+                            <input type="text" id="chatInput" placeholder="Type a message..." onkeypress="sendChatOnEnter(event)">
+                            <button class="btn btn-primary" onclick="sendChat()">Send</button>
+                        </div>
+                    </div>
+                    
+                    <!-- Audio Tab -->
+                    <div id="audioTab" class="hidden">
+                        <h3>Audio Controls</h3>
+                        <div class="audio-controls">
+                            <button class="btn btn-primary" id="micBtn" onclick="toggleMicrophone()">🎤 Mic Off</button>
+                            <button class="btn btn-primary" id="speakerBtn" onclick="toggleSpeaker()">🔊 Speaker On</button>
+                        </div>
+                        
+                        <div style="margin: 15px 0;">
+                            <label>Volume:</label>
+                            <input type="range" class="volume-slider" id="volumeSlider" min="0" max="100" value="80" onchange="setVolume(this.value)">
+                            <span id="volumeValue">80%</span>
+                        </div>
+                        
+                        <div class="audio-visualizer" id="audioVisualizer">
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                            <div class="bar"></div>
+                        </div>
+                        
+                        <div style="margin-top: 15px;">
+                            <h4>Audio Settings</h4>
+                            <label><input type="checkbox" id="autoGainControl"> Auto Gain Control</label><br>
+                            <label><input type="checkbox" id="noiseSuppression" checked> Noise Suppression</label><br>
+                            <label><input type="checkbox" id="echoCancellation" checked> Echo Cancellation</label>
+                        </div>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>
+
+    <script src="{{ asset_url('socket.io.min.js') }}"></script>
+    <script src="{{ asset_url('app.js') }}"></script>
 </body>
 </html>
 """
 
+class StaticAsset:
+    """A response body built once, with its compressed forms and their strong ETags.
+
+    Each encoding is a separate representation with its own ETag, so a
+    conditional request only matches the bytes the client actually holds."""
+
+    def __init__(self, body, mimetype, cache_control='no-cache'):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.encoded = {None: (body, self.digest), 'gzip': (gzip.compress(body, 9, mtime=0), self.digest + '-gz')}
+        if brotli is not None:
+            self.encoded['br'] = (brotli.compress(body, quality=11), self.digest + '-br')
+
+    def response(self):
+        """The body in the best encoding the client accepts, or a 304 if it has it already"""
+        encoding = next((name for name in ('br', 'gzip')
+                         if name in self.encoded and request.accept_encodings[name]), None)
+        body, etag = self.encoded[encoding]
+        response = app.response_class(body, mimetype=self.mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response.make_conditional(request)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_FILES = ('app.css', 'app.js', 'socket.io.min.js')
+STATIC_TYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+# Fingerprinted URLs change with the content, so browsers never need to revalidate
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{}:;,>]) ?', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+def minify_js(text):
+    """Drop indentation, blank lines and whole-line comments; line breaks stay so semicolon insertion is unchanged"""
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def build_static_assets():
+    """Minify, compress and fingerprint STATIC_FILES; returns the assets by URL name and a map of file to URL"""
+    assets, urls = {}, {}
+    for name in STATIC_FILES:
+        with open(os.path.join(STATIC_DIR, name), 'r', encoding='utf-8') as f:
+            text = f.read()
+        stem, ext = os.path.splitext(name)
+        if not stem.endswith('.min'):
+            text = minify_css(text) if ext == '.css' else minify_js(text)
+        asset = StaticAsset(text, STATIC_TYPES[ext], IMMUTABLE)
+        fingerprinted = f"{stem}.{asset.digest[:12]}{ext}"
+        assets[fingerprinted] = asset
+        urls[name] = f"/static/{fingerprinted}"
+    return assets, urls
+
+static_assets, static_urls = build_static_assets()
+
+def build_index_page():
+    """Render the page once, pointing at the fingerprinted assets; it has no per-request content"""
+    with app.app_context():
+        return StaticAsset(render_template_string(HTML_TEMPLATE, asset_url=static_urls.__getitem__), 'text/html')
+
+index_page = build_index_page()
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # Browsers revalidate on every load and usually get a 304
+    return index_page.response()
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = static_assets.get(name)
+    if asset is None:
+        return 'Not found', 404
+    return asset.response()
 
-@socketio.on('user_join')
+@room_event('user_join')
 def handle_user_join(data):
     user_id = request.sid
+    room_id, wire = join_target(data)
+    if room_id is None:
+        emit('join_rejected', {'message': 'Room IDs are 1-64 characters without "/" or ":"'})
+        return
+    if user_id in user_rooms:
+        # Joining again moves the user: leave the current room first
+        handle_user_leave()
     user_info = {
         'id': user_id,
         'fullName': data['fullName'],
@@ -1389,15 +2273,21 @@ def handle_user_join(data):
         'role': data['role'],
         'hand_raised': False,
         'speaking_permission': False,
-        'join_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'join_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        # Whiteboard encoding this client understands: 'binary' or 'json'
+        'wire': wire,
+        # 'pcm16' if it can't decode Opus, so the server mix must reach it uncompressed
+        'audio': 'pcm16' if data.get('audio') == 'pcm16' else 'opus'
     }
     
-    active_users[user_id] = user_info
+    # Adds the user to the room; a second teacher joins as a student
+    room = enter_room(room_id, user_info)
     
-    # Save user data to file
+    # Save user data to the student database
     username = data['username']
-    if username in user_data:
-        user_data[username]['total_sessions'] = user_data[username].get('total_sessions', 0) + 1
+    record = get_user_record(username)
+    if record is not None:
+        record['total_sessions'] = record.get('total_sessions', 0) + 1
     else:
         user_data[username] = {
             'name': data['fullName'],
@@ -1406,192 +2296,297 @@ def handle_user_join(data):
             'total_sessions': 1
         }
     
-    save_user_data()
-    
-    # Set teacher if this is a teacher
-    global teacher_id
-    if data['role'] == 'teacher':
-        if teacher_id is None:
-            teacher_id = user_id
-        else:
-            # If there's already a teacher, make this user a student
-            user_info['role'] = 'student'
-            active_users[user_id] = user_info
+    save_user(username, user_data[username])
     
-    # Join a room for broadcasting
-    join_room('lecture_room')
+    # Join the lecture's room for broadcasting, plus the room for its whiteboard encoding;
+    # a connection held by another worker was subscribed there
+    if not is_forwarded():
+        join_room(lecture_room(room.id))
+        join_room(wire_room(room.id, wire))
     
-    # Send current whiteboard state to new user
-    if whiteboard_state:
-        emit('whiteboard_state', {'operations': whiteboard_state})
+    # Stream the whiteboard history to the new user
+    start_history_stream(room, user_id)
     
-    # Notify all users
-    emit('user_joined', {
-        'user': user_info,
-        'users': active_users
-    }, room='lecture_room')
+    # Full user list for the newcomer; everyone else gets a delta on the next tick
+    send_presence_snapshot(room, user_id)
     
     # Send current lecture status
-    emit('lecture_status', {
-        'active': lecture_active,
-        'teacher': active_users.get(teacher_id, {}).get('fullName', 'Unknown') if teacher_id else 'None'
-    })
+    emit('lecture_status', room.lecture_snapshot())
     
-    print(f"User joined: {user_info['fullName']} ({user_info['role']})")
+    print(f"User joined {room.id}: {user_info['fullName']} ({user_info['role']})")
 
-@socketio.on('user_leave')
+@room_event('user_leave')
 def handle_user_leave():
     user_id = request.sid
-    if user_id in active_users:
-        user_info = active_users.pop(user_id)
-        
-        # Remove from raised hands if present
-        global raised_hands, teacher_id, lecture_active
-        raised_hands = [hand for hand in raised_hands if hand['id'] != user_id]
-        
-        # Reset teacher if teacher leaves
-        if user_id == teacher_id:
-            teacher_id = None
-            lecture_active = False
-        
-        leave_room('lecture_room')
-        
-        # Notify all users
-        emit('user_left', {
-            'user': user_info,
-            'users': active_users
-        }, room='lecture_room')
-        
-        emit('hand_raised', {'raised_hands': raised_hands}, room='lecture_room')
-        
-        print(f"User left: {user_info['fullName']}")
+    room = room_for(user_id)
+    if room is None:
+        return
+    user_info = room.remove_user(user_id)
+    if user_info is None:
+        return
+    user_rooms.pop(user_id, None)
+    history_streams.pop(user_id, None)
+    send_queues.forget(user_id)
+    
+    if not is_forwarded():
+        leave_room(lecture_room(room.id))
+        leave_room(wire_room(room.id, user_info['wire']))
+    
+    # Everyone else hears about it on the next presence tick
+    
+    discard_room_if_empty(room)
+    
+    print(f"User left {room.id}: {user_info['fullName']}")
 
-@socketio.on('disconnect')
-def handle_disconnect():
+@room_event('disconnect')
+def handle_disconnect(reason=None):
     handle_user_leave()
 
-@socketio.on('toggle_hand')
+def handle_client_congestion(congested):
+    """A connection held by another worker went over or back under the send queue limits"""
+    send_queues.set_congested(request.sid, bool(congested))
+
+# Only ever forwarded by the worker holding the connection, so clients can't send it
+room_handlers['client_congestion'] = handle_client_congestion
+
+@room_event('toggle_hand')
 def handle_toggle_hand(data):
     user_id = request.sid
-    if user_id in active_users and active_users[user_id]['role'] == 'student':
-        active_users[user_id]['hand_raised'] = data['raised']
-        
-        global raised_hands
-        if data['raised']:
-            if not any(hand['id'] == user_id for hand in raised_hands):
-                raised_hands.append(active_users[user_id])
-        else:
-            raised_hands = [hand for hand in raised_hands if hand['id'] != user_id]
-        
-        emit('hand_raised', {'raised_hands': raised_hands}, room='lecture_room')
-        emit('users_update', {'users': active_users}, room='lecture_room')
+    room = room_for(user_id)
+    if room is not None:
+        # Broadcast on the next presence tick
+        room.set_hand(user_id, bool(data['raised']))
+
+@room_event('presence_resync')
+def handle_presence_resync():
+    room = room_for(request.sid)
+    if room is not None:
+        send_presence_snapshot(room, request.sid)
 
-@socketio.on('toggle_lecture')
+@room_event('toggle_lecture')
 def handle_toggle_lecture():
     user_id = request.sid
-    if user_id == teacher_id:
-        global lecture_active
-        lecture_active = not lecture_active
+    room = room_for(user_id)
+    status = room.toggle_lecture(user_id) if room is not None else None
+    if status is not None:
+        emit('lecture_status', status, room=lecture_room(room.id))
         
-        teacher_name = active_users[teacher_id]['fullName']
-        emit('lecture_status', {
-            'active': lecture_active,
-            'teacher': teacher_name
-        }, room='lecture_room')
-        
-        print(f"Lecture {'started' if lecture_active else 'ended'} by {teacher_name}")
+        print(f"Lecture {room.id} {'started' if status['active'] else 'ended'} by {status['teacher']}")
 
-@socketio.on('send_chat')
+@room_event('send_chat')
 def handle_send_chat(data):
     user_id = request.sid
-    if user_id in active_users:
-        user_info = active_users[user_id]
-        
+    room = room_for(user_id)
+    user_info = room.active_users.get(user_id) if room is not None else None
+    if user_info is not None:
         emit('chat_message', {
             'message': data['message'],
             'sender_name': user_info['fullName'],
             'sender_role': user_info['role'],
             'timestamp': datetime.now().strftime('%H:%M:%S')
-        }, room='lecture_room')
+        }, room=lecture_room(room.id))
 
-@socketio.on('whiteboard_draw')
+@room_event('whiteboard_draw')
 def handle_whiteboard_draw(data):
     user_id = request.sid
-    if user_id == teacher_id:  # Only teacher can draw
-        # Store the drawing operation
-        whiteboard_state.append(data)
-        
-        # Limit stored operations to prevent memory issues
-        if len(whiteboard_state) > 10000:
-            whiteboard_state.pop(0)
-        
-        emit('whiteboard_update', data, room='lecture_room', include_self=False)
+    room = room_for(user_id)
+    if room is None:
+        return
+    points = data.get('points')
+    if points is None and data.get('end'):
+        # End of a stroke whose points were all sent already; nothing to relay
+        room.end_whiteboard_stroke(user_id, data.get('stroke'))
+        return
+    if points is not None:
+        # Stroke chunk: {stroke, tool, color, size, points: [x0, y0, x1, y1, ...]}
+        if (not isinstance(points, list) or not points or len(points) % 2
+                or len(points) > 2 * STROKE_CHUNK_MAX_POINTS
+                or not all(isinstance(v, (int, float)) for v in points)):
+            return
+    with room.lock:
+        # Relay under the lock so clients see operations in seq order
+        if room.add_whiteboard_op(user_id, data) is not None:
+            emit('whiteboard_update', data, room=lecture_room(room.id),
+                 skip_sid=send_queues.whiteboard_skip(room, data['seq'], user_id))
 
-@socketio.on('whiteboard_clear')
+def decode_whiteboard_chunk(payload):
+    """Header fields and int16 coordinates of a binary chunk, or None if malformed"""
+    if not isinstance(payload, (bytes, bytearray)) or len(payload) < WB_HEADER.size:
+        return None
+    version, flags, tool, size, rgb, stroke_id, _ = WB_HEADER.unpack_from(payload)
+    body = len(payload) - WB_HEADER.size
+    if (version != WB_VERSION or tool >= len(WB_TOOLS) or body % 4
+            or body > 4 * STROKE_CHUNK_MAX_POINTS or (body == 0 and not flags & WB_FLAG_END)):
+        return None
+    quantized = array('h')
+    quantized.frombytes(bytes(payload[WB_HEADER.size:]))
+    if sys.byteorder == 'big':
+        quantized.byteswap()
+    return flags, WB_TOOLS[tool], size, '#' + rgb.hex(), stroke_id, quantized
+
+@room_event('whiteboard_bin')
+def handle_whiteboard_bin(payload):
+    """Binary stroke chunk: stored as packed floats and relayed as the same bytes"""
+    user_id = request.sid
+    room = room_for(user_id)
+    decoded = decode_whiteboard_chunk(payload) if room is not None else None
+    if decoded is None:
+        return
+    flags, tool, size, color, stroke_id, quantized = decoded
+    end = bool(flags & WB_FLAG_END)
+    if not quantized:
+        room.end_whiteboard_stroke(user_id, stroke_id)
+        return
+    coords = [v / WB_COORD_SCALE for v in quantized]
+    with room.lock:
+        # Relay under the lock so clients see operations in seq order
+        seq = room.add_whiteboard_chunk(user_id, stroke_id, tool, color, size, coords, end)
+        if seq is None:
+            return
+        relay = bytearray(payload)
+        struct.pack_into('<I', relay, WB_HEADER.size - 4, seq)
+        skip_sid = send_queues.whiteboard_skip(room, seq, user_id)
+        emit('whiteboard_bin', bytes(relay), room=wire_room(room.id, 'binary'), skip_sid=skip_sid)
+        if room.json_users:
+            # Only decoded for clients that cannot read the binary form
+            emit('whiteboard_update', {
+                'stroke': stroke_id, 'tool': tool, 'color': color, 'size': size,
+                'points': coords, 'end': end, 'seq': seq
+            }, room=wire_room(room.id, 'json'), skip_sid=skip_sid)
+
+@room_event('whiteboard_clear')
 def handle_whiteboard_clear():
     user_id = request.sid
-    if user_id == teacher_id:  # Only teacher can clear
-        global whiteboard_state
-        whiteboard_state.clear()
-        emit('whiteboard_clear', room='lecture_room', include_self=False)
+    room = room_for(user_id)
+    if room is None:
+        return
+    with room.lock:
+        seq = room.clear_whiteboard(user_id)
+        if seq is not None:
+            emit('whiteboard_clear', {'seq': seq}, room=lecture_room(room.id),
+                 skip_sid=send_queues.whiteboard_skip(room, seq, user_id))
+
+@room_event('whiteboard_sync')
+def handle_whiteboard_sync(data):
+    """Send a client the operations it missed since data['since']"""
+    room = room_for(request.sid)
+    since = data.get('since', 0) if isinstance(data, dict) else None
+    if room is None or not isinstance(since, int) or isinstance(since, bool):
+        return
+    with room.lock:
+        state = room.whiteboard_since(since)
+        if state is not None:
+            emit('whiteboard_state', state)
+            return
+    # Too far behind: start over with the paged history
+    start_history_stream(room, request.sid)
 
-@socketio.on('audio_data')
+@room_event('whiteboard_page_ack')
+def handle_whiteboard_page_ack(data):
+    """Client drew a history page; send the next one"""
+    stream = history_streams.get(request.sid)
+    if stream is None or data.get('stream') != stream.id or data.get('page') != stream.page - 1:
+        return
+    page = stream.next_page()
+    if page['last']:
+        history_streams.pop(request.sid, None)
+    emit('whiteboard_page', page)
+
+@room_event('audio_data')
 def handle_audio_data(data):
     user_id = request.sid
-    if user_id in active_users:
-        # Check if user has permission to speak (teacher always has permission)
-        user_info = active_users[user_id]
-        if user_info['role'] == 'teacher' or user_info.get('speaking_permission', False):
-            # Broadcast audio to all other users
-            emit('audio_data', {
-                'audio_data': data['audio_data'],
-                'user_id': user_id,
-                'user_name': user_info['fullName']
-            }, room='lecture_room', include_self=False)
-
-@socketio.on('give_permission')
+    room = room_for(user_id)
+    user_info = room.active_users.get(user_id) if room is not None else None
+    # Check if user has permission to speak (teacher always has permission)
+    if user_info is not None and (user_info['role'] == 'teacher' or user_info.get('speaking_permission', False)):
+        audio = data.get('audio_data')
+        if isinstance(audio, list):
+            # Older pages send a JSON array of byte values
+            try:
+                audio = bytes(audio)
+            except (TypeError, ValueError):
+                return
+        if not isinstance(audio, (bytes, bytearray)) or not audio or len(audio) > AUDIO_MAX_BYTES:
+            return
+        # Broadcast audio to all other users; the bytes go out as a binary attachment
+        audio_relay.send(user_id, 'audio_data', {
+            'audio_data': audio,
+            'user_id': user_id,
+            'user_name': user_info['fullName']
+        }, room, skip_sid=user_id)
+
+@room_event('audio_frame')
+def handle_audio_frame(frame):
+    """Relay one streaming audio frame as the same bytes, or queue it for the room's mixer"""
+    user_id = request.sid
+    room = room_for(user_id)
+    user_info = room.active_users.get(user_id) if room is not None else None
+    if user_info is None or not (user_info['role'] == 'teacher' or user_info.get('speaking_permission', False)):
+        return
+    if (not isinstance(frame, (bytes, bytearray)) or not AUDIO_FRAME_HEADER.size < len(frame) <= AUDIO_FRAME_MAX_BYTES
+            or frame[0] != 1):
+        return
+    if room.mixer is not None and frame[1] in (AUDIO_CODEC_PCM16, AUDIO_CODEC_OPUS):
+        if room.mixer.push(user_id, frame):
+            with mixing_rooms_lock:
+                mixing_rooms.add(room)
+        return
+    audio_relay.send(user_id, 'audio_frame', {'user_id': user_id, 'frame': frame}, room, skip_sid=user_id)
+
+@room_event('give_permission')
 def handle_give_permission(data):
     user_id = request.sid
-    target_user_id = data['user_id']
+    room = room_for(user_id)
     
-    # Only teacher can give permission
-    if user_id == teacher_id and target_user_id in active_users:
-        active_users[target_user_id]['speaking_permission'] = True
-        
-        # Remove from raised hands
-        global raised_hands
-        raised_hands = [hand for hand in raised_hands if hand['id'] != target_user_id]
-        
-        # Lower the hand
-        active_users[target_user_id]['hand_raised'] = False
-        
-        emit('hand_raised', {'raised_hands': raised_hands}, room='lecture_room')
-        emit('users_update', {'users': active_users}, room='lecture_room')
-        
-        # Notify the user they can speak
+    # Only teacher can give permission; this also lowers the student's hand.
+    # Without a user_id the next hand in the queue is allowed.
+    target_user_id = room.grant_permission(user_id, data.get('user_id')) if room is not None else None
+    if target_user_id is not None:
+        # The room sees the change on the next presence tick; notify the user they can speak
         emit('speaking_permission_granted', room=target_user_id)
 
 # Health check endpoint for deployment
 @app.route('/health')
 def health_check():
+    with rooms_lock:
+        current = list(rooms.values())
     return jsonify({
         'status': 'healthy', 
-        'users': len(active_users),
-        'lecture_active': lecture_active,
-        'has_teacher': teacher_id is not None
+        'users': sum(len(room.active_users) for room in current),
+        'rooms': len(current),
+        'lecture_active': any(room.lecture_active for room in current),
+        'has_teacher': any(room.teacher_id is not None for room in current)
     })
 
 # API endpoint to get user statistics
 @app.route('/api/stats')
 def get_stats():
+    with rooms_lock:
+        current = list(rooms.values())
     return jsonify({
-        'total_users': len(user_data),
-        'active_users': len(active_users),
-        'lecture_active': lecture_active,
-        'raised_hands': len(raised_hands),
-        'has_teacher': teacher_id is not None
+        'total_users': count_users(),
+        'active_users': sum(len(room.active_users) for room in current),
+        'lecture_active': any(room.lecture_active for room in current),
+        'raised_hands': sum(len(room.raised_hands) for room in current),
+        'has_teacher': any(room.teacher_id is not None for room in current),
+        'audio': audio_relay.stats(),
+        'send_queues': send_queues.stats(),
+        'rooms': {
+            room.id: {
+                'active_users': len(room.active_users),
+                'lecture_active': room.lecture_active,
+                'raised_hands': len(room.raised_hands),
+                'has_teacher': room.teacher_id is not None
+            }
+            for room in current
+        }
     })
 
+# Prometheus scrape target
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # Clean up inactive users periodically
 def cleanup_inactive_users():
     while True:
@@ -1604,7 +2599,27 @@ def cleanup_inactive_users():
 cleanup_thread = threading.Thread(target=cleanup_inactive_users, daemon=True)
 cleanup_thread.start()
 
+# Start the presence tick
+socketio.start_background_task(presence_ticker)
+socketio.start_background_task(whiteboard_compactor)
+audio_relay.start()
+socketio.start_background_task(send_queue_monitor)
+if cluster is not None:
+    socketio.start_background_task(cluster.listen)
+    socketio.start_background_task(room_lease_keeper)
+if AUDIO_MIX:
+    if np is None or opuslib is None:
+        print("AUDIO_MIX needs NumPy and opuslib; relaying audio frames unmixed")
+    else:
+        socketio.start_background_task(audio_mixer)
+
 if __name__ == '__main__':
+    # One-shot migration: python edu.py import-sads [path]
+    if len(sys.argv) > 1 and sys.argv[1] == 'import-sads':
+        path = sys.argv[2] if len(sys.argv) > 2 else USER_DATA_FILE
+        print(f"Imported {import_legacy_user_data(path)} students from {path}")
+        sys.exit(0)
+
     print("=" * 60)
     print("🎓 Smart Board Online Teaching Platform - FIXED VERSION")
     print("=" * 60)
@@ -1618,18 +2633,25 @@ if __name__ == '__main__':
     print("✅ Teacher-only drawing controls")
     print("✅ Student raise-hand system")
     print("✅ Responsive design for all devices")
-    print("✅ User data automatically saved to sads.py")
+    print("✅ User data automatically saved to students.db")
     print("✅ Real-time audio with noise suppression")
     print("✅ Multi-device support (Android/iOS/Desktop)")
     print("=" * 60)
-    print("🚀 Starting fixed server...")
+    print(f"🚀 Starting fixed server ({ASYNC_MODE} mode)...")
+
+    # Prepare the student database on startup
+    load_user_data()
     
     # Get port from environment variable (for deployment) or use 5000
     port = int(os.environ.get('PORT', 5000))
     
-    # Run the application
+    # eventlet's server stops accepting at 1024 connections unless told otherwise
+    server_options = {'max_size': int(os.environ.get('MAX_CONNECTIONS', 10000))} if ASYNC_MODE == 'eventlet' else {}
+    
+    # Run the application; the Werkzeug server is only used in threading mode
     socketio.run(app, 
                 host='0.0.0.0', 
                 port=port, 
                 debug=False,
-                allow_unsafe_werkzeug=True)
+                allow_unsafe_werkzeug=True,
+                **server_options)
@@ -1,4 +1,4 @@
-# This file is used to persist user_data between restarts.
-# It will be overwritten by edu.py’s save_user_data().
+# Legacy student roster. edu.py now stores students in students.db and
+# imports this file once when the database is empty (python edu.py import-sads).
 
 user_data = {}
@@ -0,0 +1,1315 @@
+// Global variables
+let socket;
+let currentUser = null;
+let users = {};
+let presenceVersion = null;  // Unknown until the first presence_snapshot
+let isTeacher = false;
+let handRaised = false;
+let microphoneEnabled = false;
+let speakerEnabled = true;
+let localStream = null;
+let audioContext = null;
+let analyser = null;
+let mediaRecorder = null;
+let audioChunks = [];
+const AUDIO_FRAME_MS = 20;
+const AUDIO_HEADER_BYTES = 12;
+const AUDIO_CODEC_PCM16 = 0;
+const AUDIO_CODEC_OPUS = 1;
+const PCM_RATE = 16000;
+const AUDIO_JITTER_DELAY = 0.06;  // Seconds of buffering per speaker to start with
+const AUDIO_MAX_DELAY = 0.2;
+let audioSend = null;  // Capture and encoder state while the mic streams
+let audioStreamCount = 0;  // Streams started from this page, mod 256
+let audioPlayers = {};  // Sender sid -> jitter buffer
+let playbackContext = null;
+
+// Whiteboard variables
+let canvas, ctx;
+let isDrawing = false;
+let currentTool = 'pen';
+let currentColor = '#ffffff';  // White for dark board
+let currentBrushSize = 3;
+let startX, startY;
+let lastX, lastY;
+let whiteboardSeq = 0;  // Last operation applied to the canvas
+let whiteboardSyncing = false;
+let historyStream = null;  // Paged history being received, if any
+let historyBuffer = [];  // Live updates held back until the history is drawn
+const STROKE_FLUSH_MS = 25;  // Pen points are batched into one message per interval
+let strokeId = null;
+let nextStrokeId = Math.floor(Math.random() * 0x7fffffff);  // Binary stroke IDs are uint32
+const WB_TOOLS = ['pen', 'eraser', 'line', 'rect', 'circle'];
+const WB_HEADER_BYTES = 16;
+const WB_COORD_SCALE = 4;
+let pendingPoints = [];
+let strokeFlushTimer = null;
+let remoteStrokeId = null;  // Last stroke drawn from the server and where it ended
+let remoteStrokeEnd = null;
+
+// Initialize application
+document.addEventListener('DOMContentLoaded', function() {
+    initializeWhiteboard();
+    setupEventListeners();
+});
+
+// Setup event listeners
+function setupEventListeners() {
+    document.getElementById('loginForm').addEventListener('submit', handleLogin);
+    const roomParam = new URLSearchParams(location.search).get('room');
+    if (roomParam) {
+        document.getElementById('roomId').value = roomParam;
+    }
+}
+
+// Handle user login
+function handleLogin(e) {
+    e.preventDefault();
+    const fullName = document.getElementById('fullName').value.trim();
+    const username = document.getElementById('username').value.trim();
+    const phoneNumber = document.getElementById('phoneNumber').value.trim();
+    const userRole = document.getElementById('userRole').value;
+    const roomId = document.getElementById('roomId').value.trim() || 'lecture_room';
+
+    if (!fullName || !username || !phoneNumber || !userRole) {
+        alert('Please fill in all fields');
+        return;
+    }
+
+    // Same rule the server applies
+    if (roomId.length > 64 || /[\/:\x00-\x1f]/.test(roomId)) {
+        alert('Room IDs are up to 64 characters without "/" or ":"');
+        return;
+    }
+
+    currentUser = {
+        fullName: fullName,
+        username: username,
+        phoneNumber: phoneNumber,
+        role: userRole,
+        room: roomId,
+        wire: 'binary',  // Whiteboard chunks as compact binary; JSON still understood
+        audio: 'AudioDecoder' in window ? 'opus' : 'pcm16',  // How a server mix can reach us
+        id: generateUniqueId()
+    };
+
+    isTeacher = userRole === 'teacher';
+
+    // Create the playback context while we still have the click's user gesture
+    getPlaybackContext();
+
+    // Connect to socket
+    connectSocket();
+
+    // Hide login modal and show main app
+    document.getElementById('loginModal').style.display = 'none';
+    document.getElementById('mainApp').classList.remove('hidden');
+
+    // Update UI
+    updateUserInterface();
+}
+
+// Connect to socket
+function connectSocket() {
+    socket = io();
+    historyStream = 'joining';  // Hold live updates until the history arrives
+
+    socket.emit('user_join', currentUser);
+
+    socket.on('join_rejected', function(data) {
+        alert(data.message);
+        location.reload();
+    });
+
+    socket.on('presence_snapshot', function(data) {
+        users = data.users;
+        presenceVersion = data.version;
+        updateUsersList(users);
+        updateRaisedHands(data.raised_hands);
+    });
+
+    // Presence, hand and permission changes, batched per server tick
+    socket.on('room_update', function(data) {
+        if (data.raised_hands) {
+            updateRaisedHands(data.raised_hands);
+        }
+        const delta = data.presence;
+        if (!delta || presenceVersion === null || delta.version <= presenceVersion) return;
+        if (delta.from_version !== presenceVersion) {
+            // Missed a delta: ask for the full list again
+            presenceVersion = null;
+            socket.emit('presence_resync');
+            return;
+        }
+        applyPresenceChanges(delta.changes);
+        presenceVersion = delta.version;
+        updateUsersList(users);
+    });
+
+    socket.on('lecture_status', function(data) {
+        updateLectureStatus(data.active, data.teacher);
+    });
+
+    socket.on('chat_message', function(data) {
+        addChatMessage(data.sender_role, data.message, data.sender_name);
+    });
+
+    socket.on('whiteboard_bin', function(buffer) {
+        const data = decodeStrokeChunk(buffer);
+        if (historyStream !== null) {
+            historyBuffer.push(data);
+            return;
+        }
+        applyWhiteboardUpdate(data);
+    });
+
+    socket.on('whiteboard_update', function(data) {
+        if (historyStream !== null) {
+            historyBuffer.push(data);
+            return;
+        }
+        applyWhiteboardUpdate(data);
+    });
+
+    socket.on('whiteboard_clear', function(data) {
+        // A clear supersedes any history still arriving
+        historyStream = null;
+        historyBuffer = [];
+        whiteboardSyncing = false;
+        clearCanvas();
+        whiteboardSeq = data.seq;
+    });
+
+    socket.on('whiteboard_page', function(data) {
+        if (data.page === 0) {
+            // Keep updates buffered since the snapshot; the replay skips those it includes
+            clearCanvas();
+            historyStream = data.stream;
+            whiteboardSyncing = false;
+        } else if (data.stream !== historyStream) {
+            return;
+        }
+        JSON.parse(data.strokes).forEach(stroke => drawStroke(stroke));
+        if (!data.last) {
+            socket.emit('whiteboard_page_ack', { stream: data.stream, page: data.page });
+            return;
+        }
+        // Caught up: replay live updates that arrived meanwhile
+        historyStream = null;
+        whiteboardSeq = data.seq;
+        const buffered = historyBuffer;
+        historyBuffer = [];
+        buffered.forEach(op => applyWhiteboardUpdate(op));
+    });
+
+    socket.on('whiteboard_state', function(data) {
+        // The missing tail after a gap
+        data.operations.forEach(op => drawOnCanvas(op));
+        whiteboardSeq = data.seq;
+        whiteboardSyncing = false;
+    });
+
+    socket.on('audio_data', function(data) {
+        if (speakerEnabled && data.user_id !== currentUser.id) {
+            playAudioData(data.audio_data);
+        }
+    });
+
+    socket.on('audio_frame', function(data) {
+        if (speakerEnabled) {
+            receiveAudioFrame(data.user_id, data.frame);
+        }
+    });
+
+    socket.on('speaking_permission_granted', function() {
+        alert('You have been granted permission to speak!');
+        // Auto-enable microphone when permission is granted
+        if (!microphoneEnabled) {
+            toggleMicrophone();
+        }
+    });
+}
+
+// Update user interface
+function updateUserInterface() {
+    document.getElementById('userInfo').textContent = `${currentUser.fullName} (${isTeacher ? 'Teacher' : 'Student'})`;
+
+    // Hide teacher controls for students
+    if (!isTeacher) {
+        document.getElementById('startLectureBtn').style.display = 'none';
+        // Disable drawing tools for students
+        const toolbar = document.querySelector('.toolbar');
+        toolbar.style.opacity = '0.5';
+        const toolButtons = toolbar.querySelectorAll('.btn');
+        toolButtons.forEach(btn => btn.disabled = true);
+    } else {
+        // Hide raise hand button for teachers
+        document.getElementById('raiseHandBtn').style.display = 'none';
+    }
+}
+
+// Draw a live whiteboard operation, or resync if one was missed
+function applyWhiteboardUpdate(data) {
+    if (whiteboardSyncing || data.seq <= whiteboardSeq) return;
+    if (data.seq !== whiteboardSeq + 1) {
+        // Missed operations: fetch everything since the last one we drew
+        whiteboardSyncing = true;
+        socket.emit('whiteboard_sync', { since: whiteboardSeq });
+        return;
+    }
+    drawOnCanvas(data);
+    whiteboardSeq = data.seq;
+}
+
+// Apply add/remove/patch presence changes to the local user list
+function applyPresenceChanges(changes) {
+    changes.forEach(change => {
+        if (change.op === 'add') {
+            if (!users[change.user.id]) {
+                addChatMessage('system', `${change.user.fullName} joined the lecture`);
+            }
+            users[change.user.id] = change.user;
+        } else if (change.op === 'remove') {
+            const user = users[change.id];
+            delete users[change.id];
+            dropAudioPlayer(change.id);
+            if (user) {
+                addChatMessage('system', `${user.fullName} left the lecture`);
+            }
+        } else if (change.op === 'patch' && users[change.id]) {
+            Object.assign(users[change.id], change.fields);
+        }
+    });
+}
+
+// Update users list
+function updateUsersList(users) {
+    const usersList = document.getElementById('usersList');
+    const userCount = document.getElementById('userCount');
+
+    usersList.innerHTML = '';
+    userCount.textContent = Object.keys(users).length;
+
+    Object.values(users).forEach(user => {
+        const userItem = document.createElement('div');
+        userItem.className = `user-item ${user.role === 'teacher' ? 'teacher' : ''}`;
+
+        const isHandRaised = user.hand_raised;
+        if (isHandRaised) {
+            userItem.classList.add('hand-raised');
+        }
+
+        userItem.innerHTML = `
+            <div>
+                <strong>${user.fullName}</strong>
+                <div style="font-size: 12px; opacity: 0.7;">${user.username} (${user.role})</div>
+                ${isHandRaised ? '<span class="hand-raised-indicator">🙋‍♂️ Hand Raised</span>' : ''}
+            </div>
+            <div class="status online">Online</div>
+        `;
+
+        usersList.appendChild(userItem);
+    });
+}
+
+// Update raised hands
+function updateRaisedHands(raisedHands) {
+    const handsCount = document.getElementById('handsCount');
+    const raisedHandsList = document.getElementById('raisedHandsList');
+
+    handsCount.textContent = raisedHands.length;
+
+    raisedHandsList.innerHTML = '';
+    raisedHands.forEach(hand => {
+        const handItem = document.createElement('div');
+        handItem.className = 'user-item hand-raised';
+        handItem.innerHTML = `
+            <div>
+                <strong>${hand.name}</strong>
+                <div style="font-size: 12px; opacity: 0.7;">Wants to speak</div>
+            </div>
+            ${isTeacher ? `<button class="btn btn-primary" onclick="givePermissionToSpeak('${hand.id}')">Allow</button>` : ''}
+        `;
+        raisedHandsList.appendChild(handItem);
+    });
+}
+
+// Toggle raise hand
+function toggleRaiseHand() {
+    if (isTeacher) return;
+
+    handRaised = !handRaised;
+    socket.emit('toggle_hand', { raised: handRaised });
+
+    const btn = document.getElementById('raiseHandBtn');
+    if (handRaised) {
+        btn.textContent = '✋ Lower Hand';
+        btn.className = 'btn btn-danger';
+    } else {
+        btn.textContent = '🙋‍♂️ Raise Hand';
+        btn.className = 'btn btn-warning';
+    }
+}
+
+// Toggle lecture
+function toggleLecture() {
+    if (!isTeacher) return;
+
+    socket.emit('toggle_lecture');
+}
+
+// Update lecture status
+function updateLectureStatus(active, teacher) {
+    const indicator = document.getElementById('lectureIndicator');
+    const statusText = document.getElementById('lectureStatusText');
+    const startBtn = document.getElementById('startLectureBtn');
+
+    if (active) {
+        indicator.classList.add('active');
+        statusText.textContent = `Lecture Active - ${teacher}`;
+        if (isTeacher) {
+            startBtn.textContent = 'End Lecture';
+            startBtn.className = 'btn btn-danger';
+        }
+    } else {
+        indicator.classList.remove('active');
+        statusText.textContent = 'Lecture Not Started';
+        if (isTeacher) {
+            startBtn.textContent = 'Start Lecture';
+            startBtn.className = 'btn btn-primary';
+        }
+    }
+}
+
+// Leave lecture
+function leaveLecture() {
+    if (confirm('Are you sure you want to leave the lecture?')) {
+        if (localStream) {
+            localStream.getTracks().forEach(track => track.stop());
+        }
+        socket.emit('user_leave');
+        location.reload();
+    }
+}
+
+// Show tab
+function showTab(tabName) {
+    // Hide all tabs
+    document.getElementById('usersTab').classList.add('hidden');
+    document.getElementById('chatTab').classList.add('hidden');
+    document.getElementById('audioTab').classList.add('hidden');
+
+    // Remove active class from all tab buttons
+    document.querySelectorAll('.tab').forEach(tab => tab.classList.remove('active'));
+
+    // Show selected tab
+    document.getElementById(tabName + 'Tab').classList.remove('hidden');
+
+    // Add active class to selected tab button
+    event.target.classList.add('active');
+}
+
+// Chat functions
+function sendChat() {
+    const input = document.getElementById('chatInput');
+    const message = input.value.trim();
+
+    if (message) {
+        socket.emit('send_chat', { message: message });
+        input.value = '';
+    }
+}
+
+function sendChatOnEnter(event) {
+    if (event.key === 'Enter') {
+        sendChat();
+    }
+}
+
+function addChatMessage(senderRole, message, senderName = 'System') {
+    const messagesContainer = document.getElementById('chatMessages');
+    const messageElement = document.createElement('div');
+    messageElement.className = `message ${senderRole}`;
+
+    const timestamp = new Date().toLocaleTimeString();
+    messageElement.innerHTML = `
+        <div style="font-size: 12px; opacity: 0.7;">${senderName} - ${timestamp}</div>
+        <div>${message}</div>
+    `;
+
+    messagesContainer.appendChild(messageElement);
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+// Audio functions - FIXED
+async function toggleMicrophone() {
+    const btn = document.getElementById('micBtn');
+
+    if (!microphoneEnabled) {
+        try {
+            // Request microphone permission
+            localStream = await navigator.mediaDevices.getUserMedia({
+                audio: {
+                    echoCancellation: document.getElementById('echoCancellation').checked,
+                    noiseSuppression: document.getElementById('noiseSuppression').checked,
+                    autoGainControl: document.getElementById('autoGainControl').checked,
+                    sampleRate: 44100
+                }
+            });
+
+            setupAudioProcessing();
+            microphoneEnabled = true;
+            btn.textContent = '🎤 Mic On';
+            btn.className = 'btn btn-danger';
+
+        } catch (err) {
+            alert('Could not access microphone: ' + err.message);
+            console.error('Microphone error:', err);
+        }
+    } else {
+        // Stop microphone
+        if (localStream) {
+            localStream.getTracks().forEach(track => track.stop());
+            localStream = null;
+        }
+        stopAudioStream();
+        if (mediaRecorder && mediaRecorder.state !== 'inactive') {
+            mediaRecorder.stop();
+        }
+        if (audioContext) {
+            audioContext.close();
+            audioContext = null;
+        }
+        microphoneEnabled = false;
+        btn.textContent = '🎤 Mic Off';
+        btn.className = 'btn btn-primary';
+    }
+}
+
+function toggleSpeaker() {
+    const btn = document.getElementById('speakerBtn');
+    speakerEnabled = !speakerEnabled;
+
+    if (speakerEnabled) {
+        btn.textContent = '🔊 Speaker On';
+        btn.className = 'btn btn-primary';
+    } else {
+        btn.textContent = '🔇 Speaker Off';
+        btn.className = 'btn btn-danger';
+    }
+}
+
+function setVolume(value) {
+    document.getElementById('volumeValue').textContent = value + '%';
+    Object.values(audioPlayers).forEach(player => {
+        player.gain.gain.value = value / 100;
+    });
+}
+
+// Streaming audio: 20 ms frames with a sequence number and capture timestamp.
+// Opus through WebCodecs where the browser has it, 16 kHz PCM otherwise.
+const CAPTURE_WORKLET = `
+    class CaptureProcessor extends AudioWorkletProcessor {
+        process(inputs) {
+            const input = inputs[0];
+            if (input.length > 0) {
+                this.port.postMessage(input[0].slice(0));
+            }
+            return true;
+        }
+    }
+    registerProcessor('capture-processor', CaptureProcessor);
+`;
+
+async function startAudioStream(source) {
+    const moduleUrl = URL.createObjectURL(new Blob([CAPTURE_WORKLET], { type: 'application/javascript' }));
+    await audioContext.audioWorklet.addModule(moduleUrl);
+    const node = new AudioWorkletNode(audioContext, 'capture-processor');
+    source.connect(node);
+    // The node only runs while connected to the output; keep it silent
+    const mute = audioContext.createGain();
+    mute.gain.value = 0;
+    node.connect(mute);
+    mute.connect(audioContext.destination);
+
+    const rate = audioContext.sampleRate;
+    const frameSamples = Math.round(rate * AUDIO_FRAME_MS / 1000);
+    // seq and timestamps restart with every stream; the new stream number tells receivers to reset
+    audioStreamCount = (audioStreamCount + 1) & 255;
+    audioSend = {
+        node: node,
+        encoder: null,
+        stream: audioStreamCount,
+        seq: 0,
+        rate: rate,
+        samples: 0,
+        frameSamples: frameSamples,
+        buffer: new Float32Array(frameSamples),
+        fill: 0
+    };
+
+    if ('AudioEncoder' in window) {
+        try {
+            const config = {
+                codec: 'opus',
+                sampleRate: rate,
+                numberOfChannels: 1,
+                bitrate: 24000,
+                opus: { frameDuration: AUDIO_FRAME_MS * 1000 }
+            };
+            const support = await AudioEncoder.isConfigSupported(config);
+            if (support.supported) {
+                const encoder = new AudioEncoder({
+                    output: chunk => {
+                        const data = new Uint8Array(chunk.byteLength);
+                        chunk.copyTo(data);
+                        sendAudioFrame(AUDIO_CODEC_OPUS, data, Math.round(chunk.timestamp / 1000));
+                    },
+                    error: err => console.error('Opus encoder error:', err)
+                });
+                encoder.configure(config);
+                audioSend.encoder = encoder;
+            }
+        } catch (err) {
+            console.warn('Opus unavailable, streaming PCM:', err);
+        }
+    }
+
+    node.port.onmessage = event => captureSamples(event.data);
+}
+
+function stopAudioStream() {
+    if (!audioSend) return;
+    audioSend.node.port.onmessage = null;
+    audioSend.node.disconnect();
+    if (audioSend.encoder && audioSend.encoder.state !== 'closed') {
+        audioSend.encoder.close();
+    }
+    audioSend = null;
+}
+
+// Cut captured samples into fixed-size frames and send each one
+function captureSamples(samples) {
+    const s = audioSend;
+    if (!s) return;
+    let offset = 0;
+    while (offset < samples.length) {
+        const n = Math.min(samples.length - offset, s.frameSamples - s.fill);
+        s.buffer.set(samples.subarray(offset, offset + n), s.fill);
+        s.fill += n;
+        offset += n;
+        if (s.fill < s.frameSamples) break;
+
+        if (s.encoder) {
+            s.encoder.encode(new AudioData({
+                format: 'f32',
+                sampleRate: s.rate,
+                numberOfFrames: s.frameSamples,
+                numberOfChannels: 1,
+                timestamp: Math.round(s.samples * 1000000 / s.rate),
+                data: s.buffer
+            }));
+        } else {
+            sendAudioFrame(AUDIO_CODEC_PCM16, encodePcm16(s.buffer, s.rate), Math.round(s.samples * 1000 / s.rate));
+        }
+        s.samples += s.frameSamples;
+        s.fill = 0;
+    }
+}
+
+// Resample to 16 kHz and quantize to little-endian int16
+function encodePcm16(samples, rate) {
+    const length = Math.floor(samples.length * PCM_RATE / rate);
+    const out = new Int16Array(length);
+    const step = rate / PCM_RATE;
+    for (let i = 0; i < length; i++) {
+        const pos = i * step;
+        const j = Math.floor(pos);
+        const a = samples[j];
+        const b = j + 1 < samples.length ? samples[j + 1] : a;
+        const v = a + (b - a) * (pos - j);
+        out[i] = Math.max(-32768, Math.min(32767, Math.round(v * 32767)));
+    }
+    return new Uint8Array(out.buffer);
+}
+
+// Frame layout: version, codec, stream, a reserved byte, seq (uint32), timestamp in ms (uint32), payload
+function sendAudioFrame(codec, data, timestamp) {
+    if (!audioSend) return;
+    const frame = new Uint8Array(AUDIO_HEADER_BYTES + data.length);
+    const view = new DataView(frame.buffer);
+    view.setUint8(0, 1);
+    view.setUint8(1, codec);
+    view.setUint8(2, audioSend.stream);
+    view.setUint32(4, audioSend.seq, true);
+    view.setUint32(8, timestamp >>> 0, true);
+    frame.set(data, AUDIO_HEADER_BYTES);
+    audioSend.seq = (audioSend.seq + 1) >>> 0;
+    socket.emit('audio_frame', frame.buffer);
+}
+
+function getPlaybackContext() {
+    if (!playbackContext) {
+        playbackContext = new (window.AudioContext || window.webkitAudioContext)();
+    }
+    if (playbackContext.state === 'suspended') {
+        playbackContext.resume();
+    }
+    return playbackContext;
+}
+
+function getAudioPlayer(senderId) {
+    let player = audioPlayers[senderId];
+    if (!player) {
+        const ctx = getPlaybackContext();
+        const gain = ctx.createGain();
+        gain.gain.value = document.getElementById('volumeSlider').value / 100;
+        gain.connect(ctx.destination);
+        player = audioPlayers[senderId] = {
+            gain: gain,
+            decoder: null,
+            base: null,  // Playback context time that corresponds to timestamp 0
+            delay: AUDIO_JITTER_DELAY,
+            stream: null,
+            lastSeq: null,
+            lastTimestamp: 0
+        };
+    }
+    return player;
+}
+
+function dropAudioPlayer(senderId) {
+    const player = audioPlayers[senderId];
+    if (!player) return;
+    if (player.decoder && player.decoder.state !== 'closed') {
+        player.decoder.close();
+    }
+    player.gain.disconnect();
+    delete audioPlayers[senderId];
+}
+
+function receiveAudioFrame(senderId, buffer) {
+    if (buffer.byteLength < AUDIO_HEADER_BYTES) return;
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== 1) return;
+    const codec = view.getUint8(1);
+    const stream = view.getUint8(2);
+    const seq = view.getUint32(4, true);
+    const timestamp = view.getUint32(8, true);
+
+    const player = getAudioPlayer(senderId);
+    if (player.stream !== stream) {
+        // The sender restarted: its seq and timestamps start over
+        player.stream = stream;
+        player.lastSeq = null;
+        player.base = null;
+        if (player.decoder && player.decoder.state !== 'closed') {
+            player.decoder.close();
+        }
+        player.decoder = null;
+    }
+    if (player.lastSeq !== null && seq <= player.lastSeq && player.lastSeq - seq < 1000) {
+        return;  // Duplicate or hopelessly late
+    }
+    player.lastSeq = seq;
+
+    if (codec === AUDIO_CODEC_PCM16) {
+        const pcm = new Int16Array(buffer.slice(AUDIO_HEADER_BYTES));
+        const samples = new Float32Array(pcm.length);
+        for (let i = 0; i < pcm.length; i++) {
+            samples[i] = pcm[i] / 32768;
+        }
+        schedulePlayback(player, samples, PCM_RATE, timestamp);
+    } else if (codec === AUDIO_CODEC_OPUS && 'AudioDecoder' in window) {
+        if (!player.decoder) {
+            player.decoder = new AudioDecoder({
+                output: audioData => {
+                    const samples = new Float32Array(audioData.numberOfFrames);
+                    audioData.copyTo(samples, { planeIndex: 0, format: 'f32-planar' });
+                    schedulePlayback(player, samples, audioData.sampleRate, Math.round(audioData.timestamp / 1000));
+                    audioData.close();
+                },
+                error: err => console.error('Opus decoder error:', err)
+            });
+            player.decoder.configure({ codec: 'opus', sampleRate: 48000, numberOfChannels: 1 });
+        }
+        player.decoder.decode(new EncodedAudioChunk({
+            type: 'key',
+            timestamp: timestamp * 1000,
+            data: new Uint8Array(buffer, AUDIO_HEADER_BYTES)
+        }));
+    }
+}
+
+// Jitter buffer: play each frame at its capture time plus a small delay
+// that grows when frames arrive too late for their slot
+function schedulePlayback(player, samples, rate, timestamp) {
+    const ctx = getPlaybackContext();
+    const now = ctx.currentTime;
+    if (player.base === null || timestamp + 5000 < player.lastTimestamp) {
+        // First frame, or the sender restarted its stream
+        player.base = now + player.delay - timestamp / 1000;
+    }
+    player.lastTimestamp = timestamp;
+    let when = player.base + timestamp / 1000;
+    if (when < now) {
+        // Missed its slot: drop it and buffer a little more from now on
+        if (player.delay < AUDIO_MAX_DELAY) {
+            player.delay += 0.02;
+            player.base += 0.02;
+        }
+        return;
+    }
+    if (when > now + player.delay + 0.2) {
+        // Queue has drifted too far ahead; catch up
+        player.base = now + player.delay - timestamp / 1000;
+        when = now + player.delay;
+    }
+    const audioBuffer = ctx.createBuffer(1, samples.length, rate);
+    audioBuffer.copyToChannel(samples, 0);
+    const source = ctx.createBufferSource();
+    source.buffer = audioBuffer;
+    source.connect(player.gain);
+    source.start(when);
+}
+
+async function setupAudioProcessing() {
+    if (!localStream) return;
+
+    try {
+        audioContext = new (window.AudioContext || window.webkitAudioContext)();
+        const source = audioContext.createMediaStreamSource(localStream);
+
+        analyser = audioContext.createAnalyser();
+        analyser.fftSize = 256;
+        analyser.smoothingTimeConstant = 0.8;
+        source.connect(analyser);
+
+        // Stream small frames where AudioWorklet is available
+        if (audioContext.audioWorklet && window.AudioWorkletNode) {
+            try {
+                await startAudioStream(source);
+                visualizeAudio();
+                return;
+            } catch (err) {
+                console.warn('Streaming audio unavailable, falling back to recorded chunks:', err);
+                stopAudioStream();
+            }
+        }
+
+        // Fallback: MediaRecorder blobs for browsers without AudioWorklet
+        const options = { mimeType: 'audio/webm;codecs=opus' };
+        if (!MediaRecorder.isTypeSupported(options.mimeType)) {
+            options.mimeType = 'audio/webm';
+        }
+        if (!MediaRecorder.isTypeSupported(options.mimeType)) {
+            options.mimeType = 'audio/mp4';
+        }
+
+        mediaRecorder = new MediaRecorder(localStream, options);
+        audioChunks = [];
+
+        mediaRecorder.ondataavailable = function(event) {
+            if (event.data.size > 0) {
+                audioChunks.push(event.data);
+            }
+        };
+
+        mediaRecorder.onstop = function() {
+            if (audioChunks.length > 0) {
+                const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
+                // Sent as a binary attachment, not a JSON array of numbers
+                audioBlob.arrayBuffer().then(buffer => {
+                    socket.emit('audio_data', {
+                        audio_data: buffer,
+                        user_id: currentUser.id
+                    });
+                });
+                audioChunks = [];
+            }
+
+            // Restart recording if still enabled
+            if (microphoneEnabled && mediaRecorder) {
+                setTimeout(() => {
+                    if (mediaRecorder && mediaRecorder.state === 'inactive') {
+                        mediaRecorder.start();
+                        setTimeout(() => {
+                            if (mediaRecorder && mediaRecorder.state === 'recording') {
+                                mediaRecorder.stop();
+                            }
+                        }, 1000); // Record for 1 second chunks
+                    }
+                }, 100);
+            }
+        };
+
+        // Start recording
+        mediaRecorder.start();
+        setTimeout(() => {
+            if (mediaRecorder && mediaRecorder.state === 'recording') {
+                mediaRecorder.stop();
+            }
+        }, 1000);
+
+        // Start audio visualization
+        visualizeAudio();
+
+    } catch (err) {
+        console.error('Audio processing setup error:', err);
+    }
+}
+
+function visualizeAudio() {
+    if (!analyser) return;
+
+    const bufferLength = analyser.frequencyBinCount;
+    const dataArray = new Uint8Array(bufferLength);
+    const bars = document.querySelectorAll('#audioVisualizer .bar');
+
+    function updateVisualization() {
+        if (!analyser) return;
+
+        analyser.getByteFrequencyData(dataArray);
+
+        bars.forEach((bar, index) => {
+            const barIndex = Math.floor((index / bars.length) * bufferLength / 4);
+            const barHeight = (dataArray[barIndex] / 255) * 25;
+            bar.style.height = Math.max(2, barHeight) + 'px';
+        });
+
+        if (microphoneEnabled) {
+            requestAnimationFrame(updateVisualization);
+        }
+    }
+
+    updateVisualization();
+}
+
+function playAudioData(audioData) {
+    if (!speakerEnabled) return;
+
+    try {
+        const uint8Array = new Uint8Array(audioData);
+        const audioBlob = new Blob([uint8Array], { type: 'audio/webm' });
+        const audioUrl = URL.createObjectURL(audioBlob);
+        const audio = new Audio(audioUrl);
+
+        const volumeSlider = document.getElementById('volumeSlider');
+        audio.volume = volumeSlider.value / 100;
+
+        audio.play().then(() => {
+            // Audio played successfully
+        }).catch(err => {
+            console.log('Audio play error:', err);
+        });
+
+        // Clean up URL after playing
+        audio.addEventListener('ended', () => {
+            URL.revokeObjectURL(audioUrl);
+        });
+
+        // Auto cleanup after 5 seconds
+        setTimeout(() => {
+            URL.revokeObjectURL(audioUrl);
+        }, 5000);
+
+    } catch (err) {
+        console.log('Error playing audio:', err);
+    }
+}
+
+// Whiteboard functions - FIXED
+function initializeWhiteboard() {
+    canvas = document.getElementById('whiteboard');
+    ctx = canvas.getContext('2d');
+
+    resizeCanvas();
+    window.addEventListener('resize', resizeCanvas);
+
+    // Mouse events
+    canvas.addEventListener('mousedown', startDrawing);
+    canvas.addEventListener('mousemove', draw);
+    canvas.addEventListener('mouseup', stopDrawing);
+    canvas.addEventListener('mouseout', stopDrawing);
+
+    // Touch events for mobile
+    canvas.addEventListener('touchstart', handleTouch);
+    canvas.addEventListener('touchmove', handleTouch);
+    canvas.addEventListener('touchend', stopDrawing);
+
+    // Prevent default touch behaviors
+    canvas.addEventListener('touchstart', e => e.preventDefault());
+    canvas.addEventListener('touchmove', e => e.preventDefault());
+}
+
+function resizeCanvas() {
+    const rect = canvas.getBoundingClientRect();
+    const oldImageData = ctx.getImageData(0, 0, canvas.width, canvas.height);
+
+    canvas.width = rect.width;
+    canvas.height = rect.height;
+
+    // Restore image data
+    if (oldImageData.width > 0 && oldImageData.height > 0) {
+        ctx.putImageData(oldImageData, 0, 0);
+    }
+
+    // Set default drawing properties
+    ctx.lineCap = 'round';
+    ctx.lineJoin = 'round';
+    ctx.strokeStyle = currentColor;
+    ctx.lineWidth = currentBrushSize;
+}
+
+function getMousePos(e) {
+    const rect = canvas.getBoundingClientRect();
+    return {
+        x: (e.clientX - rect.left) * (canvas.width / rect.width),
+        y: (e.clientY - rect.top) * (canvas.height / rect.height)
+    };
+}
+
+function getTouchPos(e) {
+    const rect = canvas.getBoundingClientRect();
+    return {
+        x: (e.touches[0].clientX - rect.left) * (canvas.width / rect.width),
+        y: (e.touches[0].clientY - rect.top) * (canvas.height / rect.height)
+    };
+}
+
+function startDrawing(e) {
+    if (!isTeacher) return; // Only teachers can draw
+
+    isDrawing = true;
+    const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
+    startX = pos.x;
+    startY = pos.y;
+    lastX = pos.x;
+    lastY = pos.y;
+
+    if (currentTool === 'pen' || currentTool === 'eraser') {
+        ctx.beginPath();
+        ctx.moveTo(pos.x, pos.y);
+
+        // Start a new stroke; points go out in chunks
+        strokeId = newStrokeId();
+        pendingPoints = [pos.x, pos.y];
+        scheduleStrokeFlush();
+    }
+}
+
+function draw(e) {
+    if (!isDrawing || !isTeacher) return;
+
+    e.preventDefault();
+    const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
+
+    if (currentTool === 'pen' || currentTool === 'eraser') {
+        // Draw locally
+        ctx.strokeStyle = currentTool === 'eraser' ? '#2a2a2a' : currentColor;
+        ctx.lineWidth = currentBrushSize;
+        ctx.lineTo(pos.x, pos.y);
+        ctx.stroke();
+
+        // Queue the point for the next chunk
+        pendingPoints.push(pos.x, pos.y);
+        scheduleStrokeFlush();
+
+        lastX = pos.x;
+        lastY = pos.y;
+    }
+}
+
+function stopDrawing(e) {
+    if (!isDrawing || !isTeacher) return;
+
+    isDrawing = false;
+    flushStroke(true);
+
+    if (currentTool === 'line' || currentTool === 'rect' || currentTool === 'circle') {
+        const pos = e.type.includes('touch') ? getTouchPos(e) : getMousePos(e);
+        drawShape(currentTool, startX, startY, pos.x, pos.y);
+    }
+}
+
+function scheduleStrokeFlush() {
+    if (strokeFlushTimer === null) {
+        strokeFlushTimer = setTimeout(flushStroke, STROKE_FLUSH_MS);
+    }
+}
+
+// Send the points gathered since the last flush as one stroke chunk;
+// the final chunk is marked so the server can simplify the stroke
+function flushStroke(end = false) {
+    if (strokeFlushTimer !== null) {
+        clearTimeout(strokeFlushTimer);
+        strokeFlushTimer = null;
+    }
+    if (pendingPoints.length > 0 || (end && strokeId !== null)) {
+        sendStrokeChunk({
+            stroke: strokeId,
+            tool: currentTool,
+            color: currentTool === 'eraser' ? '#2a2a2a' : currentColor,
+            size: currentBrushSize,
+            points: pendingPoints
+        }, end);
+        pendingPoints = [];
+    }
+    if (end) {
+        strokeId = null;
+    }
+}
+
+function newStrokeId() {
+    nextStrokeId = (nextStrokeId + 1) >>> 0;
+    return nextStrokeId;
+}
+
+// Send a stroke chunk as binary: a 16-byte header and int16 quarter-pixel coordinates
+function sendStrokeChunk(chunk, end = false) {
+    const points = chunk.points;
+    const buffer = new ArrayBuffer(WB_HEADER_BYTES + points.length * 2);
+    const view = new DataView(buffer);
+    const rgb = parseInt(chunk.color.slice(1), 16) || 0;
+    view.setUint8(0, 1);  // version
+    view.setUint8(1, end ? 1 : 0);
+    view.setUint8(2, Math.max(WB_TOOLS.indexOf(chunk.tool), 0));
+    view.setUint8(3, Math.min(chunk.size, 255));
+    view.setUint8(4, (rgb >> 16) & 255);
+    view.setUint8(5, (rgb >> 8) & 255);
+    view.setUint8(6, rgb & 255);
+    view.setUint32(8, chunk.stroke, true);
+    for (let i = 0; i < points.length; i++) {
+        const q = Math.round(points[i] * WB_COORD_SCALE);
+        view.setInt16(WB_HEADER_BYTES + i * 2, Math.max(-32768, Math.min(32767, q)), true);
+    }
+    socket.emit('whiteboard_bin', buffer);
+}
+
+function decodeStrokeChunk(buffer) {
+    const view = new DataView(buffer);
+    const points = [];
+    for (let offset = WB_HEADER_BYTES; offset < buffer.byteLength; offset += 2) {
+        points.push(view.getInt16(offset, true) / WB_COORD_SCALE);
+    }
+    const rgb = (view.getUint8(4) << 16) | (view.getUint8(5) << 8) | view.getUint8(6);
+    return {
+        stroke: view.getUint32(8, true),
+        tool: WB_TOOLS[view.getUint8(2)],
+        color: '#' + rgb.toString(16).padStart(6, '0'),
+        size: view.getUint8(3),
+        points: points,
+        end: (view.getUint8(1) & 1) === 1,
+        seq: view.getUint32(12, true)
+    };
+}
+
+function handleTouch(e) {
+    e.preventDefault();
+
+    const touch = e.touches[0];
+    const mouseEvent = new MouseEvent(
+        e.type === 'touchstart' ? 'mousedown' : 
+        e.type === 'touchmove' ? 'mousemove' : 'mouseup', {
+        clientX: touch.clientX,
+        clientY: touch.clientY,
+        bubbles: true
+    });
+
+    canvas.dispatchEvent(mouseEvent);
+}
+
+function drawOnCanvas(data) {
+    if (data.points) {
+        drawStroke(data);
+        return;
+    }
+    ctx.strokeStyle = data.color;
+    ctx.lineWidth = data.size;
+    ctx.lineCap = 'round';
+    ctx.lineJoin = 'round';
+
+    switch (data.tool) {
+        case 'pen':
+        case 'eraser':
+            if (data.type === 'start') {
+                ctx.beginPath();
+                ctx.moveTo(data.startX, data.startY);
+            } else {
+                ctx.lineTo(data.endX, data.endY);
+                ctx.stroke();
+            }
+            break;
+        case 'line':
+            drawLine(data.startX, data.startY, data.endX, data.endY);
+            break;
+        case 'rect':
+            drawRectangle(data.startX, data.startY, data.endX, data.endY);
+            break;
+        case 'circle':
+            drawCircle(data.startX, data.startY, data.endX, data.endY);
+            break;
+    }
+}
+
+// Draw a stroke chunk or stored stroke: a pen path or a two-point shape
+function drawStroke(stroke) {
+    const p = stroke.points;
+    ctx.strokeStyle = stroke.color;
+    ctx.lineWidth = stroke.size;
+    ctx.lineCap = 'round';
+    ctx.lineJoin = 'round';
+
+    switch (stroke.tool) {
+        case 'pen':
+        case 'eraser': {
+            ctx.beginPath();
+            // A later chunk of the same stroke continues from where the last one ended
+            const joins = stroke.stroke && stroke.stroke === remoteStrokeId;
+            if (joins) {
+                ctx.moveTo(remoteStrokeEnd[0], remoteStrokeEnd[1]);
+            } else {
+                ctx.moveTo(p[0], p[1]);
+            }
+            for (let i = joins ? 0 : 2; i < p.length; i += 2) {
+                ctx.lineTo(p[i], p[i + 1]);
+            }
+            ctx.stroke();
+            remoteStrokeId = stroke.stroke;
+            remoteStrokeEnd = [p[p.length - 2], p[p.length - 1]];
+            break;
+        }
+        case 'line':
+            drawLine(p[0], p[1], p[2], p[3]);
+            break;
+        case 'rect':
+            drawRectangle(p[0], p[1], p[2], p[3]);
+            break;
+        case 'circle':
+            drawCircle(p[0], p[1], p[2], p[3]);
+            break;
+    }
+}
+
+function setTool(tool) {
+    currentTool = tool;
+
+    // Remove active class from all tools
+    document.querySelectorAll('.toolbar .btn').forEach(btn => {
+        btn.classList.remove('tool-active');
+    });
+
+    // Add active class to selected tool
+    const toolMap = {
+        'pen': 'penTool',
+        'eraser': 'eraserTool',
+        'line': 'lineTool',
+        'rect': 'rectTool',
+        'circle': 'circleTool'
+    };
+
+    if (toolMap[tool]) {
+        document.getElementById(toolMap[tool]).classList.add('tool-active');
+    }
+
+    // Update cursor
+    canvas.style.cursor = tool === 'eraser' ? 'crosshair' : 'crosshair';
+}
+
+function setColor(color) {
+    currentColor = color;
+}
+
+function setBrushSize(size) {
+    currentBrushSize = parseInt(size);
+    document.getElementById('brushSizeDisplay').textContent = size + 'px';
+}
+
+function clearBoard() {
+    if (!isTeacher) return;
+
+    if (confirm('Are you sure you want to clear the whiteboard?')) {
+        clearCanvas();
+        socket.emit('whiteboard_clear');
+    }
+}
+
+function clearCanvas() {
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    remoteStrokeId = null;
+}
+
+function drawLine(x1, y1, x2, y2) {
+    ctx.beginPath();
+    ctx.moveTo(x1, y1);
+    ctx.lineTo(x2, y2);
+    ctx.stroke();
+}
+
+function drawRectangle(x1, y1, x2, y2) {
+    const width = x2 - x1;
+    const height = y2 - y1;
+    ctx.beginPath();
+    ctx.rect(x1, y1, width, height);
+    ctx.stroke();
+}
+
+function drawCircle(x1, y1, x2, y2) {
+    const radius = Math.sqrt(Math.pow(x2 - x1, 2) + Math.pow(y2 - y1, 2));
+    ctx.beginPath();
+    ctx.arc(x1, y1, radius, 0, 2 * Math.PI);
+    ctx.stroke();
+}
+
+function drawShape(tool, x1, y1, x2, y2) {
+    ctx.strokeStyle = currentColor;
+    ctx.lineWidth = currentBrushSize;
+
+    const drawData = {
+        stroke: newStrokeId(),
+        tool: tool,
+        color: currentColor,
+        size: currentBrushSize,
+        points: [x1, y1, x2, y2]
+    };
+
+    switch (tool) {
+        case 'line':
+            drawLine(x1, y1, x2, y2);
+            break;
+        case 'rect':
+            drawRectangle(x1, y1, x2, y2);
+            break;
+        case 'circle':
+            drawCircle(x1, y1, x2, y2);
+            break;
+    }
+
+    sendStrokeChunk(drawData, true);
+}
+
+// Utility functions
+function generateUniqueId() {
+    return Math.random().toString(36).substr(2, 9) + Date.now().toString(36);
+}
+
+function givePermissionToSpeak(userId) {
+    socket.emit('give_permission', { user_id: userId });
+}
+
+// Handle disconnection
+window.addEventListener('beforeunload', function() {
+    if (localStream) {
+        localStream.getTracks().forEach(track => track.stop());
+    }
+    if (socket) {
+        socket.emit('user_leave');
+    }
+});
+
+// Auto-resize canvas when window resizes
+let resizeTimeout;
+window.addEventListener('resize', function() {
+    clearTimeout(resizeTimeout);
+    resizeTimeout = setTimeout(resizeCanvas, 100);
+});
@@ -0,0 +1,204 @@
+"""Local stand-in for Redis in cluster mode: python tools/broker.py [port]
+
+Run one next to the workers on a single box and point them at it with
+MESSAGE_QUEUE=redis://127.0.0.1:<port>/0."""
+import socketserver
+import sys
+import threading
+import time
+
+def encode_resp(value, protocol=2):
+    """Redis protocol encoding: str is a status reply, bytes a bulk string, list an
+    array, tuple a pub/sub push and dict a map; RESP3 has its own types for the last two"""
+    if value is None:
+        return b'_\r\n' if protocol == 3 else b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode()
+    if isinstance(value, Exception):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, dict):
+        items = [item for pair in value.items() for item in pair]
+        if protocol == 3:
+            return b'%%%d\r\n' % len(value) + b''.join(encode_resp(item, protocol) for item in items)
+        value = items
+    kind = b'>' if protocol == 3 and isinstance(value, tuple) else b'*'
+    return kind + b'%d\r\n' % len(value) + b''.join(encode_resp(item, protocol) for item in value)
+
+class BrokerConnection(socketserver.StreamRequestHandler):
+    """One client of the broker: commands in, replies and published messages out"""
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()  # Publishers write to subscribers from their own threads
+        self.channels = set()
+        self.protocol = 2
+        self.watched = {}  # key -> version when WATCHed
+        self.queued = None  # Commands after MULTI, until EXEC
+
+    def send(self, reply):
+        with self.write_lock:
+            self.wfile.write(encode_resp(reply, self.protocol))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()  # Inline command, as typed into telnet
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self.read_command()
+                if args is None:
+                    break
+                if args:
+                    for reply in self.server.execute(self, args):
+                        self.send(reply)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.server.unsubscribe(self, list(self.channels))
+
+class Broker(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Stand-in for Redis on one box: pub/sub, GET/SET/DEL/EXPIRE and WATCH/MULTI/EXEC, enough for cluster mode"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=6379, host='127.0.0.1'):
+        super().__init__((host, port), BrokerConnection)
+        self.lock = threading.RLock()  # EXEC runs its queued commands while holding it
+        self.values = {}  # key -> (value, expiry time or None)
+        self.versions = {}  # key -> self.version when it last changed, for WATCH
+        self.version = 0
+        self.subscribers = {}  # channel -> connections
+
+    def _touch(self, key):
+        self.version += 1
+        self.versions[key] = self.version
+
+    def _get(self, key):
+        value, expiry = self.values.get(key, (None, None))
+        if expiry is not None and time.monotonic() >= expiry:
+            del self.values[key]
+            self._touch(key)
+            return None
+        return value
+
+    def unsubscribe(self, conn, channels):
+        """Drop a connection's subscriptions; returns the unsubscribe replies"""
+        replies = []
+        with self.lock:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(conn)
+                conn.channels.discard(channel)
+                replies.append((b'unsubscribe', channel, len(conn.channels)))
+        return replies
+
+    def execute(self, conn, args):
+        """Run one command; returns the replies to send, in order"""
+        command = args[0].upper()
+        if conn.queued is not None and command not in (b'EXEC', b'DISCARD', b'MULTI', b'WATCH'):
+            conn.queued.append(args)
+            return ['QUEUED']
+        if command == b'MULTI':
+            conn.queued = []
+            return ['OK']
+        if command == b'EXEC':
+            queued, conn.queued = conn.queued, None
+            watched, conn.watched = conn.watched, {}
+            if queued is None:
+                return [Exception("EXEC without MULTI")]
+            with self.lock:
+                for key in watched:
+                    self._get(key)  # Expiry counts as a change
+                if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                    return [None]  # Aborted
+                return [[reply for queued_args in queued for reply in self.execute(conn, queued_args)]]
+        if command in (b'DISCARD', b'UNWATCH'):
+            if command == b'DISCARD':
+                conn.queued = None
+            conn.watched = {}
+            return ['OK']
+        if command == b'WATCH':
+            with self.lock:
+                for key in args[1:]:
+                    self._get(key)
+                    conn.watched[key] = self.versions.get(key, 0)
+            return ['OK']
+        if command == b'PUBLISH':
+            with self.lock:
+                targets = list(self.subscribers.get(args[1], ()))
+            for target in targets:
+                try:
+                    target.send((b'message', args[1], args[2]))
+                except OSError:
+                    pass
+            return [len(targets)]
+        if command == b'SUBSCRIBE':
+            replies = []
+            with self.lock:
+                for channel in args[1:]:
+                    self.subscribers.setdefault(channel, set()).add(conn)
+                    conn.channels.add(channel)
+                    replies.append((b'subscribe', channel, len(conn.channels)))
+            return replies
+        if command == b'UNSUBSCRIBE':
+            return self.unsubscribe(conn, args[1:] or list(conn.channels)) or [(b'unsubscribe', None, 0)]
+        if command == b'SET':
+            options = [arg.upper() for arg in args[3:]]
+            expiry = None
+            if b'EX' in options:
+                expiry = time.monotonic() + int(args[4 + options.index(b'EX')])
+            with self.lock:
+                exists = self._get(args[1]) is not None
+                if (b'NX' in options and exists) or (b'XX' in options and not exists):
+                    return [None]
+                self.values[args[1]] = (args[2], expiry)
+                self._touch(args[1])
+            return ['OK']
+        if command == b'GET':
+            with self.lock:
+                return [self._get(args[1])]
+        if command == b'DEL':
+            with self.lock:
+                deleted = 0
+                for key in args[1:]:
+                    if self._get(key) is not None:
+                        del self.values[key]
+                        self._touch(key)
+                        deleted += 1
+                return [deleted]
+        if command == b'EXPIRE':
+            with self.lock:
+                value = self._get(args[1])
+                if value is None:
+                    return [0]
+                self.values[args[1]] = (value, time.monotonic() + int(args[2]))
+                self._touch(args[1])
+                return [1]
+        if command == b'PING':
+            return ['PONG']
+        if command == b'HELLO':
+            if len(args) > 1:
+                conn.protocol = int(args[1])
+            return [{b'server': b'edugrh-broker', b'version': b'7.0.0', b'proto': conn.protocol,
+                     b'mode': b'standalone', b'role': b'master', b'modules': []}]
+        if command in (b'CLIENT', b'SELECT', b'AUTH'):
+            return ['OK']
+        return [Exception(f"unknown command '{args[0].decode(errors='replace')}'")]
+
+if __name__ == '__main__':
+    broker_port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    print(f"Broker listening on 127.0.0.1:{broker_port}")
+    Broker(broker_port).serve_forever()
@@ -0,0 +1,216 @@
+"""Multi-process check: python tools/cluster_check.py [workers]
+
+Starts tools/broker.py and that many edu.py workers on one box, then drives
+a lecture whose users are spread over all of them."""
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class PollingClient:
+    """Just enough of a Socket.IO client, over HTTP long-polling, to drive cluster_check()"""
+
+    def __init__(self, port):
+        self.port = port
+        self.events = []
+        self.stalled = False
+        self.lock = threading.Lock()
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.conn.request('GET', '/socket.io/?EIO=4&transport=polling')
+        self.sid = json.loads(self.conn.getresponse().read().decode()[1:])['sid']
+        self.path = f"/socket.io/?EIO=4&transport=polling&sid={self.sid}"
+        self.send('40')
+        threading.Thread(target=self.poll, daemon=True).start()
+
+    def send(self, packet):
+        # The long-poll holds the main connection, so posts use their own
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        conn.request('POST', self.path, body=packet.encode())
+        conn.getresponse().read()
+        conn.close()
+
+    def emit(self, event, data=None):
+        self.send('42' + json.dumps([event] if data is None else [event, data]))
+
+    def poll(self):
+        while not self.stalled:
+            try:
+                self.conn.request('GET', self.path)
+                payload = self.conn.getresponse().read().decode()
+            except (OSError, http.client.HTTPException):
+                return
+            for packet in payload.split('\x1e'):
+                if packet == '2':
+                    self.send('3')
+                elif packet.startswith('42'):
+                    event, *args = json.loads(packet[2:])
+                    with self.lock:
+                        self.events.append((event, args[0] if args else None))
+                elif packet == '1':
+                    return
+
+    def wait_for(self, event, test=lambda data: True, timeout=10):
+        """Whether a matching event arrives within timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if any(name == event and test(data) for name, data in self.events):
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stall(self):
+        """Stop reading, like a client on a link that has gone bad"""
+        self.stalled = True
+
+    def close(self):
+        try:
+            self.send('1')
+        except (OSError, http.client.HTTPException):
+            pass
+
+def cluster_check(workers=4):
+    """Run workers processes on one box around the broker and check a lecture spanning all of them"""
+    workers = max(workers, 2)
+    broker_port, base_port = 6390, 5800
+    checks = []
+
+    def check(name, ok):
+        checks.append(ok)
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, broker = os.path.join(ROOT, 'edu.py'), os.path.join(ROOT, 'tools', 'broker.py')
+        env = dict(os.environ, MESSAGE_QUEUE=f"redis://127.0.0.1:{broker_port}/0",
+                   SEND_QUEUE_MAX_MESSAGES='100', SLOW_CLIENT_SECONDS='2')
+        env.pop('PORT', None)
+        broker_env = dict(os.environ)
+        broker_env.pop('MESSAGE_QUEUE', None)
+        procs = [subprocess.Popen([sys.executable, broker, str(broker_port)], cwd=tmp, env=broker_env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+        clients = []
+        try:
+            time.sleep(0.5)
+            for n in range(workers):
+                procs.append(subprocess.Popen(
+                    [sys.executable, server], cwd=tmp,
+                    env=dict(env, PORT=str(base_port + n), WORKER_ID=f"w{n}"),
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            for n in range(workers):
+                for _ in range(100):
+                    try:
+                        probe = http.client.HTTPConnection('127.0.0.1', base_port + n, timeout=1)
+                        probe.request('GET', '/health')
+                        probe.getresponse().read()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+
+            def stats(n):
+                probe = http.client.HTTPConnection('127.0.0.1', base_port + n, timeout=5)
+                probe.request('GET', '/api/stats')
+                return json.loads(probe.getresponse().read())
+
+            def eventually(test, timeout=10):
+                deadline = time.monotonic() + timeout
+                while time.monotonic() < deadline:
+                    if test():
+                        return True
+                    time.sleep(0.1)
+                return False
+
+            def join(n, name, role, room='cluster'):
+                client = PollingClient(base_port + n % workers)
+                client.emit('user_join', {'fullName': name, 'username': name, 'phoneNumber': '0',
+                                          'role': role, 'room': room})
+                clients.append(client)
+                return client
+
+            # The teacher's worker owns the room; a student on every other worker
+            teacher = join(0, 'teacher', 'teacher')
+            teacher.wait_for('presence_snapshot')
+            students = [join(n, f"student{n}", 'student') for n in range(1, workers)]
+            everyone = [teacher] + students
+            check("every user joins",
+                  all(client.wait_for('presence_snapshot') for client in everyone))
+
+            students[-1].emit('presence_resync')
+            check(f"presence lists all {workers} users across workers", students[-1].wait_for(
+                'presence_snapshot', lambda data: len(data['users']) == workers))
+
+            teacher.emit('toggle_lecture')
+            check("lecture start reaches every worker", all(
+                client.wait_for('lecture_status', lambda data: data['active']) for client in students))
+
+            teacher.emit('whiteboard_draw', {'stroke': 'c1', 'tool': 'pen', 'color': '#ffffff', 'size': 3,
+                                             'points': [10, 10, 20, 20, 30, 10], 'end': True})
+            check("whiteboard strokes reach every worker",
+                  all(client.wait_for('whiteboard_update') for client in students))
+
+            students[0].emit('send_chat', {'message': 'hello from another worker'})
+            check("chat from a forwarded connection reaches everyone",
+                  all(client.wait_for('chat_message') for client in everyone))
+
+            students[-1].emit('toggle_hand', {'raised': True})
+            check("raised hand reaches the teacher", teacher.wait_for(
+                'room_update', lambda data: bool(data.get('raised_hands'))))
+            teacher.emit('give_permission', {})
+            check("permission reaches the student on another worker",
+                  students[-1].wait_for('speaking_permission_granted'))
+
+            late = join(workers + 1, 'latecomer', 'student')
+            check("late joiner gets the whiteboard history", late.wait_for(
+                'whiteboard_page', lambda data: 'c1' in data['strokes']))
+
+            # A client that stops reading on another worker is skipped by the owner, then dropped
+            stalled = join(1, 'stalled', 'student')
+            stalled.wait_for('presence_snapshot')
+            stalled.stall()
+            for n in range(150):
+                teacher.emit('whiteboard_draw', {'stroke': f"s{n}", 'tool': 'pen', 'color': '#ffffff',
+                                                 'size': 3, 'points': [n, 10, n, 20], 'end': True})
+            check("the owner skips a congested client held by another worker",
+                  eventually(lambda: stats(0)['send_queues']['congested'] == 1))
+            check("the worker holding a slow client disconnects it",
+                  eventually(lambda: stats(1)['send_queues']['disconnected'] == 1)
+                  and eventually(lambda: stats(0)['send_queues']['congested'] == 0))
+
+            # A second lecture is owned by whichever worker its first user came through
+            other = join(workers - 1, 'teacher2', 'teacher', room='cluster2')
+            listener = join(1, 'student2', 'student', room='cluster2')
+            other.emit('send_chat', {'message': 'second room'})
+            second = lambda data: data['message'] == 'second room'
+            check("a second room works alongside",
+                  listener.wait_for('chat_message', second) and not teacher.wait_for('chat_message', second, 0.5))
+
+            # Joining again moves a user out of a room another worker owns
+            with other.lock:
+                other.events.clear()
+            listener.emit('user_join', {'fullName': 'student2', 'username': 'student2', 'phoneNumber': '0',
+                                        'role': 'student', 'room': 'cluster'})
+            listener.wait_for('presence_snapshot', lambda data: len(data['users']) == workers + 2)
+            other.emit('presence_resync')
+            check("joining another room leaves the first",
+                  other.wait_for('presence_snapshot', lambda data: len(data['users']) == 1))
+
+            owners = [set(stats(n)['rooms']) for n in range(workers)]
+            check("each room is held by exactly one worker",
+                  [n for n, held in enumerate(owners) if 'cluster' in held] == [0]
+                  and [n for n, held in enumerate(owners) if 'cluster2' in held] == [workers - 1])
+        finally:
+            for client in clients:
+                client.close()
+            for proc in procs:
+                proc.terminate()
+                proc.wait()
+    print(f"{sum(checks)}/{len(checks)} checks passed with {workers} workers")
+    return all(checks)
+
+if __name__ == '__main__':
+    sys.exit(0 if cluster_check(int(sys.argv[1]) if len(sys.argv) > 1 else 4) else 1)
@@ -0,0 +1,107 @@
+"""Whiteboard compaction check: python tools/compaction_check.py [seed] [boards]
+
+Draws random boards of pens, erasers and shapes, renders each before and
+after StrokeStore.compact() the way the canvas in static/app.js draws them,
+and counts the pixels that differ. Needs numpy."""
+import json
+import math
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import WHITEBOARD_BACKGROUND, StrokeStore
+
+WIDTH, HEIGHT = 240, 160
+COLORS = ('#ffffff', '#ff0000', '#00ff00')
+
+# Pixel centres
+ys, xs = np.mgrid[0:HEIGHT, 0:WIDTH] + 0.5
+
+def ink(stroke):
+    """The pixels a stroke covers: round caps and joins, like the canvas"""
+    tool, _, size = stroke.style
+    half = float(size) / 2
+    p = stroke.points
+    if tool == 'circle':
+        radius = math.hypot(p[2] - p[0], p[3] - p[1])
+        return np.abs(np.hypot(xs - p[0], ys - p[1]) - radius) <= half
+    if tool == 'line':
+        segments = [tuple(p[:4])]
+    elif tool == 'rect':
+        x1, y1, x2, y2 = p[:4]
+        segments = [(x1, y1, x2, y1), (x2, y1, x2, y2), (x2, y2, x1, y2), (x1, y2, x1, y1)]
+    else:
+        # A lone moveTo draws nothing, and neither does a zero-length lineTo
+        segments = [(p[i], p[i + 1], p[i + 2], p[i + 3]) for i in range(0, len(p) - 2, 2)
+                    if (p[i], p[i + 1]) != (p[i + 2], p[i + 3])]
+    covered = np.zeros((HEIGHT, WIDTH), bool)
+    for x1, y1, x2, y2 in segments:
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        t = np.clip(((xs - x1) * dx + (ys - y1) * dy) / length, 0, 1) if length else 0
+        covered |= np.hypot(xs - x1 - t * dx, ys - y1 - t * dy) <= half
+    return covered
+
+def render(store):
+    """The board as one colour index per pixel, -1 for the background"""
+    image = np.full((HEIGHT, WIDTH), -1)
+    for stroke in store._strokes:
+        color = stroke.style[1]
+        image[ink(stroke)] = -1 if color == WHITEBOARD_BACKGROUND else COLORS.index(color)
+    return image
+
+def random_board(rng, store):
+    """Draw 5-40 random strokes, compacting now and then; returns the pixels compaction changed"""
+    changed = 0
+    for n in range(rng.randint(5, 40)):
+        tool = rng.choice(['pen', 'pen', 'eraser', 'eraser', 'line', 'rect', 'circle'])
+        if tool == 'eraser':
+            color, size = WHITEBOARD_BACKGROUND, rng.choice([10, 20, 20])
+        else:
+            color, size = rng.choice(COLORS), rng.choice([2, 3, 5, 10, 20])
+        x, y = rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT)
+        if tool in ('line', 'rect', 'circle'):
+            points = [x, y, x + rng.uniform(-60, 60), y + rng.uniform(-60, 60)]
+        else:
+            points = [x, y]
+            heading = rng.uniform(0, 2 * math.pi)
+            for _ in range(rng.randint(0, 40)):
+                heading += rng.uniform(-0.4, 0.4)
+                x += 4 * math.cos(heading)
+                y += 4 * math.sin(heading)
+                points += [x, y]
+        store.append({'stroke': n, 'tool': tool, 'color': color, 'size': size, 'points': points, 'end': True})
+        if rng.random() < 0.3:
+            before = render(store)
+            store.compact()
+            changed += int((before != render(store)).sum())
+    before = render(store)
+    store.compact()
+    return changed + int((before != render(store)).sum())
+
+def compaction_check(seed=0, boards=60):
+    """Check that compaction never changes what a board shows, nor leaves the store inconsistent"""
+    rng = random.Random(seed)
+    changed = held = hidden = broken = 0
+    for _ in range(boards):
+        store = StrokeStore(simplify_px=0.75)
+        changed += random_board(rng, store)
+        held += len(store) + store.hidden
+        hidden += store.hidden
+        parts = [part for _, part in store._checkpoint_parts]
+        records = [json.dumps(stroke.record(), separators=(',', ':'))
+                   for stroke in store._strokes if stroke is not store._current]
+        if store.points != sum(len(stroke) for stroke in store._strokes) or parts != records:
+            broken += 1
+    print(f"{boards} boards (seed {seed}): {changed} pixels changed, {broken} inconsistent stores, "
+          f"{hidden} of {held} strokes dropped as hidden")
+    return not changed and not broken
+
+if __name__ == '__main__':
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    boards = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    sys.exit(0 if compaction_check(seed, boards) else 1)
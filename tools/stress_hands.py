@@ -0,0 +1,68 @@
+"""Concurrency check for the hand queue: python tools/stress_hands.py [threads]"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from edu import Room
+
+def stress_test_hands(threads=300, iterations=200):
+    """Hammer one room's hand queue from many threads and check its invariants.
+
+    The threads start together and the interpreter switches between them
+    every few microseconds, so their operations really interleave."""
+    room = Room('stress')
+    room.add_user({'id': 'teacher', 'fullName': 'Teacher', 'role': 'teacher',
+                   'hand_raised': False, 'speaking_permission': False})
+    errors = []
+    ready = threading.Barrier(threads)
+
+    def student(n):
+        user_id = f"student{n}"
+        try:
+            ready.wait()
+            for _ in range(iterations):
+                action = random.random()
+                if user_id not in room.active_users:
+                    room.add_user({'id': user_id, 'fullName': user_id, 'role': 'student',
+                                   'hand_raised': False, 'speaking_permission': False})
+                elif action < 0.45:
+                    room.set_hand(user_id, True)
+                elif action < 0.9:
+                    room.set_hand(user_id, False)
+                elif action < 0.93:
+                    room.grant_permission('teacher', user_id)
+                elif action < 0.95:
+                    room.grant_permission('teacher')
+                else:
+                    room.remove_user(user_id)
+                if random.random() < 0.05:
+                    room.check_invariants()
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=student, args=(n,)) for n in range(threads)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.setswitchinterval(switch_interval)
+    room.check_invariants()
+    print(f"{threads} threads x {iterations} ops in {elapsed:.2f}s, "
+          f"{len(room.active_users)} users, {len(room.raised_hands)} hands, {len(errors)} errors")
+    for e in errors[:5]:
+        print(f"  {type(e).__name__}: {e}")
+    return not errors
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    sys.exit(0 if stress_test_hands(threads) else 1)